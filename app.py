@@ -1,13 +1,10 @@
-from flask import Flask, render_template, request, jsonify, current_app, make_response
+from flask import Flask, render_template, request, jsonify, current_app, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from geoalchemy2 import Geometry
 import requests
 import json
-from datetime import datetime
 import xml.etree.ElementTree as ET
-from pyproj import Transformer
-import re
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -38,13 +35,53 @@ def create_app(config_class=Config):
     
     if not app.debug:
         app.logger.addHandler(file_handler)
+        # Moduły geouploadera (np. konwersja COG w tle) logują przez własny logger.
+        logging.getLogger('geouploader').addHandler(file_handler)
     
     app.logger.setLevel(logging.INFO)
+    logging.getLogger('geouploader').setLevel(logging.INFO)
     app.logger.info('Aplikacja portfolio została uruchomiona')
 
     # --- Rejestracja komponentów (Blueprints) ---
     from geouploader import geouploader_bp
     app.register_blueprint(geouploader_bp, url_prefix='/geouploader')
+
+    from geoapi import geoapi_bp
+    app.register_blueprint(geoapi_bp, url_prefix='/api')
+
+    from geouploader.clients import clients, get_geoserver_session, get_s3_client
+    clients.init_app(app)
+
+    from geouploader.layer_cache import layer_cache
+    from geouploader.layer_info import layer_info_cache
+    from geouploader.exceptions.custom_exceptions import LayerNotFoundError
+    from geouploader.crs import transformer_cache_info
+    from geouploader.search import search_index, search, parse_query_geometry, parse_datetime, SEARCH_TYPES
+    from geouploader.exceptions.custom_exceptions import ValidationError
+    search_index.init_app(app)
+
+    from geouploader.s3 import listing_snapshot, list_objects_page, iter_objects
+    from geouploader.dedup import dedup_stats
+    from geouploader.tile_cache import tile_cache
+    tile_cache.init_app(app)
+    from geouploader.wms_proxy import wms_proxy, normalise_params, UpstreamError
+    wms_proxy.init_app(app)
+    from geoapi.sampling import block_cache
+    block_cache.init_app(app)
+    listing_snapshot.init_app(app)
+    layer_cache.init_app(app)
+    layer_info_cache.init_app(app)
+
+    from geouploader.metrics import metrics, cache_collector
+    metrics.init_app(app)
+    metrics.register_collector(cache_collector({
+        'layer_catalog': layer_cache.stats,
+        'layer_info': layer_info_cache.stats,
+        's3_listing': listing_snapshot.stats,
+        'tiles': tile_cache.stats,
+        'wms_proxy': wms_proxy.stats,
+        'sample_blocks': block_cache.stats
+    }))
     
     # --- Główna strona aplikacji (portfolio) ---
     @app.route('/')
@@ -55,6 +92,10 @@ def create_app(config_class=Config):
     def projects():
         return render_template('projects.html')
 
+    @app.route('/draw')
+    def draw():
+        return render_template('draw.html')
+
     @app.route('/wms-viewer')
     def wms_viewer():
         return render_template('wms_viewer.html')
@@ -62,31 +103,10 @@ def create_app(config_class=Config):
     @app.route('/api/layers')
     def get_wms_layers():
         try:
-            config = current_app.config
-            geoserver_rest_url = config['GEOSERVER_URL']
-            geoserver_workspace = config['GEOSERVER_WORKSPACE']
-            auth = (config['GEOSERVER_USER'], config['GEOSERVER_PASSWORD'])
-
-            layers_url = f"{geoserver_rest_url}/workspaces/{geoserver_workspace}/layers.json"
-            
-            current_app.logger.info(f"Pobieranie listy warstw z: {layers_url}")
-            
-            response = requests.get(layers_url, auth=auth)
-            response.raise_for_status()
-            
-            layers_data = response.json()
-            layers = []
-            
-            if 'layers' in layers_data and 'layer' in layers_data['layers']:
-                layer_list = layers_data['layers']['layer']
-                if isinstance(layer_list, dict):
-                    layer_list = [layer_list]
-                    
-                for layer_info in layer_list:
-                    layers.append({
-                        'name': layer_info['name'],
-                        'title': layer_info.get('name', layer_info['name'])
-                    })
+            layers = [
+                {'name': layer_info['name'], 'title': layer_info['name']}
+                for layer_info in layer_cache.get_layers()
+            ]
             
             current_app.logger.info(f"Znaleziono {len(layers)} warstw")
             return jsonify({'layers': layers})
@@ -98,139 +118,69 @@ def create_app(config_class=Config):
             current_app.logger.error(f"Błąd podczas pobierania warstw: {e}", exc_info=True)
             return jsonify({'error': 'Błąd serwera podczas pobierania warstw'}), 500
 
-    @app.route('/api/export-coordinates', methods=['POST'])
-    def export_coordinates():
+    @app.route('/wms')
+    def proxy_wms():
+        """
+        Pośrednik WMS skonfigurowanego workspace'u: GetMap z pamięcią kafli i scalaniem
+        identycznych zapytań, GetCapabilities z jednym dokumentem na workspace i wersję WMS.
+        """
+        params = normalise_params(request.args)
+        workspace = current_app.config['GEOSERVER_WORKSPACE']
+        wms_request = params.get('REQUEST', '').lower()
         try:
-            data = request.get_json()
-            if not data or 'coordinates' not in data:
-                return jsonify({'error': 'Brak współrzędnych do eksportu'}), 400
-            
-            coordinates = data['coordinates']
-            if not coordinates:
-                return jsonify({'error': 'Lista współrzędnych jest pusta'}), 400
-            
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            content = f"# Exported Coordinates - {timestamp}\n"
-            content += "# Format: X, Y (EPSG:4326)\n"
-            
-            for coord in coordinates:
-                if 'lng' in coord and 'lat' in coord:
-                    content += f"{coord['lng']}, {coord['lat']}\n"
-                elif 'x' in coord and 'y' in coord:
-                    content += f"{coord['x']}, {coord['y']}\n"
-            
-            response = make_response(content)
-            response.headers['Content-Type'] = 'text/plain'
-            response.headers['Content-Disposition'] = f'attachment; filename=coordinates_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt'
-            
-            current_app.logger.info(f"Eksportowano {len(coordinates)} współrzędnych")
-            return response
-            
+            if wms_request == 'getmap':
+                content, content_type, etag = wms_proxy.get_map(params, workspace)
+                if etag:
+                    return tile_cache.response(content, etag, content_type)
+            elif wms_request == 'getcapabilities':
+                content, content_type, etag = wms_proxy.get_capabilities(workspace, params.get('VERSION'))
+                response = Response(content, content_type=content_type)
+                response.set_etag(etag)
+                response.cache_control.max_age = wms_proxy.capabilities_ttl
+                return response.make_conditional(request)
+            elif wms_request in ('getfeatureinfo', 'getlegendgraphic'):
+                content, content_type, _ = wms_proxy.passthrough(params, workspace)
+            else:
+                return jsonify({'error': f"Nieobsługiwane zapytanie WMS: {params.get('REQUEST')}"}), 400
+            return Response(content, content_type=content_type)
+
+        except UpstreamError as e:
+            return Response(e.body, status=e.status_code, content_type=e.content_type)
+        except requests.exceptions.RequestException as e:
+            current_app.logger.error(f"Błąd połączenia z GeoServer WMS: {e}")
+            return jsonify({'error': 'Błąd połączenia z GeoServer'}), 502
+
+    @app.route('/api/layer-info')
+    def get_layers_info():
+        """Zwraca metadane wielu warstw naraz: ?names=a,b,c albo ?all=1."""
+        try:
+            if request.args.get('all', '').lower() in ['1', 'true']:
+                layer_names = [layer['name'] for layer in layer_cache.get_layers()]
+            else:
+                layer_names = [name.strip() for name in request.args.get('names', '').split(',') if name.strip()]
+            if not layer_names:
+                return jsonify({'error': "Wymagany parametr 'names' lub 'all=1'"}), 400
+
+            layers, errors = layer_info_cache.get_many(layer_names)
+            return jsonify({'layers': layers, 'errors': errors})
+
+        except requests.exceptions.RequestException as e:
+            current_app.logger.error(f"Błąd połączenia z GeoServer: {e}")
+            return jsonify({'error': 'Błąd połączenia z GeoServer'}), 500
         except Exception as e:
-            current_app.logger.error(f"Błąd podczas eksportu współrzędnych: {e}", exc_info=True)
-            return jsonify({'error': 'Błąd serwera podczas eksportu'}), 500
+            current_app.logger.error(f"Błąd podczas pobierania informacji o warstwach: {e}", exc_info=True)
+            return jsonify({'error': 'Błąd serwera podczas pobierania informacji o warstwach'}), 500
 
     @app.route('/api/layer-info/<layer_name>')
     def get_layer_info(layer_name):
         try:
-            config = current_app.config
-            auth = (config['GEOSERVER_USER'], config['GEOSERVER_PASSWORD'])
-            
-            url = f"{config['GEOSERVER_URL']}/workspaces/{config['GEOSERVER_WORKSPACE']}/layers/{layer_name}"
-            
-            current_app.logger.info(f"Pobieranie informacji o warstwie: {url}")
-            
-            response = requests.get(url, auth=auth, headers={'Accept': 'application/json'})
-            
-            if response.status_code == 404:
-                return jsonify({'error': 'Warstwa nie została znaleziona'}), 404
-            elif response.status_code != 200:
-                current_app.logger.error(f"Błąd pobierania informacji o warstwie: {response.status_code} - {response.text}")
-                return jsonify({'error': 'Nie można pobrać informacji o warstwie'}), 500
-            
-            layer_data = response.json()
-            
-            current_app.logger.info(f"Layer data structure: {layer_data}")
-            
-            layer_dict = layer_data.get('layer', {})
-            
-            layer_info = {
-                'name': layer_dict.get('name', layer_name),
-                'title': layer_dict.get('title', layer_name),
-                'abstract': layer_dict.get('abstract', ''),
-                'type': layer_dict.get('type', 'WMS'),
-                'enabled': layer_dict.get('enabled', True),
-                'wms_url': f"{config['GEOSERVER_URL'].replace('/rest', '')}/{config['GEOSERVER_WORKSPACE']}/wms"
-            }
-            
-            if 'resource' in layer_dict:
-                resource_url = layer_dict['resource']['href']
-                resource_response = requests.get(resource_url, auth=auth, headers={'Accept': 'application/json'})
-                
-                if resource_response.status_code == 200:
-                    resource_data = resource_response.json()
-                    
-                    bbox_info = None
-                    source_crs = None
-                    
-                    if 'coverage' in resource_data:
-                        coverage = resource_data['coverage']
-                        if 'nativeBoundingBox' in coverage:
-                            bbox_info = coverage['nativeBoundingBox']
-                            source_crs = bbox_info.get('crs', 'EPSG:4326')
-                    
-                    elif 'featureType' in resource_data:
-                        feature_type = resource_data['featureType']
-                        if 'nativeBoundingBox' in feature_type:
-                            bbox_info = feature_type['nativeBoundingBox']
-                            source_crs = bbox_info.get('crs', 'EPSG:4326')
-                    
-                    if bbox_info:
-                        try:
-                            minx, miny = float(bbox_info['minx']), float(bbox_info['miny'])
-                            maxx, maxy = float(bbox_info['maxx']), float(bbox_info['maxy'])
-                            
-                            layer_info['boundingBox'] = {
-                                'minx': minx,
-                                'miny': miny,
-                                'maxx': maxx,
-                                'maxy': maxy,
-                                'crs': source_crs
-                            }
-                            
-                            try:
-                                if source_crs and source_crs != 'EPSG:3857':
-                                    if 'EPSG' in str(source_crs):
-                                        epsg_match = re.search(r'EPSG["\s]*[,:]?\s*["\s]*(\d+)', str(source_crs))
-                                        if epsg_match:
-                                            epsg_code = f"EPSG:{epsg_match.group(1)}"
-                                            current_app.logger.info(f"Extracted EPSG code: {epsg_code}")
-                                            transformer = Transformer.from_crs(epsg_code, "EPSG:3857", always_xy=True)
-                                            minx_3857, miny_3857 = transformer.transform(minx, miny)
-                                            maxx_3857, maxy_3857 = transformer.transform(maxx, maxy)
-                                        else:
-                                            current_app.logger.warning(f"Could not parse CRS {source_crs}, using original bounds")
-                                            minx_3857, miny_3857 = minx, miny
-                                            maxx_3857, maxy_3857 = maxx, maxy
-                                else: # This means source_crs is 'EPSG:3857' or is not defined/parsed
-                                    minx_3857, miny_3857 = minx, miny
-                                    maxx_3857, maxy_3857 = maxx, maxy
-                                    
-                            except Exception as transform_error:
-                                current_app.logger.warning(f"CRS transformation failed for {source_crs}: {transform_error}")
-                                minx_3857, miny_3857 = minx, miny
-                                maxx_3857, maxy_3857 = maxx, maxy
-                            
-                            if 'minx_3857' in locals():
-                                layer_info['bbox_epsg3857'] = f"{minx_3857},{miny_3857},{maxx_3857},{maxy_3857}"
-                            
-                            current_app.logger.info(f"Layer {layer_name} bounds: {layer_info.get('bbox_epsg3857', 'not available')}")
-                            
-                        except Exception as e:
-                            current_app.logger.error(f"Błąd calculating bounding box for layer {layer_name}: {e}")
-            
-            return jsonify(layer_info)
-            
+            return jsonify(layer_info_cache.get(layer_name))
+
+        except LayerNotFoundError:
+            return jsonify({'error': 'Warstwa nie została znaleziona'}), 404
+        except requests.exceptions.HTTPError as e:
+            current_app.logger.error(f"Błąd pobierania informacji o warstwie: {e}")
+            return jsonify({'error': 'Nie można pobrać informacji o warstwie'}), 500
         except KeyError as e:
             current_app.logger.error(f"KeyError podczas pobierania informacji o warstwie: {e}", exc_info=True)
             return jsonify({'error': f'Brak wymaganego pola w odpowiedzi GeoServer: {e}'}), 500
@@ -241,44 +191,136 @@ def create_app(config_class=Config):
             current_app.logger.error(f"Błąd podczas pobierania informacji o warstwie: {e}", exc_info=True)
             return jsonify({'error': 'Błąd serwera podczas pobierania informacji o warstwie'}), 500
 
+    @app.route('/api/search')
+    def search_footprints():
+        """
+        Wyszukuje warstwy i COG przecinające BBOX lub geometrię (WKT/GeoJSON).
+        Parametry: bbox | geometry, crs, type, name, start, end, limit, offset, cursor.
+        """
+        try:
+            query_geom = parse_query_geometry(request.args.get('bbox'), request.args.get('geometry'),
+                                              request.args.get('crs', 'EPSG:4326'))
+            types = tuple(t for t in request.args.get('type', ','.join(SEARCH_TYPES)).split(',') if t in SEARCH_TYPES)
+            limit = min(max(int(request.args.get('limit', 50)), 1), 1000)
+            offset = max(int(request.args.get('offset', 0)), 0)
+
+            results, next_cursor = search(
+                query_geom,
+                types=types or SEARCH_TYPES,
+                name=request.args.get('name'),
+                start=parse_datetime(request.args.get('start')),
+                end=parse_datetime(request.args.get('end')),
+                limit=limit,
+                offset=offset,
+                cursor=request.args.get('cursor')
+            )
+            return jsonify({'results': results, 'next_cursor': next_cursor})
+
+        except ValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        except ValueError:
+            return jsonify({'error': "Parametry 'limit' i 'offset' muszą być liczbami"}), 400
+        except Exception as e:
+            current_app.logger.error(f"Błąd podczas wyszukiwania: {e}", exc_info=True)
+            return jsonify({'error': 'Błąd serwera podczas wyszukiwania'}), 500
+
+    @app.route('/api/pool-stats')
+    def get_pool_stats():
+        """Statystyki pul połączeń do S3 i GeoServera (do doboru rozmiarów pul)."""
+        return jsonify(clients.stats())
+
+    @app.route('/api/dedup-stats')
+    def get_dedup_stats():
+        """Oszczędności deduplikacji uploadów: liczba ponownych użyć, bajty i sekundy CPU."""
+        return jsonify(dedup_stats())
+
+    @app.route('/api/cache-stats')
+    def get_cache_stats():
+        """Liczniki trafień/chybień pamięci podręcznych aplikacji."""
+        return jsonify({
+            'layer_catalog': layer_cache.stats(),
+            'layer_info': layer_info_cache.stats(),
+            'transformers': transformer_cache_info(),
+            's3_listing': listing_snapshot.stats(),
+            'tiles': tile_cache.stats(),
+            'wms_proxy': wms_proxy.stats(),
+            'sample_blocks': block_cache.stats()
+        })
+
+    @app.route('/metrics')
+    def get_metrics():
+        """Metryki procesu w formacie tekstowym Prometheusa."""
+        if not current_app.config['METRICS_ENABLED']:
+            return jsonify({'error': 'Metryki są wyłączone'}), 404
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
     @app.route('/s3-viewer')
     def s3_viewer():
         return render_template('s3_viewer.html')
 
     @app.route('/api/s3/list')
     def list_s3_objects():
+        """
+        Stronicowany listing obiektów S3 (parametry: prefix, delimiter, token, max_keys).
+        Bez `delimiter` strony pochodzą z odświeżanej w tle migawki listingu;
+        z `delimiter` lub `fresh=1` - bezpośrednio z S3 (przeglądanie "folderów").
+        Token niesie swoje źródło: 's:<ostatni klucz>' dla migawki (kontynuowany
+        z S3 przez StartAfter, gdy migawka jest niedostępna), 'c:<token>' dla
+        tokenu kontynuacji S3.
+        """
         try:
-            s3 = boto3.client(
-                's3',
-                aws_access_key_id=current_app.config['S3_KEY'],
-                aws_secret_access_key=current_app.config['S3_SECRET'],
-                endpoint_url=current_app.config['AWS_ENDPOINT']
-            )
-            
-            bucket_name = current_app.config['S3_BUCKET']
-            prefix = current_app.config.get('AWS_FOLDER', '') # Użyj skonfigurowanego folderu
-            
-            response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-            
-            objects = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    # Pomiń folder główny, jeśli jest listowany
-                    if obj['Key'] == prefix:
-                        continue
-                    objects.append({
-                        'key': obj['Key'],
-                        'size': obj['Size'],
-                        'last_modified': obj['LastModified'].isoformat()
-                    })
+            config = current_app.config
+            base_prefix = config.get('AWS_FOLDER') or '' # Użyj skonfigurowanego folderu
+            prefix = request.args.get('prefix', base_prefix)
+            if not prefix.startswith(base_prefix):
+                return jsonify({'error': 'Prefiks spoza skonfigurowanego folderu'}), 400
+            delimiter = request.args.get('delimiter')
+            token = request.args.get('token') or ''
+            max_keys = min(max(int(request.args.get('max_keys', 1000)), 1), 1000)
+            source, _, token_value = token.partition(':')
+            if token and (source not in ('s', 'c') or not token_value):
+                return jsonify({'error': "Nieprawidłowy parametr 'token'"}), 400
+            start_after = token_value if source == 's' else None
+            continuation_token = token_value if source == 'c' else None
+
+            page = None
+            use_snapshot = not delimiter and request.args.get('fresh', '').lower() not in ['1', 'true']
+            if use_snapshot and not continuation_token:
+                page = listing_snapshot.page(start_after=start_after, max_keys=max_keys, prefix=prefix)
+                if page is not None and page['next_token']:
+                    page['next_token'] = f"s:{page['next_token']}"
+            if page is None:
+                page = list_objects_page(config['S3_BUCKET'], prefix, delimiter, continuation_token, max_keys,
+                                         start_after=start_after)
+                if page['next_token']:
+                    page['next_token'] = f"c:{page['next_token']}"
             
-            return jsonify(objects)
+            return jsonify(page)
             
+        except ValueError:
+            return jsonify({'error': "Parametr 'max_keys' musi być liczbą"}), 400
         except Exception as e:
             current_app.logger.error(f"Błąd podczas listowania obiektów S3: {e}", exc_info=True)
             return jsonify({'error': 'Błąd serwera podczas listowania obiektów S3'}), 500
 
+    @app.route('/api/s3/export')
+    def export_s3_objects():
+        """Strumieniuje pełny listing obiektów S3 jako NDJSON (jeden obiekt w linii)."""
+        config = current_app.config
+        prefix = config.get('AWS_FOLDER') or ''
+
+        def generate():
+            for obj in iter_objects(config['S3_BUCKET'], prefix):
+                yield json.dumps(obj) + "\n"
+
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = 'attachment; filename=s3_objects.ndjson'
+        return response
+
     with app.app_context():
         db.create_all()
 
+    from geouploader.jobs import job_queue
+    job_queue.init_app(app)
+
     return app
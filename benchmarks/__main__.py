@@ -0,0 +1,133 @@
+"""
+Benchmarki potoku rastrowego i najczęściej wywoływanych endpointów API.
+
+    python -m benchmarks                  # pełny zestaw, porównanie z benchmarks/baseline.json
+    python -m benchmarks --quick          # mniejsze rastry (np. w CI), benchmarks/baseline-quick.json
+    python -m benchmarks --only convert   # tylko benchmarki, których nazwa zawiera 'convert'
+    python -m benchmarks --save-baseline  # zapisuje wyniki jako nowy punkt odniesienia
+
+Każdy benchmark działa w osobnym procesie, więc szczytowe RSS dotyczy tylko jego.
+Kod wyjścia 1 oznacza regresję czasu lub pamięci względem punktu odniesienia.
+"""
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import shutil
+import sys
+from datetime import datetime
+
+from .cases import api_available, collect, run_case, temporary_work_dir
+from .synthetic import ensure_rasters
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BENCHMARKS_DIR, 'data')
+
+def run_isolated(name, raster_cases, options):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_case, args=(name, raster_cases, options, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                result = {'error': f"proces zakończył się kodem {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    """Zwraca listę regresji (nazwa, opis) względem `baseline`."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or 'error' in result:
+            continue
+        if result['wall_s'] > reference['wall_s'] * (1 + tolerance):
+            regressions.append((name, f"czas {result['wall_s']:.3f}s > {reference['wall_s']:.3f}s "
+                                      f"(+{result['wall_s'] / reference['wall_s'] - 1:.0%})"))
+        if result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + rss_tolerance):
+            regressions.append((name, f"RSS {result['peak_rss_mb']:.0f} MB > {reference['peak_rss_mb']:.0f} MB"))
+    return regressions
+
+def _format_row(name, result, reference):
+    if 'error' in result:
+        return f"{name:<40} BŁĄD: {result['error']}"
+    change = ''
+    if reference:
+        change = f"{result['wall_s'] / reference['wall_s'] - 1:+7.1%}"
+    return (f"{name:<40} {result['wall_s']:9.3f}s {result['throughput']:11.1f} {result['unit']:<7} "
+            f"{result['peak_rss_mb']:8.0f} MB {change}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true', help='mniejsze rastry testowe')
+    parser.add_argument('--only', action='append', default=[], help='wzorzec nazwy (fnmatch lub fragment)')
+    parser.add_argument('--repeat', type=int, default=3, help='liczba pomiarów (mediana)')
+    parser.add_argument('--baseline', help='plik z punktem odniesienia (domyślnie baseline[-quick].json)')
+    parser.add_argument('--save-baseline', action='store_true', help='zapisz wyniki jako punkt odniesienia')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='dopuszczalny wzrost czasu (0.25 = 25%%)')
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help='dopuszczalny wzrost szczytowego RSS')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='katalog z rastrami testowymi')
+    parser.add_argument('--api-layers', type=int, default=100, help='liczba warstw w zastępniku GeoServera')
+    parser.add_argument('--api-requests', type=int, default=200, help='liczba żądań w jednym pomiarze API')
+    parser.add_argument('--output', help='zapisz wyniki do pliku JSON')
+    args = parser.parse_args(argv)
+    args.baseline = args.baseline or os.path.join(BENCHMARKS_DIR, 'baseline-quick.json' if args.quick else 'baseline.json')
+
+    raster_cases = ensure_rasters(os.path.join(args.data_dir, 'quick' if args.quick else 'full'), args.quick)
+    names = list(collect(raster_cases))
+    if args.only:
+        names = [name for name in names
+                 if any(fnmatch.fnmatch(name, pattern) or pattern in name for pattern in args.only)]
+    if not api_available():
+        skipped = [name for name in names if name.startswith('api/')]
+        names = [name for name in names if not name.startswith('api/')]
+        if skipped:
+            print(f"Pominięto {len(skipped)} benchmarków API - ustaw BENCH_DATABASE_URL (osobna baza PostGIS).")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    elif not args.save_baseline:
+        print(f"Brak punktu odniesienia {args.baseline} - uruchom z --save-baseline.")
+
+    work_dir = temporary_work_dir()
+    options = {'repeat': args.repeat, 'work_dir': work_dir,
+               'api_layers': args.api_layers, 'api_requests': args.api_requests}
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_isolated(name, raster_cases, options)
+            print(_format_row(name, results[name], baseline.get(name)), flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    meta = {'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'quick': args.quick}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            succeeded = {name: result for name, result in results.items() if 'error' not in result}
+            json.dump({'meta': meta, 'results': {**baseline, **succeeded}}, f, indent=2)
+        print(f"Zapisano punkt odniesienia: {args.baseline}")
+
+    errors = [name for name, result in results.items() if 'error' in result]
+    if args.save_baseline:
+        return 1 if errors else 0
+    regressions = compare(results, baseline, args.tolerance, args.rss_tolerance)
+    for name, description in regressions:
+        print(f"REGRESJA {name}: {description}")
+    return 1 if errors or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
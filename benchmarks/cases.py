@@ -0,0 +1,148 @@
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+
+from .stubs import GeoServerStub, install_local_s3
+
+def measure(fn, repeat=3, warmup=1, setup=None):
+    """Mediana czasu `fn()` z `repeat` pomiarów po `warmup` przebiegach rozgrzewających (bez `setup`)."""
+    times = []
+    for i in range(warmup + repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        if i >= warmup:
+            times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def _result(wall, units, unit):
+    return {'wall_s': wall, 'throughput': units / wall if wall else None, 'unit': unit}
+
+def bench_scale_to_uint8(case, options):
+    from geouploader.util import scale_to_uint8
+    band = np.random.default_rng(0).normal(500, 100, (case['height'], case['width'])).astype('float32')
+    band[:case['height'] // 8, :case['width'] // 8] = np.nan
+    wall = measure(lambda: scale_to_uint8(band), options['repeat'])
+    return _result(wall, band.size / 1e6, 'MPix/s')
+
+def bench_reproject_band(case, options):
+    from geouploader.util import get_reproject_params, reproject_band, scale_to_uint8
+    with rasterio.open(case['path']) as src:
+        scaled = scale_to_uint8(src.read(1).astype('float32'))
+        dst_transform, width, height = get_reproject_params(src)
+        wall = measure(lambda: reproject_band(scaled, src, (height, width), dst_transform, 'EPSG:3857'),
+                       options['repeat'])
+    return _result(wall, scaled.size / 1e6, 'MPix/s')
+
+def bench_validate_geotiff(case, options, calls=50):
+    from geouploader.validators import validate_geotiff_and_get_bbox
+
+    def run():
+        for _ in range(calls):
+            validate_geotiff_and_get_bbox(case['path'], None)
+
+    wall = measure(run, options['repeat'])
+    return _result(wall, calls, 'wyw./s')
+
+def bench_convert_to_cog(case, options):
+    from geouploader.stats import STATS_CACHE_DIR
+    from geouploader.util import convert_data_to_cog
+    output = os.path.join(options['work_dir'], f"{case['name']}.cog.tif")
+
+    def clean():
+        # Statystyki pasm są zapisywane obok pliku - każdy pomiar liczy je od nowa.
+        shutil.rmtree(os.path.join(os.path.dirname(case['path']), STATS_CACHE_DIR), ignore_errors=True)
+        if os.path.exists(output):
+            os.remove(output)
+
+    wall = measure(lambda: convert_data_to_cog(case['path'], output), options['repeat'], warmup=0, setup=clean)
+    clean()
+    return _result(wall, case['width'] * case['height'] * case['count'] / 1e6, 'MPix/s')
+
+def _api_client(stub, work_dir):
+    from app import create_app
+    from config import Config
+    from geouploader.clients import clients
+
+    class BenchmarkConfig(Config):
+        TESTING = True
+        GEOSERVER_URL = stub.rest_url
+        GEOSERVER_WORKSPACE = stub.workspace
+        UPLOAD_FOLDER = os.path.join(work_dir, 'uploads')
+        SQLALCHEMY_DATABASE_URI = os.environ['BENCH_DATABASE_URL']
+
+    # Przed create_app - wznawiane przy starcie zadania nie mogą dotknąć prawdziwego S3.
+    install_local_s3(clients, os.path.join(work_dir, 's3'))
+    app = create_app(BenchmarkConfig)
+    return app.test_client()
+
+def bench_api(path, cold, options):
+    """
+    Przepustowość handlera Flask z GeoServerem zastąpionym przez `GeoServerStub`.
+    `cold=True` czyści pamięci podręczne warstw przed każdym żądaniem.
+    """
+    from geouploader.layer_cache import layer_cache
+    from geouploader.layer_info import layer_info_cache
+    requests_per_run = options['api_requests']
+
+    with GeoServerStub('bench', layer_count=options['api_layers']) as stub:
+        client = _api_client(stub, options['work_dir'])
+
+        def run():
+            for _ in range(requests_per_run):
+                if cold:
+                    layer_cache.invalidate()
+                    layer_info_cache.invalidate()
+                response = client.get(path)
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+        wall = measure(run, options['repeat'])
+    return _result(wall, requests_per_run, 'req/s')
+
+def collect(raster_cases):
+    """Zwraca {nazwa: funkcja(options)} - wszystkie benchmarki dla podanych rastrów."""
+    benchmarks = {}
+    for case in raster_cases:
+        name = case['name']
+        benchmarks[f"scale_to_uint8/{name}"] = lambda o, c=case: bench_scale_to_uint8(c, o)
+        benchmarks[f"reproject_band/{name}"] = lambda o, c=case: bench_reproject_band(c, o)
+        benchmarks[f"validate_geotiff/{name}"] = lambda o, c=case: bench_validate_geotiff(c, o)
+        benchmarks[f"convert_data_to_cog/{name}"] = lambda o, c=case: bench_convert_to_cog(c, o)
+    for cold in (False, True):
+        suffix = 'cold' if cold else 'warm'
+        benchmarks[f"api/layers/{suffix}"] = lambda o, cold=cold: bench_api('/api/layers', cold, o)
+        benchmarks[f"api/layer-info-all/{suffix}"] = lambda o, cold=cold: bench_api('/api/layer-info?all=1', cold, o)
+    return benchmarks
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje KiB, macOS - bajty.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_case(name, raster_cases, options, queue):
+    """Punkt wejścia procesu potomnego: wykonuje jeden benchmark i odsyła wynik ze szczytowym RSS."""
+    try:
+        result = collect(raster_cases)[name](options)
+        result['peak_rss_mb'] = _peak_rss_mb()
+        queue.put(result)
+    except BaseException as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+        raise
+
+def api_available():
+    """
+    Benchmarki API wymagają osobnej bazy z PostGIS (`BENCH_DATABASE_URL`).
+    create_app tworzy w niej tabele i wznawia zadania z tabeli `upload_jobs`,
+    więc baza aplikacji (`DATABASE_URL`) nigdy nie jest używana.
+    """
+    return bool(os.environ.get('BENCH_DATABASE_URL'))
+
+def temporary_work_dir():
+    return tempfile.mkdtemp(prefix='gis-bench-')
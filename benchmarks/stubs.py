@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+class GeoServerStub:
+    """
+    Lokalny zastępnik REST API GeoServera dla benchmarków: lista warstw workspace'u
+    (z ETag i 304), dokument warstwy i zasobu (coverage z `nativeBoundingBox`).
+    `latency` (s) symuluje opóźnienie sieci przy każdym zapytaniu.
+    """
+
+    def __init__(self, workspace, layer_count=100, latency=0.0):
+        self.workspace = workspace
+        self.layer_names = [f"layer_{i:04d}" for i in range(layer_count)]
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def rest_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/geoserver/rest"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _layers_document(self):
+        base = f"{self.rest_url}/workspaces/{self.workspace}/layers"
+        return {'layers': {'layer': [{'name': name, 'href': f"{base}/{name}.json"} for name in self.layer_names]}}
+
+    def _route(self, path):
+        prefix = f"/geoserver/rest/workspaces/{self.workspace}/"
+        if not path.startswith(prefix):
+            return None
+        parts = path[len(prefix):].removesuffix('.json').split('/')
+        if parts == ['layers']:
+            return self._layers_document()
+        if len(parts) == 2 and parts[0] == 'layers' and parts[1] in self.layer_names:
+            name = parts[1]
+            href = f"{self.rest_url}/workspaces/{self.workspace}/coveragestores/{name}/coverages/{name}.json"
+            return {'layer': {'name': name, 'type': 'RASTER', 'enabled': True,
+                              'resource': {'name': name, 'href': href}}}
+        if len(parts) == 4 and parts[0] == 'coveragestores' and parts[3] in self.layer_names:
+            offset = self.layer_names.index(parts[3]) * 1000.0
+            return {'coverage': {'name': parts[3], 'nativeBoundingBox': {
+                'minx': 450000.0 + offset, 'miny': 480000.0, 'maxx': 460000.0 + offset, 'maxy': 490000.0,
+                'crs': 'EPSG:2180'}}}
+        return None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                document = stub._route(urlparse(self.path).path)
+                if document is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = json.dumps(document).encode()
+                etag = f'"{hash(body) & 0xffffffff:08x}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class LocalS3:
+    """
+    Zastępnik klienta boto3 S3 zapisujący obiekty w lokalnym katalogu.
+    Obsługuje operacje używane przez aplikację przy listowaniu i zapisie,
+    więc żaden benchmark nie wysyła zapytań do prawdziwego S3.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None, Callback=None):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(Filename, 'rb') as src, open(path, 'wb') as dst:
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+                if Callback:
+                    Callback(len(chunk))
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body if isinstance(Body, bytes) else Body.read())
+        return {'ETag': f'"{os.path.getmtime(path)}"'}
+
+    def head_object(self, Bucket, Key):
+        stat = os.stat(self._path(Bucket, Key))
+        return {'ContentLength': stat.st_size, 'ETag': f'"{stat.st_mtime}"'}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        base = os.path.join(self.root, Bucket)
+        keys = sorted(os.path.relpath(os.path.join(directory, name), base).replace(os.sep, '/')
+                      for directory, _, names in os.walk(base) for name in names)
+        after = ContinuationToken or StartAfter
+        keys = [key for key in keys if key.startswith(Prefix) and (not after or key > after)]
+        page = keys[:MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys, 'Contents': [
+            {'Key': key, 'Size': os.path.getsize(self._path(Bucket, key)), 'ETag': '""',
+             'LastModified': datetime.fromtimestamp(os.path.getmtime(self._path(Bucket, key)), timezone.utc)}
+            for key in page]}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = client.list_objects_v2(**kwargs, ContinuationToken=token)
+                    yield page
+                    if not page['IsTruncated']:
+                        return
+                    token = page['NextContinuationToken']
+
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(operation)
+        return Paginator()
+
+def install_local_s3(clients, root):
+    """Podmienia klienta S3 we współdzielonym rejestrze `clients` na `LocalS3`."""
+    with clients._lock:
+        clients._pid = os.getpid()
+        clients._s3 = LocalS3(root)
+    return clients._s3
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+# Środek obszaru (okolice Polski) i rozmiar piksela w jednostkach danego CRS
+CRS_GRIDS = {
+    'EPSG:4326': ((19.0, 52.0), 0.0001),
+    'EPSG:3857': ((2115000.0, 6800000.0), 10.0),
+    'EPSG:2180': ((500000.0, 500000.0), 10.0),
+    'EPSG:32634': ((500000.0, 5760000.0), 10.0)
+}
+
+# Zestaw rastrów testowych: rozmiar, liczba pasm, typ danych i układ współrzędnych.
+# W trybie szybkim (--quick) wymiary są dzielone przez `QUICK_FACTOR`.
+RASTER_CASES = [
+    {'name': 'rgb-u8-3857', 'width': 2048, 'height': 2048, 'count': 3, 'dtype': 'uint8', 'crs': 'EPSG:3857'},
+    {'name': 'dem-f32-2180', 'width': 4096, 'height': 4096, 'count': 1, 'dtype': 'float32', 'crs': 'EPSG:2180'},
+    {'name': 'ms-u16-32634', 'width': 4096, 'height': 4096, 'count': 3, 'dtype': 'uint16', 'crs': 'EPSG:32634'},
+    {'name': 'dem-f32-4326', 'width': 8192, 'height': 4096, 'count': 1, 'dtype': 'float32', 'crs': 'EPSG:4326'}
+]
+QUICK_FACTOR = 4
+
+def raster_cases(quick=False):
+    if not quick:
+        return [dict(case) for case in RASTER_CASES]
+    return [dict(case, width=case['width'] // QUICK_FACTOR, height=case['height'] // QUICK_FACTOR)
+            for case in RASTER_CASES]
+
+def _values(dtype, rows, cols, band, rng):
+    """Gładki gradient z szumem - kompresuje się podobnie do prawdziwych danych."""
+    surface = np.sin(rows / 97.0 + band) * np.cos(cols / 131.0) + rng.normal(0, 0.05, (len(rows), len(cols[0])))
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        info = np.iinfo(dtype)
+        high = 255 if dtype == 'uint8' else min(info.max, 10000)
+        return ((surface + 1.2) / 2.4 * high).clip(info.min, high).astype(dtype)
+    return (surface * 400 + 600).astype(dtype)
+
+def make_geotiff(path, width, height, count, dtype, crs, seed=0, block_rows=256, **_):
+    """
+    Zapisuje deterministyczny kafelkowany GeoTIFF (DEFLATE). Dane są generowane
+    pasami po `block_rows` wierszy, więc nawet duże rastry nie wymagają dużo pamięci.
+    Rastry zmiennoprzecinkowe mają prostokąt NaN (brak danych) w rogu.
+    """
+    (center_x, center_y), pixel = CRS_GRIDS[crs]
+    transform = from_origin(center_x - width / 2 * pixel, center_y + height / 2 * pixel, pixel, pixel)
+    profile = {
+        'driver': 'GTiff', 'width': width, 'height': height, 'count': count, 'dtype': dtype,
+        'crs': crs, 'transform': transform, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+        'compress': 'deflate'
+    }
+    if not np.issubdtype(np.dtype(dtype), np.integer):
+        profile['nodata'] = float('nan')
+
+    rng = np.random.default_rng(seed)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row in range(0, height, block_rows):
+            rows_in_block = min(block_rows, height - row)
+            rows, cols = np.mgrid[row:row + rows_in_block, 0:width]
+            for band in range(1, count + 1):
+                data = _values(dtype, rows, cols, band, rng)
+                if 'nodata' in profile and row < height // 8:
+                    data[:, :width // 8] = np.nan
+                dst.write(data, band, window=Window(0, row, width, rows_in_block))
+    return path
+
+def ensure_rasters(data_dir, quick=False):
+    """Tworzy brakujące rastry testowe w `data_dir` i zwraca przypadki uzupełnione o ścieżkę."""
+    os.makedirs(data_dir, exist_ok=True)
+    cases = raster_cases(quick)
+    for case in cases:
+        case['path'] = os.path.join(data_dir, f"{case['name']}-{case['count']}b-{case['width']}x{case['height']}.tif")
+        if not os.path.exists(case['path']):
+            make_geotiff(**case)
+    return cases
@@ -21,10 +21,32 @@ class Config:
     GEOSERVER_WORKSPACE = os.environ.get('GEOSERVER_WORKSPACE', "host_strona")
     GEOSERVER_USER = os.environ.get("GEOSERVER_USER", "admin")
     GEOSERVER_PASSWORD = os.environ.get("GEOSERVER_PASSWORD", "geoserver")
+    # Pula połączeń HTTP do GeoServera (liczba hostów / połączeń na host) i timeouty (s)
+    GEOSERVER_POOL_CONNECTIONS = int(os.environ.get('GEOSERVER_POOL_CONNECTIONS', 4))
+    GEOSERVER_POOL_MAXSIZE = int(os.environ.get('GEOSERVER_POOL_MAXSIZE', 20))
+    GEOSERVER_CONNECT_TIMEOUT = float(os.environ.get('GEOSERVER_CONNECT_TIMEOUT', 5))
+    GEOSERVER_READ_TIMEOUT = float(os.environ.get('GEOSERVER_READ_TIMEOUT', 120))
+    # Czas (s), przez który pośrednik /wms serwuje zapamiętany dokument GetCapabilities
+    WMS_CAPABILITIES_TTL = int(os.environ.get('WMS_CAPABILITIES_TTL', 300))
+    # Pamięć podręczna listy warstw: czas świeżości i okres serwowania nieświeżej listy (s)
+    LAYER_CACHE_TTL = int(os.environ.get('LAYER_CACHE_TTL', 30))
+    LAYER_CACHE_STALE_TTL = int(os.environ.get('LAYER_CACHE_STALE_TTL', 300))
+    # Metadane pojedynczych warstw: czas życia wpisu (s) i liczba równoległych pobrań
+    LAYER_INFO_CACHE_TTL = int(os.environ.get('LAYER_INFO_CACHE_TTL', 300))
+    LAYER_INFO_CONCURRENCY = int(os.environ.get('LAYER_INFO_CONCURRENCY', 8))
+    # Czas (s), po którym indeks zasięgów w pamięci (/api/search) jest przebudowywany
+    SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 60))
     
     # Konfiguracja ścieżek
     # Używamy os.path.abspath, aby zapewnić, że ścieżka jest zawsze poprawna
     UPLOAD_FOLDER = os.path.abspath('orto_ref_host')
+    # Upload zapisywany strumieniowo kawałkami (bajty); fsync wymusza zapis na dysk
+    # przed dalszym przetwarzaniem. Ten sam rozmiar kawałka dotyczy wysyłki do GeoServera.
+    # Limit MAX_UPLOAD_SIZE_MB dotyczy uploadu do GeoServera, MAX_COG_UPLOAD_SIZE_MB - konwersji do COG.
+    MAX_UPLOAD_SIZE_MB = int(os.environ.get('MAX_UPLOAD_SIZE_MB', 100))
+    MAX_COG_UPLOAD_SIZE_MB = int(os.environ.get('MAX_COG_UPLOAD_SIZE_MB', 20 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+    UPLOAD_FSYNC = os.environ.get('UPLOAD_FSYNC', 'false').lower() in ['true', 'on', '1']
 
     # Upewnij się, że katalog do uploadu istnieje
     @staticmethod
@@ -33,6 +55,40 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
 
+    # Import geometrii (/api/save_geom): limit obiektów w żądaniu, próg, od którego
+    # PostgreSQL dostaje dane przez COPY zamiast INSERT, i rozmiar partii COPY.
+    GEOM_MAX_FEATURES = int(os.environ.get('GEOM_MAX_FEATURES', 200000))
+    GEOM_COPY_THRESHOLD = int(os.environ.get('GEOM_COPY_THRESHOLD', 1000))
+    GEOM_BATCH_SIZE = int(os.environ.get('GEOM_BATCH_SIZE', 10000))
+    # Kafle wektorowe geometrii: siatka kafla, bufor (w jednostkach siatki)
+    # i tolerancja upraszczania w pikselach siatki dla danego poziomu.
+    MVT_EXTENT = int(os.environ.get('MVT_EXTENT', 4096))
+    MVT_BUFFER = int(os.environ.get('MVT_BUFFER', 64))
+    MVT_SIMPLIFY_PX = float(os.environ.get('MVT_SIMPLIFY_PX', 1.0))
+    # Statystyki strefowe: limit geometrii w żądaniu, liczba pikseli obszaru, powyżej
+    # której czytana jest piramida, i rozmiar okna odczytu (px).
+    ZONAL_MAX_GEOMETRIES = int(os.environ.get('ZONAL_MAX_GEOMETRIES', 10000))
+    ZONAL_MAX_PIXELS = int(os.environ.get('ZONAL_MAX_PIXELS', 50_000_000))
+    ZONAL_WINDOW_SIZE = int(os.environ.get('ZONAL_WINDOW_SIZE', 1024))
+    # Próbkowanie pikseli: limit punktów w żądaniu, rozmiar bloku odczytu (px)
+    # i pojemność współdzielonej pamięci zdekodowanych bloków (MB).
+    SAMPLE_MAX_POINTS = int(os.environ.get('SAMPLE_MAX_POINTS', 100000))
+    SAMPLE_BLOCK_SIZE = int(os.environ.get('SAMPLE_BLOCK_SIZE', 512))
+    SAMPLE_BLOCK_CACHE_MB = int(os.environ.get('SAMPLE_BLOCK_CACHE_MB', 256))
+    # Eksport: liczba obiektów w partii przeliczanej i kodowanej naraz.
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+    # Metryki w formacie Prometheusa pod /metrics (czasy żądań, etapów uploadu, wywołań GeoServera i S3)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+
+    # Liczba wątków wykonujących zadania w tle (konwersja, upload, publikacja)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    # Co ile sekund proces odświeża heartbeat swoich zadań i po ilu sekundach bez
+    # heartbeatu zadanie 'running' innego procesu uznaje się za przerwane
+    JOB_HEARTBEAT_INTERVAL = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 30))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 120))
+    # Po ilu godzinach zadanie z błędem bez ponowienia jest porzucane (przerwanie multipart uploadu w S3)
+    JOB_ABANDON_AFTER_HOURS = int(os.environ.get('JOB_ABANDON_AFTER_HOURS', 24))
+
     # Konfiguracja AWS S3 dla COG
     S3_KEY = os.environ.get('AWS_ACCESS_KEY_ID')
     S3_SECRET = os.environ.get('AWS_SECRET_ACCESS_KEY')
@@ -40,4 +96,46 @@ class Config:
     S3_LOCATION = os.environ.get('AWS_REGION')
     AWS_FOLDER = os.environ.get('AWS_FOLDER_NAME')
     AWS_ENDPOINT = os.environ.get('AWS_ENDPOINT')
+    # Pula połączeń klienta S3 i timeouty (s)
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+    S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+    S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 60))
+    # Co ile sekund odświeżana jest w tle migawka listingu S3 (/api/s3/list)
+    S3_LISTING_REFRESH = int(os.environ.get('S3_LISTING_REFRESH', 60))
+    # Multipart upload COG: rozmiar części (MB, min. 5), liczba równoległych części
+    # i liczba ponowień pojedynczej części.
+    S3_PART_SIZE_MB = int(os.environ.get('S3_PART_SIZE_MB', 16))
+    S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', 8))
+    S3_MAX_RETRIES = int(os.environ.get('S3_MAX_RETRIES', 5))
+
+    # Konfiguracja konwersji COG
+    # Rozmiar bloku (kafla) pliku wynikowego i przybliżony limit pamięci (MB)
+    # dzielony między cache GDAL a bufor operacji warp.
+    COG_BLOCK_SIZE = int(os.environ.get('COG_BLOCK_SIZE', 512))
+    COG_MEMORY_LIMIT_MB = int(os.environ.get('COG_MEMORY_LIMIT_MB', 256))
+    # Statystyki pasm: 'approx' (piramidy/odczyt zdecymowany) lub 'exact' (cały raster),
+    # rozciąganie: 'minmax' lub 'percentile' (2-98%).
+    COG_STATS_MODE = os.environ.get('COG_STATS_MODE', 'approx')
+    COG_STRETCH = os.environ.get('COG_STRETCH', 'minmax')
+    # Równoległość konwersji: liczba wątków reprojekcji okien, wątki operacji warp GDAL
+    # na okno oraz opcja NUM_THREADS kompresji (np. 'ALL_CPUS').
+    COG_WORKERS = int(os.environ.get('COG_WORKERS', os.cpu_count() or 1))
+    COG_WARP_THREADS = int(os.environ.get('COG_WARP_THREADS', 1))
+    COG_COMPRESS_THREADS = os.environ.get('COG_COMPRESS_THREADS', 'ALL_CPUS')
+    # Metoda próbkowania piramid COG ('average', 'cubic', 'nearest', ...).
+    COG_OVERVIEW_RESAMPLING = os.environ.get('COG_OVERVIEW_RESAMPLING', 'average')
+
+    # Serwer kafli XYZ z COG: domyślny rozmiar kafla (256 lub 512 px), metoda próbkowania,
+    # cache bloków GDAL (MB) i opcjonalny katalog z lokalnymi kopiami COG (klucz S3 = ścieżka względna).
+    TILE_SIZE = int(os.environ.get('TILE_SIZE', 256))
+    TILE_RESAMPLING = os.environ.get('TILE_RESAMPLING', 'bilinear')
+    TILE_GDAL_CACHE_MB = int(os.environ.get('TILE_GDAL_CACHE_MB', 256))
+    COG_LOCAL_FOLDER = os.environ.get('COG_LOCAL_FOLDER')
+    # Pamięć podręczna kafli: katalog na dysku, limit LRU w pamięci (MB)
+    # i czas (s) w nagłówku Cache-Control odpowiedzi; co ile sekund proces
+    # odczytuje generacje warstw zapisane przez inne procesy.
+    TILE_CACHE_DIR = os.path.abspath(os.environ.get('TILE_CACHE_DIR', 'tile_cache'))
+    TILE_CACHE_MEMORY_MB = int(os.environ.get('TILE_CACHE_MEMORY_MB', 64))
+    TILE_CACHE_MAX_AGE = int(os.environ.get('TILE_CACHE_MAX_AGE', 3600))
+    TILE_CACHE_GENERATION_TTL = float(os.environ.get('TILE_CACHE_GENERATION_TTL', 1))
 
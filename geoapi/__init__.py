@@ -0,0 +1,8 @@
+from flask import Blueprint
+
+# Blueprint 'geoapi' - API danych wektorowych i analiz rastrowych,
+# rejestrowany z prefiksem '/api' obok tras z app.py.
+geoapi_bp = Blueprint('geoapi', __name__)
+
+# Importujemy trasy na końcu, aby uniknąć cyklicznego importu.
+from . import routes
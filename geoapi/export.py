@@ -0,0 +1,142 @@
+import json
+import zlib
+from datetime import datetime
+
+import numpy as np
+import shapely
+from pyproj.exceptions import CRSError
+from sqlalchemy import func, select
+
+from app import db, DrawnGeometry
+from geouploader.crs import get_transformer
+from geouploader.exceptions.custom_exceptions import ValidationError
+from .flatgeobuf import FGB_MIMETYPE, encode_header, encode_feature
+
+# Format -> (typ MIME, rozszerzenie pliku)
+EXPORT_FORMATS = {
+    'txt': ('text/plain', 'txt'),
+    'csv': ('text/csv', 'csv'),
+    'geojson': ('application/geo+json', 'geojson'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'fgb': (FGB_MIMETYPE, 'fgb')
+}
+
+def parse_target_crs(value):
+    """Zwraca kod docelowego CRS ('EPSG:n') i transformer z EPSG:4326 (None bez przeliczania)."""
+    if not value:
+        return 'EPSG:4326', None
+    code = str(value).upper().removeprefix('EPSG:')
+    if not code.isdigit():
+        raise ValidationError("Parametr 'crs' musi być kodem EPSG, np. 'EPSG:2180'.")
+    target = f"EPSG:{int(code)}"
+    if target == 'EPSG:4326':
+        return target, None
+    try:
+        return target, get_transformer('EPSG:4326', target)
+    except CRSError:
+        raise ValidationError(f"Nieznany układ współrzędnych: {target}")
+
+def coordinate_batches(coordinates, batch_size):
+    """
+    Partie (identyfikatory, punkty) z listy {lng, lat} lub {x, y}; niepełne wpisy
+    są pomijane. Walidacja odbywa się od razu, przed rozpoczęciem strumienia.
+    """
+    xy = [(c['lng'], c['lat']) if 'lng' in c and 'lat' in c else (c['x'], c['y'])
+          for c in coordinates if isinstance(c, dict) and (('lng' in c and 'lat' in c) or ('x' in c and 'y' in c))]
+    if not xy:
+        raise ValidationError('Lista współrzędnych jest pusta')
+    try:
+        xy = np.asarray(xy, dtype='float64')
+    except (TypeError, ValueError):
+        raise ValidationError('Współrzędne muszą być liczbami')
+    return ((np.arange(start, min(start + batch_size, len(xy))), shapely.points(xy[start:start + batch_size]))
+            for start in range(0, len(xy), batch_size))
+
+def stored_geometry_batches(bbox=None, batch_size=2000):
+    """Partie (identyfikatory, geometrie) z tabeli `DrawnGeometry` z kursora serwerowego."""
+    query = select(DrawnGeometry.id, func.ST_AsBinary(DrawnGeometry.geom)).order_by(DrawnGeometry.id)
+    if bbox:
+        query = query.where(func.ST_Intersects(DrawnGeometry.geom, func.ST_MakeEnvelope(*bbox, 4326)))
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        yield (np.array([row[0] for row in partition]),
+               shapely.from_wkb([bytes(row[1]) for row in partition]))
+
+def reproject_batches(batches, transformer):
+    """Przelicza każdą partię jednym wektorowym wywołaniem pyproj."""
+    for ids, geoms in batches:
+        if transformer is not None:
+            geoms = shapely.transform(geoms, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+        keep = ~shapely.is_empty(geoms)
+        yield ids[keep], geoms[keep]
+
+def _encode_txt(batches, crs, points):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    yield f"# Exported Coordinates - {timestamp}\n# Format: X, Y ({crs})\n"
+    for _, geoms in batches:
+        yield ''.join(f"{x}, {y}\n" for x, y in shapely.get_coordinates(geoms).tolist())
+
+def _encode_csv(batches, crs, points):
+    if points:
+        yield 'id,x,y\n'
+        for ids, geoms in batches:
+            yield ''.join(f"{i},{x},{y}\n" for i, (x, y) in zip(ids.tolist(), shapely.get_coordinates(geoms).tolist()))
+    else:
+        yield 'id,wkt\n'
+        for ids, geoms in batches:
+            yield ''.join(f'{i},"{wkt}"\n' for i, wkt in zip(ids.tolist(), shapely.to_wkt(geoms, rounding_precision=-1)))
+
+def _features(ids, geoms):
+    return (f'{{"type": "Feature", "id": {i}, "properties": {{}}, "geometry": {geometry}}}'
+            for i, geometry in zip(ids.tolist(), shapely.to_geojson(geoms)))
+
+def _encode_geojson(batches, crs, points):
+    # Dla układów innych niż WGS84 dopisujemy nieoficjalne pole "crs" (rozpoznawane przez GDAL/QGIS).
+    crs_member = '' if crs == 'EPSG:4326' else \
+        f', "crs": {json.dumps({"type": "name", "properties": {"name": "urn:ogc:def:crs:" + crs.replace(":", "::")}})}'
+    yield f'{{"type": "FeatureCollection"{crs_member}, "features": [\n'
+    first = True
+    for ids, geoms in batches:
+        if len(ids):
+            yield ('' if first else ',\n') + ',\n'.join(_features(ids, geoms))
+            first = False
+    yield '\n]}\n'
+
+def _encode_ndjson(batches, crs, points):
+    for ids, geoms in batches:
+        yield ''.join(feature + '\n' for feature in _features(ids, geoms))
+
+def _encode_fgb(batches, crs, points):
+    yield encode_header('points' if points else 'geoms', int(crs.split(':')[1]))
+    for ids, geoms in batches:
+        yield b''.join(encode_feature(i, geom) for i, geom in zip(ids.tolist(), geoms))
+
+ENCODERS = {
+    'txt': _encode_txt,
+    'csv': _encode_csv,
+    'geojson': _encode_geojson,
+    'ndjson': _encode_ndjson,
+    'fgb': _encode_fgb
+}
+
+def gzip_stream(chunks, level=6):
+    """Kompresuje strumień w locie; w pamięci jest tylko bieżąca porcja i stan kompresora."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(batches, fmt, crs='EPSG:4326', transformer=None, points=False, gzip=False):
+    """
+    Generator bajtów eksportu w formacie `fmt`. Partie geometrii są przeliczane
+    do `crs` i kodowane pojedynczo, więc zużycie pamięci nie zależy od wielkości
+    eksportu (poza samą partią).
+    """
+    chunks = (chunk.encode() if isinstance(chunk, str) else chunk
+              for chunk in ENCODERS[fmt](reproject_batches(batches, transformer), crs, points))
+    return gzip_stream(chunks) if gzip else chunks
+
+def export_filename(prefix, fmt):
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt][1]}"
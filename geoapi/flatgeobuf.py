@@ -0,0 +1,144 @@
+import struct
+
+import numpy as np
+import shapely
+
+FGB_MAGIC = b'fgb\x03fgb\x01'
+FGB_MIMETYPE = 'application/flatgeobuf'
+
+# Kody typów geometrii i kolumn wg schematu FlatGeobuf 3
+GEOMETRY_TYPES = {'Point': 1, 'LineString': 2, 'Polygon': 3, 'MultiPoint': 4,
+                  'MultiLineString': 5, 'MultiPolygon': 6, 'GeometryCollection': 7}
+COLUMN_LONG = 7
+
+class Table:
+    """Tabela FlatBuffers: lista (numer pola, format struct lub None dla referencji, wartość)."""
+
+    def __init__(self, fields):
+        self.fields = [field for field in fields if field[2] is not None]
+
+class Vector:
+    """Wektor skalarów FlatBuffers: format elementu i gotowe bajty little-endian."""
+
+    def __init__(self, fmt, data):
+        self.fmt = fmt
+        self.data = data
+
+class _Builder:
+    """
+    Minimalny koder FlatBuffers zapisujący od początku bufora (z prefiksem
+    rozmiaru): tabela trafia przed obiekty, na które wskazuje, więc wszystkie
+    przesunięcia są dodatnie, a wyrównanie liczone jest od początku bufora.
+    """
+
+    def __init__(self):
+        self.buf = bytearray(8)
+
+    def _align(self, size, extra=0):
+        self.buf += b'\0' * (-(len(self.buf) + extra) % size)
+
+    def finish(self, root):
+        position = self._write(root)
+        struct.pack_into('<I', self.buf, 4, position - 4)
+        struct.pack_into('<I', self.buf, 0, len(self.buf) - 4)
+        return bytes(self.buf)
+
+    def _write(self, obj):
+        if isinstance(obj, Table):
+            return self._write_table(obj)
+        if isinstance(obj, Vector):
+            size = struct.calcsize(obj.fmt)
+            self._align(max(size, 4), 4)
+            position = len(self.buf)
+            self.buf += struct.pack('<I', len(obj.data) // size) + obj.data
+            return position
+        if isinstance(obj, str):
+            data = obj.encode()
+            self._align(4)
+            position = len(self.buf)
+            self.buf += struct.pack('<I', len(data)) + data + b'\0'
+            return position
+        # Wektor tabel
+        self._align(4)
+        position = len(self.buf)
+        self.buf += struct.pack('<I', len(obj)) + b'\0' * (4 * len(obj))
+        for i, item in enumerate(obj):
+            slot = position + 4 + 4 * i
+            struct.pack_into('<I', self.buf, slot, self._write(item) - slot)
+        return position
+
+    def _write_table(self, table):
+        # Pola od największych, żeby wyrównanie wymagało jak najmniej dopełnień.
+        fields = sorted(((index, fmt or 'I', value) for index, fmt, value in table.fields),
+                        key=lambda field: -struct.calcsize(field[1]))
+        offsets, size = {}, 4
+        for index, fmt, _ in fields:
+            width = struct.calcsize(fmt)
+            size += -size % width
+            offsets[index] = size
+            size += width
+
+        field_count = max(offsets, default=-1) + 1
+        self._align(2)
+        vtable_position = len(self.buf)
+        self.buf += struct.pack(f'<HH{field_count}H', 4 + 2 * field_count, size,
+                                *(offsets.get(i, 0) for i in range(field_count)))
+        self._align(8)
+        position = len(self.buf)
+        self.buf += b'\0' * size
+        struct.pack_into('<i', self.buf, position, position - vtable_position)
+
+        references = []
+        for index, fmt, value in table.fields:
+            if fmt is None:
+                references.append((position + offsets[index], value))
+            else:
+                struct.pack_into('<' + fmt, self.buf, position + offsets[index], value)
+        for slot, value in references:
+            struct.pack_into('<I', self.buf, slot, self._write(value) - slot)
+        return position
+
+def _geometry(geom):
+    kind = geom.geom_type
+    fields = [(6, 'B', GEOMETRY_TYPES[kind])]
+    if kind in ('MultiPolygon', 'GeometryCollection'):
+        return Table(fields + [(7, None, [_geometry(part) for part in geom.geoms])])
+
+    if kind == 'Polygon':
+        parts = [geom.exterior, *geom.interiors]
+    elif kind == 'MultiLineString':
+        parts = list(geom.geoms)
+    else:
+        parts = []
+    xy = shapely.get_coordinates(geom)
+    ends = np.cumsum(shapely.get_num_coordinates(parts)).astype('<u4') if len(parts) > 1 else None
+    return Table(fields + [
+        (0, None, Vector('I', ends.tobytes()) if ends is not None else None),
+        (1, None, Vector('d', xy.astype('<f8').tobytes()))
+    ])
+
+def encode_header(name, epsg=None):
+    """
+    Nagłówek pliku FlatGeobuf bez indeksu przestrzennego (`index_node_size=0`)
+    i z nieznaną liczbą obiektów, dzięki czemu plik można zapisywać strumieniowo.
+    Typ geometrii jest zapisywany w każdym obiekcie, a jedyną kolumną jest `id`.
+    """
+    column = Table([(0, None, 'id'), (1, 'B', COLUMN_LONG)])
+    crs = Table([(0, None, 'EPSG'), (1, 'i', epsg)]) if epsg else None
+    header = Table([
+        (0, None, name),
+        (2, 'B', 0),
+        (7, None, [column]),
+        (8, 'Q', 0),
+        (9, 'H', 0),
+        (10, None, crs)
+    ])
+    return FGB_MAGIC + _Builder().finish(header)
+
+def encode_feature(feature_id, geom):
+    """Koduje jeden obiekt (geometria + właściwość `id`) z prefiksem rozmiaru."""
+    feature = Table([
+        (0, None, _geometry(geom)),
+        (1, None, Vector('B', struct.pack('<Hq', 0, feature_id)))
+    ])
+    return _Builder().finish(feature)
@@ -0,0 +1,142 @@
+import io
+import json
+
+import numpy as np
+import shapely
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db, DrawnGeometry
+from geouploader.exceptions.custom_exceptions import ValidationError
+
+WORLD_BOUNDS = (-180.0, -90.0, 180.0, 90.0)
+
+def parse_features(payload):
+    """
+    Zamienia GeoJSON (FeatureCollection, Feature lub samą geometrię) na tablicę
+    geometrii Shapely. Parsowanie geometrii odbywa się jednym wywołaniem
+    `shapely.from_geojson`; niepoprawne wpisy dają None i trafiają do błędów.
+    """
+    if not isinstance(payload, dict):
+        raise ValidationError("Oczekiwano obiektu GeoJSON.")
+    kind = payload.get('type')
+    if kind == 'FeatureCollection':
+        geometries = [feature.get('geometry') if isinstance(feature, dict) else None
+                      for feature in payload.get('features') or []]
+    elif kind == 'Feature':
+        geometries = [payload.get('geometry')]
+    else:
+        geometries = [payload]
+    if not geometries:
+        raise ValidationError("Kolekcja nie zawiera obiektów.")
+
+    max_features = current_app.config['GEOM_MAX_FEATURES']
+    if len(geometries) > max_features:
+        raise ValidationError(f"Za dużo obiektów w jednym żądaniu (maksymalnie {max_features}).")
+
+    encoded = np.array([json.dumps(g) if isinstance(g, dict) else None for g in geometries], dtype=object)
+    return shapely.from_geojson(encoded, on_invalid='ignore')
+
+def validate_geometries(geoms, repair=False):
+    """
+    Wektorowa walidacja geometrii: brak/pusta, poza zakresem EPSG:4326,
+    niepoprawna topologia (opcjonalnie naprawiana przez `make_valid`).
+    Zwraca (poprawne geometrie, indeksy wejściowe, lista błędów).
+    """
+    errors = np.full(len(geoms), None, dtype=object)
+    missing = shapely.is_missing(geoms)
+    errors[missing] = 'Nieprawidłowa geometria GeoJSON'
+
+    empty = ~missing & shapely.is_empty(geoms)
+    errors[empty] = 'Pusta geometria'
+
+    bounds = shapely.bounds(geoms)
+    with np.errstate(invalid='ignore'):
+        outside = ~missing & ~empty & ((bounds[:, 0] < WORLD_BOUNDS[0]) | (bounds[:, 1] < WORLD_BOUNDS[1]) |
+                                       (bounds[:, 2] > WORLD_BOUNDS[2]) | (bounds[:, 3] > WORLD_BOUNDS[3]))
+    errors[outside] = 'Współrzędne poza zakresem EPSG:4326'
+
+    candidates = ~(missing | empty | outside)
+    invalid = candidates & ~shapely.is_valid(geoms)
+    if repair and invalid.any():
+        geoms = geoms.copy()
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+    else:
+        reasons = shapely.is_valid_reason(geoms[invalid])
+        errors[invalid] = [f"Niepoprawna geometria: {reason}" for reason in reasons]
+        candidates &= ~invalid
+
+    indices = np.flatnonzero(candidates)
+    rejected = [{'index': int(i), 'error': errors[i]} for i in np.flatnonzero(~candidates)]
+    return geoms[indices], indices, rejected
+
+def _copy_available():
+    return db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+
+def insert_geometries(geoms, return_ids=False):
+    """
+    Zapisuje geometrie do tabeli `DrawnGeometry`.
+
+    Duże partie w PostgreSQL idą przez `COPY ... FROM STDIN` (heksadecymalny
+    EWKB, bez warstwy ORM), mniejsze - jednym `INSERT` typu executemany.
+    Przy `return_ids=True` zawsze używany jest INSERT ... RETURNING.
+    """
+    if len(geoms) == 0:
+        return []
+    config = current_app.config
+    geoms = shapely.set_srid(geoms, 4326)
+
+    if not return_ids and len(geoms) >= config['GEOM_COPY_THRESHOLD'] and _copy_available():
+        table = DrawnGeometry.__table__
+        ewkb = shapely.to_wkb(geoms, hex=True, include_srid=True)
+        connection = db.session.connection().connection
+        with connection.cursor() as cursor:
+            batch_size = config['GEOM_BATCH_SIZE']
+            for start in range(0, len(ewkb), batch_size):
+                buffer = io.StringIO('\n'.join(ewkb[start:start + batch_size]) + '\n')
+                cursor.copy_expert(f"COPY {table.name} ({table.c.geom.name}) FROM STDIN", buffer)
+        db.session.commit()
+        return None
+
+    ewkt = ['SRID=4326;' + wkt for wkt in shapely.to_wkt(geoms, rounding_precision=-1)]
+    statement = DrawnGeometry.__table__.insert()
+    if return_ids:
+        statement = statement.returning(DrawnGeometry.id)
+        ids = [row[0] for row in db.session.execute(statement, [{'geom': value} for value in ewkt])]
+    else:
+        db.session.execute(statement, [{'geom': value} for value in ewkt])
+        ids = None
+    db.session.commit()
+    return ids
+
+def iter_geojson(bbox, limit=None, batch_size=2000):
+    """
+    Strumieniuje FeatureCollection z geometriami przecinającymi BBOX (EPSG:4326).
+    Filtr `&&` + ST_Intersects korzysta z indeksu GiST kolumny `geom`, a wiersze
+    są pobierane z kursora serwerowego partiami po `batch_size`.
+    """
+    envelope = func.ST_MakeEnvelope(*bbox, 4326)
+    query = (select(DrawnGeometry.id, func.ST_AsGeoJSON(DrawnGeometry.geom))
+             .where(func.ST_Intersects(DrawnGeometry.geom, envelope))
+             .order_by(DrawnGeometry.id))
+    if limit:
+        query = query.limit(limit)
+
+    yield '{"type": "FeatureCollection", "features": [\n'
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    first = True
+    for partition in result.partitions():
+        chunk = ',\n'.join(f'{{"type": "Feature", "id": {geom_id}, "properties": {{}}, "geometry": {geometry}}}'
+                           for geom_id, geometry in partition)
+        yield ('' if first else ',\n') + chunk
+        first = False
+    yield '\n]}\n'
+
+def parse_bbox(value):
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValidationError("Parametr 'bbox' musi mieć postać 'minx,miny,maxx,maxy'.")
+    if minx >= maxx or miny >= maxy:
+        raise ValidationError("Nieprawidłowy zakres 'bbox'.")
+    return minx, miny, maxx, maxy
@@ -0,0 +1,196 @@
+import numpy as np
+import shapely
+from flask import current_app
+from sqlalchemy import text, func, select
+from sqlalchemy.exc import DBAPIError
+from shapely.geometry.polygon import orient
+
+from app import db, DrawnGeometry
+from geouploader.crs import get_transformer, transform_bounds
+from geouploader.tiles import tile_bounds
+
+LAYER_NAME = 'geoms'
+MVT_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+# Kody typów geometrii i poleceń wg specyfikacji Mapbox Vector Tile 2.1
+GEOM_POINT, GEOM_LINESTRING, GEOM_POLYGON = 1, 2, 3
+CMD_MOVE_TO, CMD_LINE_TO, CMD_CLOSE_PATH = 1, 2, 7
+
+# None - jeszcze nie sprawdzono, czy baza obsługuje ST_AsMVT.
+_st_asmvt_available = None
+# SQLSTATE "undefined_function" - PostGIS bez ST_AsMVT (np. bez protobuf-c).
+UNDEFINED_FUNCTION = '42883'
+
+def _sqlstate(error):
+    orig = getattr(error, 'orig', None)
+    return getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _field(number, wire_type, payload):
+    key = _varint((number << 3) | wire_type)
+    if wire_type == 2:
+        return key + _varint(len(payload)) + payload
+    return key + _varint(payload)
+
+def _packed(number, values):
+    return _field(number, 2, b''.join(_varint(v) for v in values))
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+def _encode_path(coords, cursor, closed):
+    """Koduje ciąg współrzędnych kafla jako MoveTo + LineTo (+ ClosePath) z przyrostami względem kursora."""
+    points = np.round(np.asarray(coords)).astype('int64')
+    if closed:
+        points = points[:-1]
+    # Pomijamy kolejne identyczne punkty powstałe po zaokrągleniu.
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = points[keep]
+    if len(points) < (3 if closed else 2):
+        return [], cursor
+
+    deltas = np.diff(np.vstack([cursor, points]), axis=0)
+    commands = [_command(CMD_MOVE_TO, 1), _zigzag(int(deltas[0, 0])), _zigzag(int(deltas[0, 1])),
+                _command(CMD_LINE_TO, len(points) - 1)]
+    for dx, dy in deltas[1:].tolist():
+        commands += [_zigzag(dx), _zigzag(dy)]
+    if closed:
+        commands.append(_command(CMD_CLOSE_PATH, 1))
+    return commands, points[-1]
+
+def _encode_geometry(geom):
+    """Zwraca (typ MVT, lista poleceń) dla geometrii we współrzędnych kafla."""
+    cursor = np.zeros(2, dtype='int64')
+    commands = []
+    kind = geom.geom_type
+    if kind in ('Point', 'MultiPoint'):
+        points = np.round(shapely.get_coordinates(geom)).astype('int64')
+        deltas = np.diff(np.vstack([cursor, points]), axis=0)
+        commands = [_command(CMD_MOVE_TO, len(points))]
+        for dx, dy in deltas.tolist():
+            commands += [_zigzag(dx), _zigzag(dy)]
+        return GEOM_POINT, commands
+    if kind in ('LineString', 'MultiLineString'):
+        for line in getattr(geom, 'geoms', [geom]):
+            path, cursor = _encode_path(line.coords, cursor, closed=False)
+            commands += path
+        return GEOM_LINESTRING, commands
+    if kind in ('Polygon', 'MultiPolygon'):
+        for polygon in getattr(geom, 'geoms', [geom]):
+            # Przy osi Y w dół pierścień zewnętrzny musi mieć dodatnie pole (zgodnie ze wskazówkami zegara).
+            polygon = orient(polygon, sign=1.0)
+            exterior, cursor = _encode_path(polygon.exterior.coords, cursor, closed=True)
+            if not exterior:
+                continue
+            commands += exterior
+            for interior in polygon.interiors:
+                ring, cursor = _encode_path(interior.coords, cursor, closed=True)
+                commands += ring
+        return GEOM_POLYGON, commands
+    # GeometryCollection (np. po przycięciu) nie ma odpowiednika w MVT.
+    return None, []
+
+def encode_mvt(layer_name, features, extent=4096):
+    """Koduje listę (id, geometria we współrzędnych kafla) jako warstwę MVT (protobuf)."""
+    encoded = []
+    for feature_id, geom in features:
+        geom_type, commands = _encode_geometry(geom)
+        if geom_type is None or not commands:
+            continue
+        encoded.append(_field(1, 0, feature_id) + _field(3, 0, geom_type) + _packed(4, commands))
+    if not encoded:
+        return b''
+    layer = (_field(15, 0, 2) + _field(1, 2, layer_name.encode()) +
+             b''.join(_field(2, 2, feature) for feature in encoded) + _field(5, 0, extent))
+    return _field(3, 2, layer)
+
+def simplify_tolerance(z, extent, pixels):
+    """Tolerancja upraszczania (m, EPSG:3857) odpowiadająca `pixels` jednostkom siatki kafla na poziomie `z`."""
+    bounds = tile_bounds(z, 0, 0)
+    return (bounds[2] - bounds[0]) / extent * pixels
+
+def _render_postgis(z, x, y, extent, buffer, tolerance):
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    # Filtr przestrzenny obejmuje bufor kafla, tak jak w `_render_python`.
+    margin = (maxx - minx) * buffer / extent
+    table = DrawnGeometry.__table__.name
+    query = text(f"""
+        WITH tile AS (SELECT ST_MakeEnvelope(:minx, :miny, :maxx, :maxy, 3857) AS envelope)
+        SELECT ST_AsMVT(q, :layer, :extent, 'mvt_geom', 'id') FROM (
+            SELECT id, ST_AsMVTGeom(ST_Simplify(ST_Transform(geom, 3857), :tolerance, true),
+                                    tile.envelope, :extent, :buffer, true) AS mvt_geom
+            FROM {table}, tile
+            WHERE geom && ST_Transform(ST_Expand(tile.envelope, :margin), 4326)
+        ) q WHERE mvt_geom IS NOT NULL
+    """)
+    result = db.session.execute(query, {'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy,
+                                        'layer': LAYER_NAME, 'extent': extent, 'buffer': buffer,
+                                        'tolerance': tolerance, 'margin': margin}).scalar()
+    return bytes(result) if result else b''
+
+def _render_python(z, x, y, extent, buffer, tolerance):
+    """Zapas bez ST_AsMVT: filtr BBOX w bazie, przycięcie, uproszczenie i kodowanie wektorowo w Shapely."""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    margin = (maxx - minx) * buffer / extent
+    bbox_4326 = transform_bounds((minx - margin, miny - margin, maxx + margin, maxy + margin),
+                                 'EPSG:3857', 'EPSG:4326')
+    rows = db.session.execute(
+        select(DrawnGeometry.id, func.ST_AsBinary(DrawnGeometry.geom))
+        .where(func.ST_Intersects(DrawnGeometry.geom, func.ST_MakeEnvelope(*bbox_4326, 4326)))
+    ).all()
+    if not rows:
+        return b''
+
+    ids = [row[0] for row in rows]
+    geoms = shapely.from_wkb([bytes(row[1]) for row in rows])
+    transformer = get_transformer('EPSG:4326', 'EPSG:3857')
+    geoms = shapely.transform(geoms, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+    geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    geoms = shapely.clip_by_rect(geoms, minx - margin, miny - margin, maxx + margin, maxy + margin)
+
+    # Współrzędne kafla: początek w lewym górnym rogu, oś Y w dół.
+    scale = extent / (maxx - minx)
+    geoms = shapely.transform(geoms, lambda c: np.column_stack([(c[:, 0] - minx) * scale,
+                                                                 (maxy - c[:, 1]) * scale]))
+    keep = ~shapely.is_empty(geoms)
+    return encode_mvt(LAYER_NAME, [(i, g) for i, g, k in zip(ids, geoms, keep) if k], extent)
+
+def render_geoms_tile(z, x, y):
+    """
+    Kafel MVT z tabeli `DrawnGeometry`: ST_AsMVT, jeśli PostGIS go udostępnia,
+    w przeciwnym razie koder w Pythonie. Geometrie są upraszczane z tolerancją
+    zależną od poziomu przybliżenia.
+    """
+    global _st_asmvt_available
+    config = current_app.config
+    extent = config['MVT_EXTENT']
+    buffer = config['MVT_BUFFER']
+    tolerance = simplify_tolerance(z, extent, config['MVT_SIMPLIFY_PX'])
+
+    if _st_asmvt_available is not False and db.engine.dialect.name == 'postgresql':
+        try:
+            tile = _render_postgis(z, x, y, extent, buffer, tolerance)
+            _st_asmvt_available = True
+            return tile
+        except DBAPIError as e:
+            db.session.rollback()
+            # Tylko brak funkcji wyłącza ST_AsMVT; inne błędy (np. przerwane połączenie) są przekazywane dalej.
+            if _sqlstate(e) != UNDEFINED_FUNCTION:
+                raise
+            current_app.logger.warning(f"ST_AsMVT niedostępne - używam kodera w Pythonie: {e}")
+            _st_asmvt_available = False
+    return _render_python(z, x, y, extent, buffer, tolerance)
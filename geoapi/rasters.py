@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+
+import rasterio
+from flask import current_app
+
+from geouploader.models import CogRecord
+from geouploader.tiles import cog_source, gdal_env
+from geouploader.exceptions.custom_exceptions import ValidationError
+
+def resolve_cogs(refs):
+    """Zamienia listę identyfikatorów lub kluczy COG na wpisy katalogu (w kolejności żądania)."""
+    if not refs:
+        raise ValidationError("Wymagana lista 'cogs' (identyfikatory lub klucze COG z katalogu).")
+    ids = [ref for ref in refs if isinstance(ref, int)]
+    keys = [ref for ref in refs if isinstance(ref, str)]
+    records = {}
+    if ids:
+        records.update({record.id: record for record in CogRecord.query.filter(CogRecord.id.in_(ids))})
+    if keys:
+        records.update({record.key: record for record in CogRecord.query.filter(CogRecord.key.in_(keys))})
+    missing = [ref for ref in refs if ref not in records]
+    if missing:
+        raise ValidationError(f"Nie znaleziono COG w katalogu: {', '.join(str(ref) for ref in missing)}")
+    return [records[ref] for ref in refs]
+
+@contextmanager
+def open_cog(record, overview_level=None):
+    """Otwiera COG z katalogu (lokalnie, /vsis3/ lub /vsicurl/), opcjonalnie na poziomie piramidy."""
+    config = current_app.config
+    options = {} if overview_level is None else {'overview_level': overview_level}
+    with gdal_env(config):
+        with rasterio.open(cog_source(record.key, config), **options) as src:
+            yield src
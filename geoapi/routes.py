@@ -0,0 +1,212 @@
+import shapely
+from flask import request, jsonify, current_app, Response, stream_with_context
+
+from . import geoapi_bp
+from .geometries import parse_features, validate_geometries, insert_geometries, iter_geojson, parse_bbox
+from .mvt import LAYER_NAME as MVT_LAYER, MVT_MIMETYPE, render_geoms_tile
+from .export import (EXPORT_FORMATS, parse_target_crs, coordinate_batches, stored_geometry_batches,
+                     export_stream, export_filename)
+from .rasters import resolve_cogs
+from .sampling import sample_points
+from .zonal import load_geometries, zonal_stats
+from geouploader.exceptions.custom_exceptions import ValidationError
+from geouploader.crs import parse_crs
+from geouploader.tile_cache import tile_cache
+from geouploader.tiles import valid_tile
+
+# Maksymalna liczba błędów walidacji zwracana w odpowiedzi
+MAX_REPORTED_ERRORS = 100
+
+@geoapi_bp.route('/save_geom', methods=['POST'])
+def save_geometries():
+    """
+    Zapisuje geometrię lub całą FeatureCollection (EPSG:4326).
+    Parametr `repair=1` naprawia niepoprawne geometrie zamiast je odrzucać.
+    """
+    payload = request.get_json(silent=True)
+    try:
+        geoms = parse_features(payload)
+        valid, _, rejected = validate_geometries(geoms, repair=request.args.get('repair', '').lower() in ['1', 'true'])
+        if len(valid) == 0:
+            return jsonify({'error': 'Brak poprawnych geometrii', 'rejected': rejected[:MAX_REPORTED_ERRORS]}), 400
+
+        single = payload.get('type') != 'FeatureCollection'
+        ids = insert_geometries(valid, return_ids=single)
+        # Nieaktualne są tylko kafle w zasięgu nowych geometrii.
+        tile_cache.purge_bounds(MVT_LAYER, shapely.total_bounds(valid))
+        current_app.logger.info(f"Zapisano {len(valid)} geometrii, odrzucono {len(rejected)}.")
+
+        if single:
+            return jsonify({'id': ids[0]}), 201
+        return jsonify({
+            'inserted': len(valid),
+            'rejected_count': len(rejected),
+            'rejected': rejected[:MAX_REPORTED_ERRORS]
+        }), 201
+
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Błąd podczas zapisu geometrii: {e}", exc_info=True)
+        return jsonify({'error': 'Błąd serwera podczas zapisu geometrii'}), 500
+
+@geoapi_bp.route('/geoms')
+def query_geometries():
+    """Strumieniuje geometrie przecinające `bbox` (EPSG:4326) jako FeatureCollection."""
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        limit = request.args.get('limit', type=int)
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(stream_with_context(iter_geojson(bbox, limit)), mimetype='application/geo+json')
+
+@geoapi_bp.route('/geoms/tiles/<int:z>/<int:x>/<int:y>.mvt')
+def geometry_tile(z, x, y):
+    """Kafel wektorowy (MVT, EPSG:3857) z zapisanymi geometriami, z pamięci kafli."""
+    if not valid_tile(z, x, y):
+        return jsonify({'error': 'Nieprawidłowy kafel'}), 404
+    try:
+        tile, etag = tile_cache.get(MVT_LAYER, z, x, y, 'mvt', 256, lambda: render_geoms_tile(z, x, y))
+    except Exception as e:
+        current_app.logger.error(f"Błąd generowania kafla MVT {z}/{x}/{y}: {e}", exc_info=True)
+        return jsonify({'error': 'Błąd serwera podczas generowania kafla'}), 500
+    return tile_cache.response(tile, etag, MVT_MIMETYPE)
+
+@geoapi_bp.route('/zonal-stats', methods=['POST'])
+def compute_zonal_stats():
+    """
+    Statystyki strefowe (count, sum, mean, min, max, histogram) geometrii względem COG.
+    Treść JSON: `geometry_ids` (DrawnGeometry) lub `geometry` (GeoJSON, EPSG:4326),
+    `cogs` (identyfikatory lub klucze), opcjonalnie `bins`, `histogram_range`, `all_touched`.
+    """
+    config = current_app.config
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('geometry_ids'):
+            zone_ids = [int(i) for i in data['geometry_ids']]
+            geoms = load_geometries(zone_ids)
+        elif data.get('geometry'):
+            geoms, zone_ids, rejected = validate_geometries(parse_features(data['geometry']))
+            if rejected:
+                return jsonify({'error': 'Niepoprawne geometrie', 'rejected': rejected[:MAX_REPORTED_ERRORS]}), 400
+            zone_ids = zone_ids.tolist()
+        else:
+            return jsonify({'error': "Wymagany parametr 'geometry_ids' lub 'geometry'"}), 400
+        if len(geoms) > config['ZONAL_MAX_GEOMETRIES']:
+            return jsonify({'error': f"Za dużo geometrii (maksymalnie {config['ZONAL_MAX_GEOMETRIES']})"}), 400
+        records = resolve_cogs(data.get('cogs'))
+        bins = min(max(int(data.get('bins', 32)), 1), 1024)
+
+        results = []
+        for record in records:
+            zones, meta = zonal_stats(geoms, record, bins=bins,
+                                      histogram_range=data.get('histogram_range'),
+                                      all_touched=bool(data.get('all_touched')),
+                                      max_pixels=config['ZONAL_MAX_PIXELS'],
+                                      window_size=config['ZONAL_WINDOW_SIZE'])
+            results.append({
+                'cog_id': record.id,
+                'cog': record.key,
+                **meta,
+                'zones': [{'id': zone_id, 'bands': bands} for zone_id, bands in zip(zone_ids, zones)]
+            })
+        return jsonify({'results': results})
+
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': "Parametry 'geometry_ids' i 'bins' muszą być liczbami"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Błąd podczas liczenia statystyk strefowych: {e}", exc_info=True)
+        return jsonify({'error': 'Błąd serwera podczas liczenia statystyk strefowych'}), 500
+
+def _parse_sample_request():
+    if request.method == 'GET':
+        points = [[request.args.get('x', type=float), request.args.get('y', type=float)]]
+        cogs = [int(ref) if ref.isdigit() else ref for ref in request.args.get('cogs', '').split(',') if ref]
+        return points, request.args.get('crs', 'EPSG:4326'), cogs
+    data = request.get_json(silent=True) or {}
+    return data.get('points'), data.get('crs', 'EPSG:4326'), data.get('cogs')
+
+@geoapi_bp.route('/sample', methods=['GET', 'POST'])
+def sample():
+    """
+    Wartości pikseli COG w punktach. POST (JSON): `points` ([[x, y], ...]), `crs`
+    (domyślnie EPSG:4326), `cogs` (identyfikatory lub klucze). GET: `x`, `y`, `crs`,
+    `cogs` (po przecinku) - pojedyncze kliknięcie w przeglądarce.
+    """
+    config = current_app.config
+    try:
+        points, crs, cogs = _parse_sample_request()
+        crs = parse_crs(crs)
+        if not points:
+            return jsonify({'error': "Wymagany parametr 'points' (lub 'x' i 'y')"}), 400
+        if len(points) > config['SAMPLE_MAX_POINTS']:
+            return jsonify({'error': f"Za dużo punktów (maksymalnie {config['SAMPLE_MAX_POINTS']})"}), 400
+        xs = [float(point[0]) for point in points]
+        ys = [float(point[1]) for point in points]
+        records = resolve_cogs(cogs)
+
+        results = [{
+            'cog_id': record.id,
+            'cog': record.key,
+            'values': sample_points(record, xs, ys, crs, config['SAMPLE_BLOCK_SIZE'])
+        } for record in records]
+        return jsonify({'crs': crs, 'results': results})
+
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except (TypeError, ValueError, IndexError):
+        return jsonify({'error': "Punkty muszą mieć postać [x, y] z liczbami"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Błąd podczas próbkowania COG: {e}", exc_info=True)
+        return jsonify({'error': 'Błąd serwera podczas próbkowania rastrów'}), 500
+
+def _export_response(batches, fmt, crs, transformer, points, prefix):
+    """Odpowiedź strumieniowa eksportu; gzip (`Content-Encoding`) tylko, gdy klient go akceptuje."""
+    use_gzip = request.values.get('gzip', '').lower() in ['1', 'true'] and 'gzip' in request.accept_encodings
+    response = Response(stream_with_context(export_stream(batches, fmt, crs, transformer, points, use_gzip)),
+                        mimetype=EXPORT_FORMATS[fmt][0])
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(prefix, fmt)}'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    return response
+
+def _export_options(default_format):
+    fmt = request.values.get('format', default_format).lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValidationError(f"Nieobsługiwany format eksportu (dostępne: {', '.join(EXPORT_FORMATS)})")
+    return fmt, *parse_target_crs(request.values.get('crs'))
+
+@geoapi_bp.route('/export-coordinates', methods=['POST'])
+def export_coordinates():
+    """
+    Eksport punktów z przeglądarki: treść JSON `coordinates` ([{lng, lat} | {x, y}]),
+    parametry `format` (txt, csv, geojson, ndjson, fgb; domyślnie txt), `crs` (kod EPSG
+    docelowego układu) i `gzip=1`. Plik jest generowany strumieniowo.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'coordinates' not in data:
+        return jsonify({'error': 'Brak współrzędnych do eksportu'}), 400
+    try:
+        fmt, crs, transformer = _export_options('txt')
+        batches = coordinate_batches(data['coordinates'] or [], current_app.config['EXPORT_BATCH_SIZE'])
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    current_app.logger.info(f"Eksport {len(data['coordinates'])} współrzędnych ({fmt}, {crs})")
+    return _export_response(batches, fmt, crs, transformer, True, 'coordinates')
+
+@geoapi_bp.route('/export')
+def export_geometries():
+    """
+    Strumieniowy eksport zapisanych geometrii (opcjonalnie przecinających `bbox`,
+    EPSG:4326) w formacie `format` (domyślnie geojson), z `crs` i `gzip=1` jak wyżej.
+    """
+    try:
+        fmt, crs, transformer = _export_options('geojson')
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    batches = stored_geometry_batches(bbox, current_app.config['EXPORT_BATCH_SIZE'])
+    return _export_response(batches, fmt, crs, transformer, False, 'geometries')
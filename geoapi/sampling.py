@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from affine import Affine
+from rasterio.windows import Window
+
+from geouploader.crs import crs_key, get_transformer
+from .rasters import open_cog
+
+class BlockCache:
+    """
+    LRU zdekodowanych bloków COG współdzielone przez żądania, ograniczone sumą
+    rozmiarów tablic. Klucz zawiera ETag obiektu, więc nadpisany COG nie
+    zwraca starych bloków. Przechowuje też metadane rastra, żeby odczyt
+    z samych bloków w pamięci nie wymagał otwierania pliku.
+    """
+
+    def __init__(self):
+        self.max_bytes = 256 * 1024 * 1024
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def init_app(self, app):
+        self.max_bytes = app.config['SAMPLE_BLOCK_CACHE_MB'] * 1024 * 1024
+        app.extensions['geoapi_block_cache'] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters, entries=len(self._entries), bytes=self._bytes)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = counters['hits'] / lookups if lookups else None
+        return counters
+
+block_cache = BlockCache()
+
+def _dataset_meta(record):
+    key = ('meta', record.key, record.etag)
+    meta = block_cache.get(key)
+    if meta is None:
+        with open_cog(record) as src:
+            meta = {
+                'crs': crs_key(src.crs),
+                'transform': tuple(src.transform)[:6],
+                'width': src.width,
+                'height': src.height,
+                'count': src.count,
+                'nodata': src.nodata
+            }
+        block_cache.put(key, meta, 1024)
+    return meta
+
+def sample_points(record, xs, ys, crs='EPSG:4326', block_size=512):
+    """
+    Zwraca wartości pasm COG w punktach (listę list lub None poza rastrem / w nodata).
+
+    Współrzędne są przeliczane jednym wektorowym wywołaniem pyproj, grupowane
+    wg bloku rastra, a każdy blok jest czytany najwyżej raz i trafia do
+    współdzielonego `block_cache`. Bloki `block_size` x `block_size` pokrywają się
+    z kafelkami wewnętrznymi COG tworzonych przez aplikację (512 px).
+    """
+    meta = _dataset_meta(record)
+    xs, ys = np.asarray(xs, dtype='float64'), np.asarray(ys, dtype='float64')
+    if crs_key(crs) != meta['crs']:
+        xs, ys = get_transformer(crs, meta['crs']).transform(xs, ys)
+
+    cols, rows = ~Affine(*meta['transform']) * (np.asarray(xs), np.asarray(ys))
+    with np.errstate(invalid='ignore'):
+        inside = np.isfinite(cols) & np.isfinite(rows)
+        inside &= (cols >= 0) & (cols < meta['width']) & (rows >= 0) & (rows < meta['height'])
+    cols = np.where(inside, cols, 0).astype('int64')
+    rows = np.where(inside, rows, 0).astype('int64')
+
+    blocks_per_row = (meta['width'] + block_size - 1) // block_size
+    block_ids = (rows // block_size) * blocks_per_row + cols // block_size
+    values = np.full((len(cols), meta['count']), np.nan)
+    valid = np.zeros(len(cols), dtype=bool)
+
+    # Indeksy punktów pogrupowane wg bloku - jeden odczyt na blok.
+    inside_idx = np.flatnonzero(inside)
+    block_list, inverse = np.unique(block_ids[inside_idx], return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(inside_idx[order], np.cumsum(np.bincount(inverse))[:-1]) if len(inside_idx) else []
+
+    missing = []
+    for block_id, members in zip(block_list.tolist(), groups):
+        block = block_cache.get(('block', record.key, record.etag, block_size, block_id))
+        if block is None:
+            missing.append((block_id, members))
+        else:
+            _fill(values, valid, block, members, rows, cols, meta)
+
+    if missing:
+        with open_cog(record) as src:
+            for block_id, members in missing:
+                row_off = (block_id // blocks_per_row) * block_size
+                col_off = (block_id % blocks_per_row) * block_size
+                window = Window(col_off, row_off, min(block_size, meta['width'] - col_off),
+                                min(block_size, meta['height'] - row_off))
+                block = {'data': src.read(window=window), 'mask': src.dataset_mask(window=window) > 0,
+                         'row_off': row_off, 'col_off': col_off}
+                block_cache.put(('block', record.key, record.etag, block_size, block_id), block,
+                                block['data'].nbytes + block['mask'].nbytes)
+                _fill(values, valid, block, members, rows, cols, meta)
+
+    return [values[i].tolist() if valid[i] else None for i in range(len(cols))]
+
+def _fill(values, valid, block, selected, rows, cols, meta):
+    local_rows = rows[selected] - block['row_off']
+    local_cols = cols[selected] - block['col_off']
+    values[selected] = block['data'][:, local_rows, local_cols].T
+    ok = block['mask'][local_rows, local_cols]
+    if meta['nodata'] is not None:
+        ok &= ~np.all(values[selected] == meta['nodata'], axis=1)
+    valid[selected] = ok
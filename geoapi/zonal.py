@@ -0,0 +1,182 @@
+import math
+
+import numpy as np
+import shapely
+from rasterio.features import rasterize
+from rasterio.windows import Window, from_bounds
+from shapely.strtree import STRtree
+from sqlalchemy import func, select
+
+from app import db, DrawnGeometry
+from geouploader.crs import crs_key, get_transformer
+from geouploader.exceptions.custom_exceptions import ValidationError
+from .rasters import open_cog
+
+def load_geometries(ids):
+    """Wczytuje geometrie `DrawnGeometry` o podanych identyfikatorach (EPSG:4326)."""
+    rows = db.session.execute(
+        select(DrawnGeometry.id, func.ST_AsBinary(DrawnGeometry.geom)).where(DrawnGeometry.id.in_(ids))
+    ).all()
+    found = {geom_id: wkb for geom_id, wkb in rows}
+    missing = [geom_id for geom_id in ids if geom_id not in found]
+    if missing:
+        raise ValidationError(f"Nie znaleziono geometrii: {', '.join(str(i) for i in missing)}")
+    return shapely.from_wkb([bytes(found[geom_id]) for geom_id in ids])
+
+def _to_crs(geoms, dst_crs):
+    if crs_key(dst_crs) == 'EPSG:4326':
+        return geoms
+    transformer = get_transformer('EPSG:4326', dst_crs)
+    return shapely.transform(geoms, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+
+def zone_pixels(src, geoms):
+    """
+    Suma pól BBOX-ów geometrii (w układzie rastra) w pikselach pełnej rozdzielczości
+    - przybliżenie liczby odczytywanych pikseli, także dla stref rozrzuconych po rastrze.
+    """
+    bounds = shapely.bounds(geoms)
+    res_x, res_y = src.res
+    widths = np.maximum((bounds[:, 2] - bounds[:, 0]) / res_x, 1.0)
+    heights = np.maximum((bounds[:, 3] - bounds[:, 1]) / res_y, 1.0)
+    return float(np.sum(widths * heights))
+
+def select_overview(src, pixels, max_pixels):
+    """Poziom piramidy, przy którym `pixels` pikseli pełnej rozdzielczości mieści się w `max_pixels`."""
+    needed = math.sqrt(pixels / max_pixels)
+    if needed <= 1:
+        return None
+    factors = src.overviews(1)
+    for level, factor in enumerate(factors):
+        if factor >= needed:
+            return level
+    return len(factors) - 1 if factors else None
+
+def _non_overlapping_groups(geoms, candidates, all_touched=False):
+    """
+    Dzieli kandydatów okna na grupy bez wspólnego wnętrza (zachłanne kolorowanie
+    grafu nakładania się), aby każdą grupę zrasteryzować jednym przebiegiem.
+    Przy `all_touched` stykające się geometrie dzielą piksele granicy, więc też
+    trafiają do różnych grup.
+    """
+    tree = STRtree(geoms[candidates])
+    left, right = tree.query(geoms[candidates], predicate='intersects')
+    pairs = left < right
+    left, right = left[pairs], right[pairs]
+    if all_touched:
+        overlapping = np.ones(len(left), dtype=bool)
+    else:
+        overlapping = ~shapely.touches(geoms[candidates][left], geoms[candidates][right])
+    neighbours = {}
+    for a, b in zip(left[overlapping].tolist(), right[overlapping].tolist()):
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+
+    colours = {}
+    for i in range(len(candidates)):
+        used = {colours[n] for n in neighbours.get(i, ()) if n in colours}
+        colours[i] = next(c for c in range(len(candidates) + 1) if c not in used)
+    groups = {}
+    for i, colour in colours.items():
+        groups.setdefault(colour, []).append(candidates[i])
+    return list(groups.values())
+
+class ZonalAccumulator:
+    """Sumy częściowe statystyk strefowych dla n geometrii i b pasm, uzupełniane okno po oknie."""
+
+    def __init__(self, n, bands, bins, ranges):
+        self.bins = bins
+        self.ranges = ranges
+        self.count = np.zeros((n, bands), dtype='int64')
+        self.sum = np.zeros((n, bands), dtype='float64')
+        self.min = np.full((n, bands), np.inf)
+        self.max = np.full((n, bands), -np.inf)
+        self.histogram = np.zeros((n, bands, bins), dtype='int64')
+
+    def add(self, labels, data):
+        """`labels` - indeksy geometrii dla pikseli strefy, `data` - wartości pasm tych pikseli (b x k)."""
+        n = self.count.shape[0]
+        order = np.argsort(labels, kind='stable')
+        labels = labels[order]
+        present, starts = np.unique(labels, return_index=True)
+        counts = np.bincount(labels, minlength=n)
+        for band, values in enumerate(data):
+            values = values[order].astype('float64')
+            self.count[:, band] += counts
+            self.sum[:, band] += np.bincount(labels, weights=values, minlength=n)
+            self.min[present, band] = np.minimum(self.min[present, band], np.minimum.reduceat(values, starts))
+            self.max[present, band] = np.maximum(self.max[present, band], np.maximum.reduceat(values, starts))
+
+            low, high = self.ranges[band]
+            scale = self.bins / (high - low) if high > low else 0.0
+            bin_index = np.clip(((values - low) * scale).astype('int64'), 0, self.bins - 1)
+            self.histogram[:, band] += np.bincount(labels * self.bins + bin_index,
+                                                   minlength=n * self.bins).reshape(n, self.bins)
+
+    def result(self, index):
+        bands = []
+        for band in range(self.count.shape[1]):
+            count = int(self.count[index, band])
+            bands.append({
+                'count': count,
+                'sum': float(self.sum[index, band]),
+                'mean': float(self.sum[index, band] / count) if count else None,
+                'min': float(self.min[index, band]) if count else None,
+                'max': float(self.max[index, band]) if count else None,
+                'histogram': {
+                    'range': list(self.ranges[band]),
+                    'counts': self.histogram[index, band].tolist()
+                }
+            })
+        return bands
+
+def _histogram_ranges(src, record, histogram_range):
+    if histogram_range:
+        return [tuple(histogram_range)] * src.count
+    if src.dtypes[0] == 'uint8':
+        return [(0.0, 256.0)] * src.count
+    stats = record.band_stats or []
+    return [(stats[i]['min'], stats[i]['max']) if i < len(stats) else (0.0, 1.0) for i in range(src.count)]
+
+def zonal_stats(geoms, record, bins=32, histogram_range=None, all_touched=False,
+                max_pixels=50_000_000, window_size=1024):
+    """
+    Statystyki strefowe wszystkich geometrii (EPSG:4326) względem jednego COG
+    w jednym przebiegu po rastrze. Odczytywane są tylko okna w zasięgu geometrii,
+    dla dużych obszarów (suma BBOX-ów stref, zob. `zone_pixels`) z piramidy. W każdym oknie geometrie bez wspólnego wnętrza
+    są rasteryzowane razem do jednej mapy etykiet, a statystyki liczone przez
+    `np.bincount`/`reduceat` dla wszystkich stref naraz.
+    Zwraca (listę wyników dla kolejnych geometrii, metadane odczytu).
+    """
+    with open_cog(record) as src:
+        geoms_src = _to_crs(geoms, src.crs)
+        minx, miny, maxx, maxy = shapely.total_bounds(geoms_src)
+        level = select_overview(src, zone_pixels(src, geoms_src), max_pixels)
+
+    with open_cog(record, level) as src:
+        accumulator = ZonalAccumulator(len(geoms), src.count, bins, _histogram_ranges(src, record, histogram_range))
+        tree = STRtree(geoms_src)
+        area = from_bounds(minx, miny, maxx, maxy, transform=src.transform).round_offsets().round_lengths()
+        col_start, row_start = max(int(area.col_off), 0), max(int(area.row_off), 0)
+        col_stop = min(int(area.col_off + area.width) + 1, src.width)
+        row_stop = min(int(area.row_off + area.height) + 1, src.height)
+
+        for row in range(row_start, row_stop, window_size):
+            for col in range(col_start, col_stop, window_size):
+                window = Window(col, row, min(window_size, col_stop - col), min(window_size, row_stop - row))
+                window_transform = src.window_transform(window)
+                candidates = tree.query(shapely.box(*src.window_bounds(window)))
+                if len(candidates) == 0:
+                    continue
+                data = src.read(window=window)
+                valid = src.dataset_mask(window=window) > 0
+                for group in _non_overlapping_groups(geoms_src, candidates, all_touched):
+                    labels = rasterize(((geoms_src[i], int(i) + 1) for i in group),
+                                       out_shape=(int(window.height), int(window.width)),
+                                       transform=window_transform, fill=0, dtype='int32',
+                                       all_touched=all_touched)
+                    zone = (labels > 0) & valid
+                    if zone.any():
+                        accumulator.add(labels[zone] - 1, data[:, zone])
+
+        meta = {'overview_level': level, 'resolution': list(src.res), 'crs': crs_key(src.crs)}
+    return [accumulator.result(i) for i in range(len(geoms))], meta
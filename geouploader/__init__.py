@@ -12,3 +12,5 @@ geouploader_bp = Blueprint(
 # Importujemy logikę ścieżek (routes), aby zostały one powiązane z naszym Blueprintem.
 # Robimy to na końcu, aby uniknąć problemów z cyklicznym importem.
 from . import routes
+# Polecenia CLI (`flask geouploader ...`), m.in. zasilanie pamięci kafli.
+from . import commands
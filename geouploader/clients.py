@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+import boto3
+import requests
+from botocore.config import Config as BotoConfig
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+from .metrics import instrument_s3_client, observe_upstream
+
+class GeoServerSession(requests.Session):
+    """Sesja HTTP do GeoServera z uwierzytelnieniem, domyślnym timeoutem i pomiarem czasu wywołań."""
+
+    def __init__(self, auth, timeout):
+        super().__init__()
+        self.auth = auth
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        operation = f"{method.upper()} {'rest' if '/rest/' in url else 'ows'}"
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            observe_upstream('geoserver', operation, time.perf_counter() - start, error=True)
+            raise
+        observe_upstream('geoserver', operation, time.perf_counter() - start, error=response.status_code >= 500)
+        return response
+
+class ClientRegistry:
+    """
+    Współdzielone klienty S3 i GeoServera, tworzone raz na proces.
+
+    Klient boto3 i sesja requests są bezpieczne wątkowo i trzymają pule połączeń
+    keep-alive, więc kolejne żądania nie płacą za handshake TLS ani ponowne
+    wczytywanie poświadczeń. Po forku (np. gunicorn --preload) klienty są
+    tworzone od nowa, bo pul połączeń nie wolno dzielić między procesami.
+    """
+
+    def __init__(self):
+        self.config = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._s3 = None
+        self._geoserver = None
+
+    def init_app(self, app):
+        self.config = app.config
+        app.extensions['geouploader_clients'] = self
+
+    def _get_config(self):
+        return self.config if self.config is not None else current_app.config
+
+    def _reset_after_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._s3 = None
+            self._geoserver = None
+
+    def s3(self):
+        if self._s3 is not None and self._pid == os.getpid():
+            return self._s3
+        with self._lock:
+            self._reset_after_fork()
+            if self._s3 is None:
+                config = self._get_config()
+                self._s3 = instrument_s3_client(boto3.session.Session().client(
+                    's3',
+                    region_name=config['S3_LOCATION'],
+                    aws_access_key_id=config['S3_KEY'],
+                    aws_secret_access_key=config['S3_SECRET'],
+                    endpoint_url=config['AWS_ENDPOINT'],
+                    config=BotoConfig(
+                        max_pool_connections=config['S3_MAX_POOL_CONNECTIONS'],
+                        connect_timeout=config['S3_CONNECT_TIMEOUT'],
+                        read_timeout=config['S3_READ_TIMEOUT'],
+                        tcp_keepalive=True
+                    )
+                ))
+            return self._s3
+
+    def geoserver(self):
+        if self._geoserver is not None and self._pid == os.getpid():
+            return self._geoserver
+        with self._lock:
+            self._reset_after_fork()
+            if self._geoserver is None:
+                config = self._get_config()
+                session = GeoServerSession(
+                    auth=(config['GEOSERVER_USER'], config['GEOSERVER_PASSWORD']),
+                    timeout=(config['GEOSERVER_CONNECT_TIMEOUT'], config['GEOSERVER_READ_TIMEOUT'])
+                )
+                adapter = HTTPAdapter(pool_connections=config['GEOSERVER_POOL_CONNECTIONS'],
+                                      pool_maxsize=config['GEOSERVER_POOL_MAXSIZE'])
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._geoserver = session
+            return self._geoserver
+
+    def stats(self):
+        """Statystyki pul połączeń (na host) do doboru rozmiarów pul."""
+        stats = {'pid': os.getpid(), 's3': None, 'geoserver': None}
+        if self._s3 is not None:
+            try:
+                manager = self._s3._endpoint.http_session._manager
+                stats['s3'] = {
+                    'max_pool_connections': self._s3.meta.config.max_pool_connections,
+                    'pools': _pool_manager_stats(manager)
+                }
+            except AttributeError:
+                # Wewnętrzne API botocore - może się zmienić między wersjami.
+                stats['s3'] = {'max_pool_connections': self._s3.meta.config.max_pool_connections}
+        if self._geoserver is not None:
+            adapter = self._geoserver.get_adapter('http://')
+            stats['geoserver'] = {
+                'pool_maxsize': adapter._pool_maxsize,
+                'pools': _pool_manager_stats(adapter.poolmanager)
+            }
+        return stats
+
+def _pool_manager_stats(manager):
+    pools = []
+    for key in list(manager.pools.keys()):
+        pool = manager.pools.get(key)
+        if pool is None:
+            continue
+        pools.append({
+            'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+            'connections_created': pool.num_connections,
+            'requests': pool.num_requests,
+            'idle': pool.pool.qsize() if pool.pool is not None else 0,
+            'maxsize': pool.pool.maxsize if pool.pool is not None else 0
+        })
+    return pools
+
+clients = ClientRegistry()
+
+def get_s3_client():
+    return clients.s3()
+
+def get_geoserver_session():
+    return clients.geoserver()
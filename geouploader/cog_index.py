@@ -0,0 +1,73 @@
+import os
+
+import rasterio
+from flask import current_app
+from geoalchemy2.shape import from_shape
+from shapely.geometry import Polygon
+
+from app import db
+from .models import CogRecord
+from .crs import transform_footprint
+
+def read_cog_metadata(path):
+    """Czyta z pliku COG metadane zapisywane w katalogu (CRS, wymiary, piramidy, zasięg)."""
+    with rasterio.open(path) as src:
+        bounds = tuple(src.bounds)
+        return {
+            'crs': src.crs.to_string() if src.crs else None,
+            'width': src.width,
+            'height': src.height,
+            'band_count': src.count,
+            'overview_levels': src.overviews(1),
+            'bbox_epsg3857': ",".join(str(v) for v in bounds) if src.crs == 'EPSG:3857' else None,
+            'footprint': Polygon(transform_footprint(bounds, src.crs, 'EPSG:4326')) if src.crs else None
+        }
+
+def _summarize_band_stats(band_stats):
+    # Histogramy zostają w pamięci podręcznej statystyk - w katalogu tylko wartości skalarne.
+    return [{k: v for k, v in band.items() if k != 'histogram'} for band in band_stats or []]
+
+def register_cog(key, path, etag=None, band_stats=None, size=None):
+    """
+    Dodaje lub aktualizuje wpis katalogu COG dla obiektu `key` na podstawie pliku
+    `path` (lokalnego albo ścieżki GDAL, np. `/vsis3/` - wtedy trzeba podać `size`).
+    """
+    metadata = read_cog_metadata(path)
+    footprint = metadata.pop('footprint')
+
+    record = CogRecord.query.filter_by(key=key).one_or_none()
+    if record is None:
+        record = CogRecord(key=key)
+        db.session.add(record)
+
+    record.size = size if size is not None else os.path.getsize(path)
+    record.etag = etag
+    record.band_stats = _summarize_band_stats(band_stats)
+    record.footprint = from_shape(footprint, srid=4326) if footprint is not None else None
+    for name, value in metadata.items():
+        setattr(record, name, value)
+    db.session.commit()
+    return record
+
+def cog_url(key):
+    """Buduje publiczny URL obiektu COG (z uwzględnieniem własnego endpointu S3)."""
+    config = current_app.config
+    if config.get('AWS_ENDPOINT'):
+        return f"{config['AWS_ENDPOINT'].rstrip('/')}/{config['S3_BUCKET']}/{key}"
+    return f"https://{config['S3_BUCKET']}.s3.{config['S3_LOCATION']}.amazonaws.com/{key}"
+
+def list_cogs(prefix='cog/'):
+    """Zwraca listę COG z katalogu w bazie (jedno zapytanie po indeksie klucza)."""
+    records = (CogRecord.query
+               .with_entities(CogRecord.id, CogRecord.key, CogRecord.bbox_epsg3857)
+               .filter(CogRecord.key.startswith(prefix))
+               .order_by(CogRecord.key)
+               .all())
+    return [{'id': cog_id, 'key': key, 'url': cog_url(key), 'bbox': bbox} for cog_id, key, bbox in records]
+
+def get_cog_bbox(filename, prefix='cog/'):
+    record = (CogRecord.query
+              .with_entities(CogRecord.bbox_epsg3857)
+              .filter_by(key=prefix + filename)
+              .one_or_none())
+    return record.bbox_epsg3857 if record else None
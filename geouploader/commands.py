@@ -0,0 +1,95 @@
+import click
+from flask import current_app
+from geoalchemy2.shape import to_shape
+
+from app import db
+from . import geouploader_bp
+from .models import CogRecord
+from .tiles import TILE_FORMATS, render_tile, tiles_for_bounds, cog_source, gdal_env
+from .tile_cache import tile_cache, cog_layer
+from .cog_index import register_cog
+from .s3 import iter_objects
+from .stats import compute_band_stats
+from .search import search_index
+from .dedup import forget_target
+
+@geouploader_bp.cli.command('index-cogs')
+@click.option('--prefix', default='cog/', show_default=True, help='Prefiks obiektów COG w buckecie.')
+@click.option('--force', is_flag=True, help='Odczytuje ponownie także obiekty już obecne w katalogu.')
+def index_cogs(prefix, force):
+    """
+    Uzupełnia katalog COG o obiekty z bucketu (np. wysłane przed wprowadzeniem katalogu).
+    Obiekty już skatalogowane z tym samym ETagiem są pomijane. Metadane i statystyki
+    pasm są czytane zakresami z S3 (nagłówki i piramidy), bez pobierania całych plików.
+    """
+    config = current_app.config
+    known = dict(CogRecord.query.with_entities(CogRecord.key, CogRecord.etag).all())
+    added = updated = skipped = failed = 0
+    with gdal_env(config):
+        for obj in iter_objects(config['S3_BUCKET'], prefix):
+            key = obj['key']
+            if key.endswith('/'):
+                continue
+            if key in known and known[key] == obj['etag'] and not force:
+                skipped += 1
+                continue
+            source = cog_source(key, config)
+            try:
+                band_stats = compute_band_stats(source, mode=config['COG_STATS_MODE'], use_cache=False)
+                record = register_cog(key, source, etag=obj['etag'], band_stats=band_stats, size=obj['size'])
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                click.echo(f"Błąd odczytu '{key}': {e}", err=True)
+                continue
+            if key in known:
+                # Obiekt podmieniony w buckecie - kafle i wpis deduplikacji starej wersji są nieaktualne.
+                tile_cache.purge(cog_layer(record.id))
+                forget_target('cog', key)
+                updated += 1
+            else:
+                added += 1
+            click.echo(f"Skatalogowano '{key}'")
+    search_index.invalidate()
+    click.echo(f"Dodano {added}, zaktualizowano {updated}, pominięto {skipped}, błędy: {failed}.")
+    current_app.logger.info(f"Uzupełniono katalog COG: {added} nowych, {updated} zaktualizowanych, {failed} błędów.")
+
+@geouploader_bp.cli.command('seed-tiles')
+@click.argument('cog_id', type=int)
+@click.option('--bbox', help="Zasięg 'minlon,minlat,maxlon,maxlat' (EPSG:4326). Domyślnie zasięg COG.")
+@click.option('--zoom', 'zoom_range', default='0-14', show_default=True, help="Zakres poziomów, np. '10-16'.")
+@click.option('--format', 'fmt', type=click.Choice(sorted(TILE_FORMATS)), default='png', show_default=True)
+@click.option('--size', 'tile_size', type=click.Choice(['256', '512']), default='256', show_default=True)
+@click.option('--force', is_flag=True, help='Renderuje ponownie kafle, które już są na dysku.')
+def seed_tiles(cog_id, bbox, zoom_range, fmt, tile_size, force):
+    """Zasila dyskową pamięć kafli COG dla zasięgu i zakresu poziomów."""
+    record = CogRecord.query.get(cog_id)
+    if record is None:
+        raise click.ClickException(f"COG {cog_id} nie istnieje w katalogu.")
+    if bbox:
+        bounds = [float(v) for v in bbox.split(',')]
+    elif record.footprint is not None:
+        bounds = to_shape(record.footprint).bounds
+    else:
+        raise click.ClickException("COG nie ma zasięgu w katalogu - podaj --bbox.")
+    min_zoom, _, max_zoom = zoom_range.partition('-')
+    min_zoom, max_zoom = int(min_zoom), int(max_zoom or min_zoom)
+    tile_size = int(tile_size)
+
+    rendered = skipped = 0
+    for z in range(min_zoom, max_zoom + 1):
+        for x, y in tiles_for_bounds(bounds, z):
+            if tile_cache.seed(cog_layer(cog_id), z, x, y, fmt, tile_size,
+                               lambda: render_tile(record, z, x, y, fmt, tile_size), force=force):
+                rendered += 1
+            else:
+                skipped += 1
+        click.echo(f"z={z}: wyrenderowano {rendered}, pominięto {skipped}")
+    current_app.logger.info(f"Zasilono kafle COG {cog_id}: {rendered} nowych, {skipped} istniejących.")
+
+@geouploader_bp.cli.command('purge-tiles')
+@click.argument('layer')
+def purge_tiles(layer):
+    """Usuwa z pamięci kafli warstwę: WMS (`wms:<workspace>:<nazwa>`), COG (`cog-<id>`) albo `geoms`."""
+    tile_cache.purge(layer)
+    click.echo(f"Usunięto kafle warstwy '{layer}'.")
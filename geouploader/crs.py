@@ -0,0 +1,99 @@
+from functools import lru_cache
+
+import numpy as np
+from pyproj import CRS, Transformer
+from pyproj.exceptions import CRSError
+
+from .exceptions.custom_exceptions import ValidationError
+
+# Maksymalna liczba par (źródłowy, docelowy) CRS trzymanych w pamięci.
+TRANSFORMER_CACHE_SIZE = 128
+
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def _normalise_crs(value):
+    if isinstance(value, int):
+        return CRS.from_epsg(value).to_string()
+    return CRS.from_user_input(value).to_string()
+
+def crs_key(crs):
+    """
+    Zamienia CRS (tekst, kod EPSG, rasterio/pyproj CRS) na hashowalny klucz.
+    Tekst i kod EPSG są normalizowane przez pyproj ('epsg:2180' -> 'EPSG:2180');
+    nieznany CRS zgłasza `pyproj.exceptions.CRSError`.
+    """
+    if isinstance(crs, (int, str)) and not isinstance(crs, bool):
+        return _normalise_crs(crs)
+    if hasattr(crs, 'to_string'):
+        return crs.to_string()
+    return str(crs)
+
+def parse_crs(value):
+    """
+    Klucz CRS z parametru żądania (tekst, kod EPSG lub obiekt CRS); nieznany
+    układ albo wartość innego typu zgłasza ValidationError (400).
+    """
+    if isinstance(value, bool) or not (isinstance(value, (int, str)) or hasattr(value, 'to_string')):
+        raise ValidationError(f"Nieprawidłowy układ współrzędnych: {value!r}")
+    try:
+        return crs_key(value)
+    except CRSError:
+        raise ValidationError(f"Nieznany układ współrzędnych: {value}")
+
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def _cached_transformer(src_key, dst_key):
+    return Transformer.from_crs(src_key, dst_key, always_xy=True)
+
+def get_transformer(src_crs, dst_crs):
+    """
+    Zwraca Transformer (always_xy) dla pary CRS ze współdzielonego rejestru LRU.
+    Budowa transformera to zapytanie do bazy PROJ, więc robimy ją raz na parę.
+    Obiekty Transformer w pyproj >= 3.1 są bezpieczne wątkowo.
+    """
+    return _cached_transformer(crs_key(src_crs), crs_key(dst_crs))
+
+def transformer_cache_info():
+    return _cached_transformer.cache_info()._asdict()
+
+def densify_bounds(bounds, densify_pts=21):
+    """Zwraca współrzędne x, y obwodu BBOX z `densify_pts` punktami na każdy bok."""
+    minx, miny, maxx, maxy = bounds
+    steps = np.linspace(0.0, 1.0, densify_pts)
+    xs = np.concatenate([
+        minx + (maxx - minx) * steps,
+        np.full(densify_pts, maxx),
+        maxx - (maxx - minx) * steps,
+        np.full(densify_pts, minx)
+    ])
+    ys = np.concatenate([
+        np.full(densify_pts, miny),
+        miny + (maxy - miny) * steps,
+        np.full(densify_pts, maxy),
+        maxy - (maxy - miny) * steps
+    ])
+    return xs, ys
+
+def transform_footprint(bounds, src_crs, dst_crs, densify_pts=21):
+    """Zwraca obwód BBOX przeliczony do `dst_crs` jako listę (x, y) - gotowy pierścień poligonu."""
+    xs, ys = densify_bounds(bounds, densify_pts)
+    if crs_key(src_crs) != crs_key(dst_crs):
+        xs, ys = get_transformer(src_crs, dst_crs).transform(xs, ys)
+    return list(zip(np.asarray(xs).tolist(), np.asarray(ys).tolist()))
+
+def transform_bounds(bounds, src_crs, dst_crs, densify_pts=21):
+    """
+    Przelicza BBOX (minx, miny, maxx, maxy) do innego CRS.
+
+    Krawędzie prostokąta są zagęszczane do `densify_pts` punktów na bok i
+    wszystkie punkty są transformowane jednym wywołaniem NumPy, więc wynik
+    obejmuje cały obszar także dla odwzorowań, w których krawędzie są krzywymi.
+    """
+    if crs_key(src_crs) == crs_key(dst_crs):
+        return tuple(float(v) for v in bounds)
+
+    xs, ys = densify_bounds(bounds, densify_pts)
+    out_x, out_y = get_transformer(src_crs, dst_crs).transform(xs, ys)
+    finite = np.isfinite(out_x) & np.isfinite(out_y)
+    if not finite.any():
+        raise ValueError(f"Nie można przeliczyć zasięgu z {crs_key(src_crs)} do {crs_key(dst_crs)}.")
+    return (float(out_x[finite].min()), float(out_y[finite].min()),
+            float(out_x[finite].max()), float(out_y[finite].max()))
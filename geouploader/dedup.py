@@ -0,0 +1,104 @@
+import hashlib
+from datetime import datetime
+
+import requests
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from .models import UploadArtifact, CogRecord
+from .layer_cache import layer_cache
+
+def content_hasher():
+    """Nowy obiekt skrótu treści uploadu (BLAKE2b, 256 bitów)."""
+    return hashlib.blake2b(digest_size=32)
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Skrót treści pliku już zapisanego na dysku, czytanego kawałkami."""
+    digest = content_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _target_exists(artifact):
+    """True/False - czy cel artefaktu istnieje; None, gdy nie da się tego sprawdzić."""
+    if artifact.kind == 'cog':
+        return CogRecord.query.filter_by(key=artifact.target).first() is not None
+    try:
+        return artifact.target in {layer['name'] for layer in layer_cache.get_layers()}
+    except requests.exceptions.RequestException as e:
+        current_app.logger.warning(f"Nie można sprawdzić warstwy '{artifact.target}' w GeoServerze: {e}")
+        return None
+
+def find_artifact(content_hash, kind):
+    """
+    Zwraca artefakt (`UploadArtifact`) dla pliku o tej samej treści albo None.
+    Wpisy, których cel usunięto z S3/GeoServera, są kasowane. Gdy istnienia celu
+    nie da się sprawdzić (np. GeoServer nie odpowiada), deduplikacja jest
+    pomijana, ale wpis zostaje.
+    """
+    artifact = UploadArtifact.query.filter_by(content_hash=content_hash, kind=kind).one_or_none()
+    if artifact is None:
+        return None
+    exists = _target_exists(artifact)
+    if exists is None:
+        return None
+    if not exists:
+        current_app.logger.info(f"Artefakt {kind} '{artifact.target}' już nie istnieje - usuwam wpis deduplikacji.")
+        db.session.delete(artifact)
+        db.session.commit()
+        return None
+    return artifact
+
+def forget_target(kind, target, keep_hash=None):
+    """
+    Usuwa wpisy wskazujące na `target` (poza treścią `keep_hash`) - cel został
+    nadpisany inną treścią, więc nie jest już duplikatem starych plików.
+    """
+    query = UploadArtifact.query.filter_by(kind=kind, target=target)
+    if keep_hash is not None:
+        query = query.filter(UploadArtifact.content_hash != keep_hash)
+    query.delete(synchronize_session=False)
+    db.session.commit()
+
+def register_artifact(content_hash, kind, target, size, cpu_seconds, details=None):
+    """
+    Zapamiętuje wynik przetworzenia pliku, zastępując wpisy innej treści dla tego
+    samego celu. Przy wyścigu dwóch identycznych uploadów wygrywa pierwszy.
+    """
+    forget_target(kind, target, keep_hash=content_hash)
+    artifact = UploadArtifact(content_hash=content_hash, kind=kind, target=target, size=size,
+                              cpu_seconds=cpu_seconds, details=details)
+    db.session.add(artifact)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+def record_hit(artifact, size):
+    """Zlicza ponowne użycie artefaktu: oszczędzone bajty (transfer, zapis) i sekundy CPU przetwarzania."""
+    artifact.hits += 1
+    artifact.bytes_saved += size
+    artifact.cpu_seconds_saved += artifact.cpu_seconds
+    artifact.last_hit_at = datetime.utcnow()
+    db.session.commit()
+
+def dedup_stats():
+    """Sumaryczne oszczędności deduplikacji w podziale na rodzaj artefaktu."""
+    rows = (db.session.query(UploadArtifact.kind,
+                             func.count(UploadArtifact.id),
+                             func.coalesce(func.sum(UploadArtifact.hits), 0),
+                             func.coalesce(func.sum(UploadArtifact.bytes_saved), 0),
+                             func.coalesce(func.sum(UploadArtifact.cpu_seconds_saved), 0.0))
+            .group_by(UploadArtifact.kind).all())
+    return {
+        kind: {
+            'artifacts': artifacts,
+            'hits': int(hits),
+            'bytes_saved': int(bytes_saved),
+            'cpu_seconds_saved': float(cpu_seconds_saved)
+        }
+        for kind, artifacts, hits, bytes_saved, cpu_seconds_saved in rows
+    }
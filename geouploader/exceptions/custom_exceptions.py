@@ -1,2 +1,8 @@
 class ValidationError(Exception):
     pass
+
+class CogValidationError(Exception):
+    pass
+
+class LayerNotFoundError(Exception):
+    pass
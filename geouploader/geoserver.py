@@ -1,6 +1,31 @@
-import requests
+import os
 from flask import current_app
 
+from .clients import get_geoserver_session
+from .layer_cache import layer_cache
+from .layer_info import layer_info_cache
+from .search import search_index
+from .tile_cache import tile_cache, wms_layer
+from .wms_proxy import wms_proxy
+
+class ChunkedFileReader:
+    """
+    Opakowanie pliku dla requests/http.client: każde `read()` zwraca najwyżej
+    `chunk_size` bajtów (zamiast domyślnych 8 KB bloku http.client), a `len()`
+    pozwala wysłać nagłówek Content-Length zamiast kodowania chunked.
+    """
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.size = os.fstat(f.fileno()).st_size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        return self.f.read(self.chunk_size)
+
 def publish_geotiff_directly(layer_name, filepath):
     """
     Publikuje GeoTIFF przez bezpośrednie wysłanie pliku do GeoServera.
@@ -10,12 +35,6 @@ def publish_geotiff_directly(layer_name, filepath):
     config = current_app.config
     logger = current_app.logger
     
-    auth = (config['GEOSERVER_USER'], config['GEOSERVER_PASSWORD'])
-    
-    # Odczytanie zawartości pliku w trybie binarnym
-    with open(filepath, 'rb') as f:
-        file_data = f.read()
-
     # Ustawienie nagłówka dla danych binarnych GeoTIFF
     headers = {'Content-type': 'image/tiff'}
     
@@ -25,8 +44,10 @@ def publish_geotiff_directly(layer_name, filepath):
     
     logger.info(f"Wysyłanie żądania PUT z plikiem GeoTIFF do {url}")
     
-    # Wysłanie żądania PUT z danymi pliku
-    response = requests.put(url, data=file_data, auth=auth, headers=headers)
+    # Wysłanie żądania PUT - plik jest czytany kawałkami, a nie w całości do pamięci
+    with open(filepath, 'rb') as f:
+        response = get_geoserver_session().put(url, data=ChunkedFileReader(f, config['UPLOAD_CHUNK_SIZE']),
+                                               headers=headers)
 
     # GeoServer powinien odpowiedzieć 201 (Created) lub 200 (OK), jeśli nadpisujemy
     if response.status_code not in [200, 201]:
@@ -35,6 +56,51 @@ def publish_geotiff_directly(layer_name, filepath):
         logger.error(error_message)
         raise Exception(error_message)
 
+    layer_cache.invalidate(config['GEOSERVER_WORKSPACE'])
+    layer_info_cache.invalidate(layer_name)
+    search_index.invalidate()
+    tile_cache.purge(wms_layer(config['GEOSERVER_WORKSPACE'], layer_name))
+    wms_proxy.invalidate_capabilities(config['GEOSERVER_WORKSPACE'])
     logger.info(f"Pomyślnie wysłano plik i opublikowano warstwę '{layer_name}'.")
 
+def publish_coverage_alias(layer_name, store_name):
+    """
+    Publikuje warstwę `layer_name` jako kolejne pokrycie istniejącego
+    CoverageStore `store_name` - bez ponownego wysyłania pliku GeoTIFF.
+    """
+    config = current_app.config
+    logger = current_app.logger
+    session = get_geoserver_session()
+    store_url = f"{config['GEOSERVER_URL']}/workspaces/{config['GEOSERVER_WORKSPACE']}/coveragestores/{store_name}"
+
+    response = session.get(f"{store_url}/coverages.json")
+    response.raise_for_status()
+    coverages = (response.json().get('coverages') or {}).get('coverage', [])
+    if isinstance(coverages, dict):
+        coverages = [coverages]
+    if not coverages:
+        raise Exception(f"Magazyn '{store_name}' nie zawiera pokrycia do ponownego użycia.")
+
+    source = session.get(coverages[0]['href'], headers={'Accept': 'application/json'})
+    source.raise_for_status()
+    native_name = source.json()['coverage']['nativeName']
+
+    logger.info(f"Publikowanie warstwy '{layer_name}' jako aliasu pokrycia '{native_name}' z magazynu '{store_name}'")
+    response = session.post(f"{store_url}/coverages", json={'coverage': {
+        'name': layer_name,
+        'title': layer_name,
+        'nativeName': native_name,
+        'nativeCoverageName': native_name
+    }})
+    if response.status_code not in [200, 201]:
+        error_message = (f"Nie udało się opublikować aliasu warstwy. "
+                         f"Status: {response.status_code}, Treść: {response.text}")
+        logger.error(error_message)
+        raise Exception(error_message)
 
+    layer_cache.invalidate(config['GEOSERVER_WORKSPACE'])
+    layer_info_cache.invalidate(layer_name)
+    search_index.invalidate()
+    tile_cache.purge(wms_layer(config['GEOSERVER_WORKSPACE'], layer_name))
+    wms_proxy.invalidate_capabilities(config['GEOSERVER_WORKSPACE'])
+    logger.info(f"Opublikowano warstwę '{layer_name}' bez ponownego przetwarzania pliku.")
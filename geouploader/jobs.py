@@ -0,0 +1,324 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app import db
+from .models import UploadJob
+from .geoserver import publish_geotiff_directly, publish_coverage_alias
+from .util import convert_upload_to_cog
+from .s3 import upload_file_multipart, abort_multipart
+from .clients import get_s3_client
+from .stats import compute_band_stats
+from .cog_index import register_cog
+from .search import search_index
+from .tile_cache import tile_cache, cog_layer
+from .dedup import register_artifact, find_artifact, record_hit, forget_target
+from .metrics import timed_stage, cpu_timer
+
+STAGES = ('save', 'validate', 'convert', 'upload', 'publish')
+
+class JobContext:
+    """Przekazywany do funkcji zadania - raportuje postęp etapów do tabeli zadań."""
+
+    def __init__(self, job_id, params, stages=None):
+        self.job_id = job_id
+        self.params = params
+        self.stages = stages or {}
+        self.current_stage = None
+        self._last_progress = None
+        # Czas CPU ukończonych etapów (wątek zadania i jego pule wątków, zob. `cpu_timer`),
+        # łącznie z etapami z poprzedniej próby.
+        self.cpu_seconds = sum(stage.get('cpu_seconds', 0.0) for stage in self.stages.values())
+
+    @contextmanager
+    def stage(self, name):
+        self.current_stage = name
+        self._last_progress = None
+        _update_stage(self.job_id, name, status='running', started_at=_now())
+        with timed_stage(name), cpu_timer() as timer:
+            yield
+        cpu_seconds = timer.seconds
+        self.cpu_seconds += cpu_seconds
+        _update_stage(self.job_id, name, status='done', progress=1.0, finished_at=_now(),
+                      cpu_seconds=round(cpu_seconds, 3))
+        self.current_stage = None
+
+    def stage_done(self, name):
+        return self.stages.get(name, {}).get('status') == 'done'
+
+    def progress(self, done, total):
+        """Zapisuje postęp bieżącego etapu, najwyżej raz na każdy pełny procent."""
+        if not total or self.current_stage is None:
+            return
+        progress = round(done / total, 2)
+        if progress != self._last_progress:
+            self._last_progress = progress
+            _update_stage(self.job_id, self.current_stage, progress=progress)
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+def _update_stage(job_id, name, **fields):
+    job = db.session.get(UploadJob, job_id)
+    stages = dict(job.stages or {})
+    stages[name] = {**stages.get(name, {}), **fields}
+    job.stages = stages
+    job.stage = name
+    db.session.commit()
+
+def run_geoserver_job(ctx):
+    params = ctx.params
+    result = {'layer_name': params['layer_name'], 'bbox_epsg3857': params.get('bbox_epsg3857')}
+
+    # Duplikat opublikowanego już pliku: nowa warstwa wskazuje istniejący magazyn.
+    artifact = find_artifact(params['content_hash'], 'geoserver') if params.get('alias_of') else None
+    if artifact is not None:
+        with ctx.stage('publish'):
+            publish_coverage_alias(params['layer_name'], artifact.target)
+        # Warstwa wskazuje teraz cudzy magazyn - jej wcześniejsza treść nie jest już dostępna.
+        forget_target('geoserver', params['layer_name'], keep_hash=params['content_hash'])
+        record_hit(artifact, os.path.getsize(params['filepath']))
+        return {**result, 'duplicate_of': artifact.target}
+
+    with ctx.stage('publish'):
+        publish_geotiff_directly(params['layer_name'], params['filepath'])
+    if params.get('content_hash'):
+        register_artifact(params['content_hash'], 'geoserver', params['layer_name'],
+                          os.path.getsize(params['filepath']), ctx.cpu_seconds,
+                          details={'bbox_epsg3857': params.get('bbox_epsg3857')})
+    else:
+        forget_target('geoserver', params['layer_name'])
+    return result
+
+def run_cog_job(ctx):
+    params = ctx.params
+    input_path = params['input_path']
+    output_path = params['output_path']
+
+    # Przy ponowieniu zadania pomijamy gotową konwersję, a multipart upload
+    # wznawia się od brakujących części - dlatego plik COG zostaje na dysku
+    # do czasu udanego wysłania.
+    if not (ctx.stage_done('convert') and os.path.exists(output_path)):
+        try:
+            with ctx.stage('convert'):
+                convert_upload_to_cog(input_path, output_path, progress=ctx.progress,
+                                      content_hash=params.get('content_hash'))
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+    with ctx.stage('upload'):
+        etag = upload_file_multipart(output_path, params['object_name'], progress=ctx.progress)
+        # Statystyki pasm źródła są już w pamięci podręcznej po konwersji.
+        band_stats = compute_band_stats(input_path, mode=current_app.config['COG_STATS_MODE'],
+                                        content_hash=params.get('content_hash'))
+        record = register_cog(params['object_name'], output_path, etag=etag, band_stats=band_stats)
+        search_index.invalidate()
+        # Nadpisany obiekt zachowuje identyfikator w katalogu - stare kafle są nieaktualne.
+        tile_cache.purge(cog_layer(record.id))
+    if params.get('content_hash'):
+        register_artifact(params['content_hash'], 'cog', params['object_name'],
+                          os.path.getsize(input_path), ctx.cpu_seconds)
+    else:
+        forget_target('cog', params['object_name'])
+
+    for path in (input_path, output_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return {'object_name': params['object_name']}
+
+def cleanup_cog_job(params):
+    """Sprzątanie porzuconego zadania COG: przerwany multipart upload i pliki robocze."""
+    abort_multipart(get_s3_client(), params['output_path'])
+    for path in (params['input_path'], params['output_path']):
+        if os.path.exists(path):
+            os.remove(path)
+
+JOB_HANDLERS = {
+    'geoserver': run_geoserver_job,
+    'cog': run_cog_job
+}
+
+# Sprzątanie po zadaniach porzuconych (`JobQueue.abandon`) - tylko typy, które zostawiają zasoby.
+JOB_CLEANUP = {
+    'cog': cleanup_cog_job
+}
+
+class JobQueue:
+    """
+    Lokalna kolejka zadań: stan w tabeli `upload_jobs`, wykonanie w puli wątków
+    procesu aplikacji. Nie wymaga zewnętrznego brokera.
+
+    Przy kilku procesach (np. workerach gunicorna) każdy z nich może wstawić to
+    samo zadanie do swojej puli, ale wykona je tylko ten, który pierwszy przejmie
+    je warunkowym UPDATE (status 'queued' -> 'running' z właścicielem). Wątek
+    heartbeat odświeża `heartbeat_at` zadań procesu, a zadania 'running' bez
+    heartbeatu dłużej niż JOB_STALE_AFTER są uznawane za przerwane.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._submitted = set()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['geouploader_jobs'] = self
+        with app.app_context():
+            self._recover()
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _start(self):
+        """Pula wątków i wątek heartbeat procesu - tworzone od nowa po forku."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOB_WORKERS'],
+                                                thread_name_prefix='geouploader-job')
+            self._submitted = set()
+            threading.Thread(target=self._heartbeat_loop, name='geouploader-job-heartbeat', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _enqueue(self, job_id):
+        self._start()
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.app.config['JOB_HEARTBEAT_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    UploadJob.query.filter_by(status='running', owner=self.owner).update(
+                        {'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                    db.session.commit()
+                    self._recover()
+            except Exception:
+                self.app.logger.warning("Błąd odświeżania heartbeatu zadań.", exc_info=True)
+
+    def _recover(self):
+        # Zadania 'running', których proces przestał odświeżać heartbeat (restart,
+        # zabity worker), nie mogą być wznowione. Zadania oczekujące trafiają do
+        # kolejki - także te wstawione przez proces, który już nie działa.
+        stale_before = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_STALE_AFTER'])
+        UploadJob.query.filter(
+            UploadJob.status == 'running',
+            or_(UploadJob.heartbeat_at.is_(None), UploadJob.heartbeat_at < stale_before)
+        ).update({'status': 'failed', 'error': 'Zadanie przerwane - proces wykonujący przestał działać.'},
+                 synchronize_session=False)
+        db.session.commit()
+        for (job_id,) in db.session.query(UploadJob.id).filter_by(status='queued').all():
+            self._enqueue(job_id)
+        # Zadania z błędem, których nikt nie ponowił przez JOB_ABANDON_AFTER_HOURS, są porzucane.
+        abandon_before = datetime.utcnow() - timedelta(hours=self.app.config['JOB_ABANDON_AFTER_HOURS'])
+        for (job_id,) in db.session.query(UploadJob.id).filter(UploadJob.status == 'failed',
+                                                                 UploadJob.updated_at < abandon_before).all():
+            self.abandon(job_id)
+
+    def _claim(self, job_id):
+        """Atomowo przejmuje zadanie oczekujące. False, jeśli przejął je inny proces."""
+        now = datetime.utcnow()
+        claimed = UploadJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'owner': self.owner, 'heartbeat_at': now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def submit(self, kind, params, completed_stages=()):
+        """Zapisuje nowe zadanie i wstawia je do kolejki. Zwraca identyfikator zadania."""
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Nieznany typ zadania: {kind}")
+        now = _now()
+        job = UploadJob(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            status='queued',
+            params=params,
+            stages={name: {'status': 'done', 'progress': 1.0, 'finished_at': now} for name in completed_stages}
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._enqueue(job.id)
+        return job.id
+
+    def retry(self, job_id):
+        """Ponownie wstawia do kolejki zadanie zakończone błędem. Ukończone etapy są zachowane."""
+        job = db.session.get(UploadJob, job_id)
+        if job is None or job.status != 'failed':
+            return False
+        job.status = 'queued'
+        job.error = None
+        db.session.commit()
+        self._enqueue(job.id)
+        return True
+
+    def abandon(self, job_id):
+        """
+        Porzuca zadanie zakończone błędem: przerywa jego multipart upload w S3
+        i usuwa pliki robocze. Porzuconego zadania nie można już ponowić.
+        """
+        abandoned = UploadJob.query.filter_by(id=job_id, status='failed').update(
+            {'status': 'abandoned'}, synchronize_session=False)
+        db.session.commit()
+        if not abandoned:
+            return False
+        job = db.session.get(UploadJob, job_id)
+        cleanup = JOB_CLEANUP.get(job.kind)
+        if cleanup:
+            try:
+                cleanup(job.params)
+            except Exception:
+                # Części w S3 usunie reguła cyklu życia bucketu (AbortIncompleteMultipartUpload).
+                self.app.logger.warning(f"Sprzątanie porzuconego zadania {job_id} nie powiodło się.", exc_info=True)
+        return True
+
+    def _run(self, job_id):
+        with self._lock:
+            self._submitted.discard(job_id)
+        with self.app.app_context():
+            logger = self.app.logger
+            if not self._claim(job_id):
+                return
+            job = db.session.get(UploadJob, job_id)
+            ctx = JobContext(job_id, job.params, dict(job.stages or {}))
+
+            try:
+                result = JOB_HANDLERS[job.kind](ctx)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Zadanie {job_id} ({job.kind}) zakończone błędem.", exc_info=True)
+                job = db.session.get(UploadJob, job_id)
+                if ctx.current_stage:
+                    stages = dict(job.stages or {})
+                    stages[ctx.current_stage] = {**stages.get(ctx.current_stage, {}),
+                                                  'status': 'failed', 'finished_at': _now()}
+                    job.stages = stages
+                job.status = 'failed'
+                job.error = str(e)
+                db.session.commit()
+                return
+
+            job = db.session.get(UploadJob, job_id)
+            job.status = 'done'
+            job.result = result
+            db.session.commit()
+            logger.info(f"Zadanie {job_id} ({job.kind}) zakończone pomyślnie.")
+
+job_queue = JobQueue()
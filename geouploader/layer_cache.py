@@ -0,0 +1,130 @@
+import time
+import threading
+
+from flask import current_app
+
+from .clients import get_geoserver_session
+
+class LayerCatalogCache:
+    """
+    Pamięć podręczna listy warstw workspace'u GeoServera (`layers.json`).
+
+    - wpis świeży (młodszy niż `ttl`) jest zwracany bez zapytania do GeoServera,
+    - wpis nieświeży, ale młodszy niż `stale_ttl`, jest zwracany od razu,
+      a w tle uruchamiana jest rewalidacja (stale-while-revalidate),
+    - starszy wpis jest rewalidowany synchronicznie z `If-None-Match`,
+      więc przy niezmienionej liście GeoServer odpowiada tylko 304.
+    """
+
+    def __init__(self):
+        self.ttl = 30
+        self.stale_ttl = 300
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._counters = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'not_modified': 0,
+                          'refreshes': 0, 'errors': 0, 'invalidations': 0}
+
+    def init_app(self, app):
+        self.ttl = app.config['LAYER_CACHE_TTL']
+        self.stale_ttl = app.config['LAYER_CACHE_STALE_TTL']
+        app.extensions['geouploader_layer_cache'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get_layers(self, workspace=None):
+        """Zwraca listę warstw (słowniki z `name` i `href`) z workspace'u."""
+        config = current_app.config
+        workspace = workspace or config['GEOSERVER_WORKSPACE']
+        url = f"{config['GEOSERVER_URL']}/workspaces/{workspace}/layers.json"
+
+        entry = self._entries.get(workspace)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry['fetched_at']
+            if age < self.ttl:
+                self._count('hits')
+                return entry['layers']
+            if age < self.stale_ttl:
+                self._count('stale_hits')
+                self._refresh_in_background(current_app._get_current_object(), workspace, url)
+                return entry['layers']
+
+        self._count('misses')
+        try:
+            return self._refresh(workspace, url)
+        except Exception:
+            self._count('errors')
+            if entry is not None:
+                current_app.logger.warning(f"GeoServer niedostępny, zwracam nieświeżą listę warstw '{workspace}'.")
+                return entry['layers']
+            raise
+
+    def _refresh(self, workspace, url):
+        entry = self._entries.get(workspace)
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+
+        response = get_geoserver_session().get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self._count('not_modified')
+            self._entries[workspace] = {**entry, 'fetched_at': time.monotonic()}
+            return entry['layers']
+        response.raise_for_status()
+
+        self._count('refreshes')
+        layers = _parse_layers(response.json())
+        self._entries[workspace] = {
+            'layers': layers,
+            'etag': response.headers.get('ETag'),
+            'fetched_at': time.monotonic()
+        }
+        return layers
+
+    def _refresh_in_background(self, app, workspace, url):
+        with self._lock:
+            if workspace in self._refreshing:
+                return
+            self._refreshing.add(workspace)
+
+        def run():
+            try:
+                with app.app_context():
+                    self._refresh(workspace, url)
+            except Exception:
+                self._count('errors')
+                app.logger.warning(f"Rewalidacja listy warstw '{workspace}' nie powiodła się.", exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(workspace)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def invalidate(self, workspace=None):
+        """Usuwa listę warstw z pamięci (po publikacji nowej warstwy)."""
+        with self._lock:
+            if workspace is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(workspace, None)
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['stale_hits'] + counters['misses']
+        counters['hit_ratio'] = (counters['hits'] + counters['stale_hits']) / lookups if lookups else None
+        counters['workspaces'] = list(self._entries.keys())
+        return counters
+
+def _parse_layers(layers_data):
+    layers = layers_data.get('layers') or {}
+    layer_list = layers.get('layer', []) if isinstance(layers, dict) else []
+    if isinstance(layer_list, dict):
+        layer_list = [layer_list]
+    return [{'name': layer['name'], 'href': layer.get('href')} for layer in layer_list]
+
+layer_cache = LayerCatalogCache()
@@ -0,0 +1,189 @@
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .clients import get_geoserver_session
+from .crs import transform_bounds
+from .exceptions.custom_exceptions import LayerNotFoundError
+
+def fetch_layer_info(layer_name, config, logger):
+    """
+    Pobiera z GeoServera dokument warstwy i jej zasobu (coverage/featureType)
+    i buduje słownik z metadanymi warstwy oraz BBOX w EPSG:3857.
+    """
+    session = get_geoserver_session()
+    url = f"{config['GEOSERVER_URL']}/workspaces/{config['GEOSERVER_WORKSPACE']}/layers/{layer_name}"
+
+    logger.info(f"Pobieranie informacji o warstwie: {url}")
+
+    response = session.get(url, headers={'Accept': 'application/json'})
+
+    if response.status_code == 404:
+        raise LayerNotFoundError(layer_name)
+    response.raise_for_status()
+
+    layer_dict = response.json().get('layer', {})
+
+    layer_info = {
+        'name': layer_dict.get('name', layer_name),
+        'title': layer_dict.get('title', layer_name),
+        'abstract': layer_dict.get('abstract', ''),
+        'type': layer_dict.get('type', 'WMS'),
+        'enabled': layer_dict.get('enabled', True),
+        'wms_url': f"{config['GEOSERVER_URL'].replace('/rest', '')}/{config['GEOSERVER_WORKSPACE']}/wms"
+    }
+
+    if 'resource' in layer_dict:
+        resource_response = session.get(layer_dict['resource']['href'], headers={'Accept': 'application/json'})
+        if resource_response.status_code == 200:
+            _add_bounding_box(layer_info, resource_response.json(), layer_name, logger)
+
+    return layer_info
+
+def _add_bounding_box(layer_info, resource_data, layer_name, logger):
+    bbox_info = None
+    source_crs = None
+
+    if 'coverage' in resource_data:
+        coverage = resource_data['coverage']
+        if 'nativeBoundingBox' in coverage:
+            bbox_info = coverage['nativeBoundingBox']
+            source_crs = bbox_info.get('crs', 'EPSG:4326')
+
+    elif 'featureType' in resource_data:
+        feature_type = resource_data['featureType']
+        if 'nativeBoundingBox' in feature_type:
+            bbox_info = feature_type['nativeBoundingBox']
+            source_crs = bbox_info.get('crs', 'EPSG:4326')
+
+    if not bbox_info:
+        return
+
+    try:
+        minx, miny = float(bbox_info['minx']), float(bbox_info['miny'])
+        maxx, maxy = float(bbox_info['maxx']), float(bbox_info['maxy'])
+
+        layer_info['boundingBox'] = {
+            'minx': minx,
+            'miny': miny,
+            'maxx': maxx,
+            'maxy': maxy,
+            'crs': source_crs
+        }
+
+        minx_3857, miny_3857 = minx, miny
+        maxx_3857, maxy_3857 = maxx, maxy
+        try:
+            if source_crs and source_crs != 'EPSG:3857':
+                epsg_match = re.search(r'EPSG["\s]*[,:]?\s*["\s]*(\d+)', str(source_crs))
+                if epsg_match:
+                    epsg_code = f"EPSG:{epsg_match.group(1)}"
+                    minx_3857, miny_3857, maxx_3857, maxy_3857 = transform_bounds(
+                        (minx, miny, maxx, maxy), epsg_code, "EPSG:3857")
+                else:
+                    logger.warning(f"Could not parse CRS {source_crs}, using original bounds")
+        except Exception as transform_error:
+            logger.warning(f"CRS transformation failed for {source_crs}: {transform_error}")
+            minx_3857, miny_3857 = minx, miny
+            maxx_3857, maxy_3857 = maxx, maxy
+
+        layer_info['bbox_epsg3857'] = f"{minx_3857},{miny_3857},{maxx_3857},{maxy_3857}"
+        logger.info(f"Layer {layer_name} bounds: {layer_info['bbox_epsg3857']}")
+
+    except Exception as e:
+        logger.error(f"Błąd calculating bounding box for layer {layer_name}: {e}")
+
+class LayerInfoCache:
+    """
+    Pamięć podręczna metadanych pojedynczych warstw z TTL.
+
+    `get_many` pobiera brakujące warstwy równolegle (pula o rozmiarze
+    `LAYER_INFO_CONCURRENCY`) i wypełnia pamięć, więc późniejsze zapytania
+    o pojedyncze warstwy są obsługiwane lokalnie.
+    """
+
+    def __init__(self):
+        self.ttl = 300
+        self.concurrency = 8
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def init_app(self, app):
+        self.ttl = app.config['LAYER_INFO_CACHE_TTL']
+        self.concurrency = app.config['LAYER_INFO_CONCURRENCY']
+        app.extensions['geouploader_layer_info'] = self
+
+    def _cached(self, layer_name):
+        entry = self._entries.get(layer_name)
+        if entry is not None and time.monotonic() - entry['fetched_at'] < self.ttl:
+            return entry['info']
+        return None
+
+    def _store(self, layer_name, info):
+        self._entries[layer_name] = {'info': info, 'fetched_at': time.monotonic()}
+
+    def get(self, layer_name):
+        info = self._cached(layer_name)
+        with self._lock:
+            self._counters['hits' if info is not None else 'misses'] += 1
+        if info is None:
+            info = fetch_layer_info(layer_name, current_app.config, current_app.logger)
+            self._store(layer_name, info)
+        return info
+
+    def get_many(self, layer_names):
+        """Zwraca ({nazwa: metadane}, {nazwa: błąd}) dla listy warstw."""
+        results, errors, missing = {}, {}, []
+        for name in layer_names:
+            info = self._cached(name)
+            if info is not None:
+                results[name] = info
+            else:
+                missing.append(name)
+        with self._lock:
+            self._counters['hits'] += len(results)
+            self._counters['misses'] += len(missing)
+
+        config = current_app.config
+        logger = current_app.logger
+
+        def fetch(name):
+            try:
+                return name, fetch_layer_info(name, config, logger), None
+            except LayerNotFoundError:
+                return name, None, 'Warstwa nie została znaleziona'
+            except Exception as e:
+                logger.error(f"Błąd pobierania informacji o warstwie {name}: {e}")
+                return name, None, 'Nie można pobrać informacji o warstwie'
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing))) as executor:
+                for name, info, error in executor.map(fetch, missing):
+                    if error:
+                        errors[name] = error
+                    else:
+                        self._store(name, info)
+                        results[name] = info
+        return results, errors
+
+    def invalidate(self, layer_name=None):
+        with self._lock:
+            if layer_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(layer_name, None)
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = counters['hits'] / lookups if lookups else None
+        counters['entries'] = len(self._entries)
+        return counters
+
+layer_info_cache = LayerInfoCache()
@@ -0,0 +1,338 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request, g
+
+# Progi histogramów (s): żądania HTTP i wywołania usług zewnętrznych / etapy uploadu
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return self.name, tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+class Gauge(Counter):
+    """Wartość bieżąca jako suma przyrostów ze wszystkich wątków (inc/dec mogą być w różnych wątkach)."""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        # Wpis: liczności przedziałów (ostatni to +Inf), a na końcu suma wartości.
+        shard = self.registry._shard()
+        key = self._key(labels)
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+def _merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, list):
+            entry = target.setdefault(key, [0] * len(value))
+            for i, v in enumerate(value):
+                entry[i] += v
+        else:
+            target[key] = target.get(key, 0) + value
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """
+    Metryki procesu w formacie tekstowym Prometheusa.
+
+    Każdy wątek zapisuje do własnej porcji (słownik w `threading.local`), więc
+    zapis na gorącej ścieżce nie bierze żadnej blokady i wątki WSGI nie
+    rywalizują o nią. Blokada jest potrzebna tylko przy pierwszym zapisie nowego
+    wątku i przy odczycie (`render`), który sumuje porcje; w obu przypadkach porcje
+    zakończonych wątków są scalane w jedną, więc ich liczba nie rośnie bez końca
+    także wtedy, gdy nikt nie odczytuje metryk.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+        self._metrics = {}
+        self._collectors = []
+
+    def init_app(self, app):
+        app.extensions['geouploader_metrics'] = self
+        if app.config['METRICS_ENABLED']:
+            app.before_request(_start_request)
+            app.after_request(_finish_request)
+            app.teardown_request(_teardown_request)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        """Scala porcje zakończonych wątków w `_retired` (wywoływane pod blokadą)."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = alive
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """`collector()` zwraca listę (nazwa, typ, opis, [(etykiety, wartość)]) liczoną przy odczycie."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """Suma porcji wszystkich wątków: {(nazwa, wartości etykiet): wartość}."""
+        with self._lock:
+            self._retire_dead_shards()
+            total = {key: list(value) if isinstance(value, list) else value
+                     for key, value in self._retired.items()}
+            # dict.copy() wykonuje się przy GIL w całości - wątek właściciela może pisać równolegle.
+            shards = [shard.copy() for _, shard in self._shards]
+        for shard in shards:
+            _merge(total, shard)
+        return total
+
+    def render(self):
+        values = {}
+        for (name, label_values), value in self.snapshot().items():
+            values.setdefault(name, []).append((label_values, value))
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for label_values, value in sorted(values.get(name, [])):
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_labels(metric.labelnames, label_values)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = (('le', _number(float(bound))),)
+                    lines.append(f"{name}_bucket{_labels(metric.labelnames, label_values, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric.labelnames, label_values)} {_number(float(value[-1]))}")
+                lines.append(f"{name}_count{_labels(metric.labelnames, label_values)} {cumulative}")
+
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+http_request_seconds = metrics.histogram(
+    'gis_http_request_duration_seconds', 'Czas obsługi żądania HTTP wg reguły URL.',
+    ('endpoint', 'method', 'status'))
+http_requests_in_flight = metrics.gauge('gis_http_requests_in_flight', 'Liczba obsługiwanych żądań HTTP.')
+upstream_seconds = metrics.histogram(
+    'gis_upstream_request_duration_seconds', 'Czas wywołań GeoServera i S3.', ('service', 'operation'))
+upstream_errors = metrics.counter(
+    'gis_upstream_errors_total', 'Błędy wywołań GeoServera i S3 (wyjątki i odpowiedzi 5xx).',
+    ('service', 'operation'))
+stage_seconds = metrics.histogram(
+    'gis_upload_stage_duration_seconds', 'Czas etapów przetwarzania uploadu.', ('stage',), STAGE_BUCKETS)
+stage_errors = metrics.counter('gis_upload_stage_errors_total', 'Etapy uploadu zakończone błędem.', ('stage',))
+processed_bytes = metrics.counter('gis_processed_bytes_total', 'Bajty przetworzone w etapach uploadu.', ('stage',))
+conversions_in_flight = metrics.gauge('gis_conversions_in_flight', 'Liczba trwających konwersji do COG.')
+
+@contextmanager
+def timed_stage(name):
+    """Mierzy etap uploadu; wyjątek zwiększa licznik błędów etapu i jest przekazywany dalej."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=name)
+
+_cpu_local = threading.local()
+
+class CpuTimer:
+    """Czas CPU wątku wraz z pracą zleconą przez ten wątek do pul wątków (zob. `cpu_accounted`)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._worker_seconds = 0.0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        with self._lock:
+            self._worker_seconds += seconds
+
+@contextmanager
+def cpu_timer():
+    """
+    Mierzy czas CPU bieżącego wątku (`time.thread_time`) i funkcji zleconych
+    z niego do pul przez `cpu_accounted`. W odróżnieniu od `time.process_time`
+    nie obejmuje pracy innych wątków procesu (np. równoległych zadań ani żądań).
+    Wewnętrzne wątki GDAL (NUM_THREADS) nie są liczone.
+    """
+    timer = CpuTimer()
+    previous = getattr(_cpu_local, 'timer', None)
+    _cpu_local.timer = timer
+    start = time.thread_time()
+    try:
+        yield timer
+    finally:
+        _cpu_local.timer = previous
+        timer.seconds = time.thread_time() - start + timer._worker_seconds
+
+def cpu_accounted(fn):
+    """Opakowuje funkcję zlecaną do puli wątków - jej czas CPU dolicza się do `cpu_timer` zlecającego."""
+    timer = getattr(_cpu_local, 'timer', None)
+    if timer is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.thread_time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timer.add(time.thread_time() - start)
+    return wrapper
+
+def observe_upstream(service, operation, seconds, error=False):
+    upstream_seconds.observe(seconds, service=service, operation=operation)
+    if error:
+        upstream_errors.inc(service=service, operation=operation)
+
+def instrument_s3_client(client):
+    """Podpina pomiar czasu i błędów pod zdarzenia botocore klienta S3."""
+    def before_call(model, context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+        context['metrics_operation'] = model.name
+
+    def after_call(http_response, context, **kwargs):
+        if 'metrics_started' in context:
+            observe_upstream('s3', context['metrics_operation'], time.perf_counter() - context['metrics_started'],
+                             error=http_response.status_code >= 500)
+
+    def after_call_error(context, **kwargs):
+        if 'metrics_started' in context:
+            observe_upstream('s3', context['metrics_operation'], time.perf_counter() - context['metrics_started'],
+                             error=True)
+
+    events = client.meta.events
+    events.register('before-call.s3', before_call)
+    events.register('after-call.s3', after_call)
+    events.register('after-call-error.s3', after_call_error)
+    return client
+
+def cache_collector(sources):
+    """Kolektor współczynników trafień i liczników pamięci podręcznych z ich metod `stats()`."""
+    def collect():
+        ratios, stats = [], []
+        for cache, stats_fn in sources.items():
+            for key, value in stats_fn().items():
+                if key == 'hit_ratio':
+                    if value is not None:
+                        ratios.append(({'cache': cache}, value))
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats.append(({'cache': cache, 'stat': key}, value))
+        return [
+            ('gis_cache_hit_ratio', 'gauge', 'Współczynnik trafień pamięci podręcznych.', ratios),
+            ('gis_cache_stat', 'gauge', 'Liczniki i rozmiary pamięci podręcznych (z stats()).', stats)
+        ]
+    return collect
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    http_requests_in_flight.inc()
+
+def _finish_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+def _teardown_request(exc):
+    # Pomiar w teardown obejmuje też żądania zakończone nieobsłużonym wyjątkiem
+    # (after_request może się wtedy nie wykonać) i całe strumieniowane odpowiedzi.
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    status = 500 if exc is not None else g.pop('metrics_status', 500)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint,
+                                 method=request.method, status=status)
+    http_requests_in_flight.dec()
@@ -0,0 +1,109 @@
+from datetime import datetime
+
+from geoalchemy2 import Geometry
+
+from app import db
+
+class UploadJob(db.Model):
+    """Zadanie przetwarzania uploadu wykonywane w tle (zob. `jobs.py`)."""
+    __tablename__ = 'upload_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    stage = db.Column(db.String(20))
+    stages = db.Column(db.JSON, nullable=False, default=dict)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    # Proces wykonujący zadanie ('host:pid') i ostatni sygnał, że nadal działa.
+    owner = db.Column(db.String(128))
+    heartbeat_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'owner': self.owner,
+            'stage': self.stage,
+            'stages': self.stages,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class CogRecord(db.Model):
+    """Wpis katalogu COG w S3 - metadane pliku i zasięg (footprint) z indeksem GiST."""
+    __tablename__ = 'cog_catalog'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(1024), nullable=False, unique=True, index=True)
+    size = db.Column(db.BigInteger)
+    etag = db.Column(db.String(128))
+    crs = db.Column(db.String(64))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    band_count = db.Column(db.Integer)
+    band_stats = db.Column(db.JSON)
+    overview_levels = db.Column(db.JSON)
+    bbox_epsg3857 = db.Column(db.String(128))
+    footprint = db.Column(Geometry(geometry_type='POLYGON', srid=4326, spatial_index=True))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'key': self.key,
+            'size': self.size,
+            'etag': self.etag,
+            'crs': self.crs,
+            'width': self.width,
+            'height': self.height,
+            'band_count': self.band_count,
+            'band_stats': self.band_stats,
+            'overview_levels': self.overview_levels,
+            'bbox_epsg3857': self.bbox_epsg3857,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class UploadArtifact(db.Model):
+    """
+    Wynik przetworzenia pliku o danej treści (skrót BLAKE2): obiekt COG w S3
+    albo magazyn pokrycia w GeoServerze. Pozwala pominąć ponowne przetwarzanie
+    duplikatów (zob. `dedup.py`).
+    """
+    __tablename__ = 'upload_artifacts'
+    __table_args__ = (db.UniqueConstraint('content_hash', 'kind'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)
+    target = db.Column(db.String(1024), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    cpu_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    details = db.Column(db.JSON)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    bytes_saved = db.Column(db.BigInteger, nullable=False, default=0)
+    cpu_seconds_saved = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'content_hash': self.content_hash,
+            'kind': self.kind,
+            'target': self.target,
+            'size': self.size,
+            'cpu_seconds': self.cpu_seconds,
+            'details': self.details,
+            'hits': self.hits,
+            'bytes_saved': self.bytes_saved,
+            'cpu_seconds_saved': self.cpu_seconds_saved,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_hit_at': self.last_hit_at.isoformat() if self.last_hit_at else None
+        }
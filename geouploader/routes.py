@@ -3,41 +3,52 @@ import rasterio
 from rasterio.warp import reproject, Resampling
 from werkzeug.utils import secure_filename
 from flask import (render_template, request, flash, redirect, url_for,
-                   current_app)
+                   current_app, jsonify)
 import tempfile
 import requests
 from pyproj import Transformer
 import json
+import uuid
 
 from . import geouploader_bp
 from .geoserver import publish_geotiff_directly
-from .validators import validate_file, validate_geotiff_and_get_bbox
+from .validators import validate_file, validate_geotiff_and_get_bbox, save_upload
 from .exceptions.custom_exceptions import ValidationError
-from .util import upload_cog_to_s3, list_cogs_in_bucket, get_cog_bbox
+from .cog_index import list_cogs as list_cog_records, get_cog_bbox
+from .jobs import job_queue
+from .models import UploadJob, CogRecord
+from .tiles import TILE_FORMATS, render_tile, valid_tile
+from .tile_cache import tile_cache, cog_layer, wms_layer
+from .layer_cache import layer_cache
+from .layer_info import layer_info_cache
+from .dedup import find_artifact, record_hit
 
 def get_geoserver_layers():
-    config = current_app.config
-    geoserver_rest_url = config['GEOSERVER_URL']
-    geoserver_workspace = config['GEOSERVER_WORKSPACE']
-    auth = (config['GEOSERVER_USER'], config['GEOSERVER_PASSWORD'])
-
-    layers_url = f"{geoserver_rest_url}/workspaces/{geoserver_workspace}/layers.json"
     try:
-        response = requests.get(layers_url, auth=auth)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        layers_data = response.json()
-        
-        # Extract layer names
-        layer_names = []
-        if 'layers' in layers_data and 'layer' in layers_data['layers']:
-            for layer_info in layers_data['layers']['layer']:
-                # GeoServer REST API returns layer name as 'name' field
-                layer_names.append(layer_info['name'])
-        return layer_names
+        return [layer_info['name'] for layer_info in layer_cache.get_layers()]
     except requests.exceptions.RequestException as e:
         current_app.logger.error(f"Błąd podczas pobierania listy warstw z GeoServera: {e}", exc_info=True)
         return []
 
+def job_accepted(job_id, message):
+    """Odpowiedź na przyjęcie zadania: JSON (202) dla klientów API, flash + redirect dla formularzy."""
+    status_url = url_for('.job_status', job_id=job_id)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': status_url}), 202
+    flash(f"{message} Identyfikator zadania: {job_id} (status: {status_url})", "info")
+    return redirect(url_for('.index'))
+
+def duplicate_accepted(artifact, size, message, redirect_url):
+    """Odpowiedź na upload pliku, którego treść została już przetworzona - bez tworzenia zadania."""
+    record_hit(artifact, size)
+    current_app.logger.info(f"Duplikat pliku ({artifact.kind}): użyto '{artifact.target}', "
+                            f"oszczędzono {size} B i {artifact.cpu_seconds:.1f} s CPU.")
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'duplicate_of': artifact.target, 'kind': artifact.kind,
+                        'bytes_saved': size, 'cpu_seconds_saved': artifact.cpu_seconds}), 200
+    flash(message, "info")
+    return redirect(redirect_url)
+
 @geouploader_bp.route('/')
 def index():
     """Renderuje stronę główną komponentu do wgrywania plików."""
@@ -58,24 +69,91 @@ def upload_cog_route():
             flash('No selected file', 'danger')
             return redirect(request.url)
         if file:
-            status_code = upload_cog_to_s3(file)
-            if status_code == 204:
-                flash('File uploaded successfully to S3.', 'success')
-            else:
-                flash(f'Failed to upload file to S3. Status code: {status_code}', 'danger')
-            return redirect(url_for('.index'))
+            config = current_app.config
+            filename = secure_filename(file.filename)
+            token = uuid.uuid4().hex[:8]
+            input_path = os.path.join(config['UPLOAD_FOLDER'], f"input_{token}_{filename}")
+            output_path = os.path.join(config['UPLOAD_FOLDER'], f"cog_{token}_{filename}")
+            try:
+                size, content_hash = save_upload(file.stream, input_path, config,
+                                                 max_size_mb=config['MAX_COG_UPLOAD_SIZE_MB'])
+                # Ten sam plik był już skonwertowany - używamy istniejącego obiektu COG.
+                artifact = find_artifact(content_hash, 'cog')
+                if artifact is not None:
+                    os.remove(input_path)
+                    return duplicate_accepted(artifact, size,
+                                              f"Ten plik był już przetworzony - użyto istniejącego COG '{artifact.target}'.",
+                                              url_for('.list_cogs'))
+                validate_geotiff_and_get_bbox(input_path, None)
+            except ValidationError as e:
+                if os.path.exists(input_path):
+                    os.remove(input_path)
+                flash(str(e), 'danger')
+                return redirect(request.url)
+
+            job_id = job_queue.submit('cog', {
+                'input_path': input_path,
+                'output_path': output_path,
+                'object_name': 'cog/' + file.filename,
+                'content_hash': content_hash
+            }, completed_stages=('save', 'validate'))
+            return job_accepted(job_id, 'Plik przyjęty do konwersji COG i wysłania do S3.')
     return render_template('upload_cog.html')
 
 @geouploader_bp.route('/cog_viewer')
 def cog_viewer():
     cog_url = request.args.get('url')
-    if not cog_url:
-        return "Please provide a 'url' query parameter.", 400
-    return render_template('cog_viewer.html', cog_url=cog_url)
+    cog_id = request.args.get('cog_id', type=int)
+    if not cog_url and cog_id is None:
+        return "Please provide a 'url' or 'cog_id' query parameter.", 400
+
+    tiles_url, bbox = None, None
+    record = CogRecord.query.get(cog_id) if cog_id is not None else None
+    if record is not None:
+        tiles_url = tile_url_template(record.id)
+        if record.bbox_epsg3857:
+            bbox = [float(v) for v in record.bbox_epsg3857.split(',')]
+    return render_template('cog_viewer.html', cog_url=cog_url, tiles_url=tiles_url, bbox=bbox)
+
+def tile_url_template(cog_id, fmt='png'):
+    """Szablon URL kafli XYZ (`{z}/{x}/{y}`) dla klientów OpenLayers/Leaflet."""
+    url = url_for('.cog_tile', cog_id=cog_id, z=0, x=0, y=0, fmt=fmt)
+    return url[:-len(f"0/0/0.{fmt}")] + f"{{z}}/{{x}}/{{y}}.{fmt}"
+
+@geouploader_bp.route('/tiles/')
+def tile_sources():
+    """Lista COG z katalogu dostępnych jako źródła kafli XYZ."""
+    records = (CogRecord.query
+               .with_entities(CogRecord.id, CogRecord.key, CogRecord.bbox_epsg3857)
+               .order_by(CogRecord.key)
+               .all())
+    return jsonify({'cogs': [{'id': cog_id, 'key': key, 'bbox_epsg3857': bbox,
+                              'tiles_url': tile_url_template(cog_id)}
+                             for cog_id, key, bbox in records]})
+
+@geouploader_bp.route('/tiles/<int:cog_id>/<int:z>/<int:x>/<int:y>.<fmt>')
+def cog_tile(cog_id, z, x, y, fmt):
+    """Kafel XYZ (EPSG:3857) renderowany bezpośrednio z COG. Parametr `size`: 256 lub 512."""
+    if fmt not in TILE_FORMATS or not valid_tile(z, x, y):
+        return jsonify({'error': 'Nieprawidłowy kafel lub format'}), 404
+    tile_size = request.args.get('size', current_app.config['TILE_SIZE'], type=int)
+    if tile_size not in (256, 512):
+        return jsonify({'error': "Parametr 'size' musi mieć wartość 256 lub 512"}), 400
+    record = CogRecord.query.get(cog_id)
+    if record is None:
+        return jsonify({'error': 'COG nie został znaleziony'}), 404
+
+    try:
+        tile, etag = tile_cache.get(cog_layer(cog_id), z, x, y, fmt, tile_size,
+                                    lambda: render_tile(record, z, x, y, fmt, tile_size))
+    except Exception as e:
+        current_app.logger.error(f"Błąd renderowania kafla {cog_id}/{z}/{x}/{y}: {e}", exc_info=True)
+        return jsonify({'error': 'Błąd serwera podczas renderowania kafla'}), 500
+    return tile_cache.response(tile, etag, TILE_FORMATS[fmt][1])
 
 @geouploader_bp.route('/list_cogs')
 def list_cogs():
-    cogs = list_cogs_in_bucket()
+    cogs = list_cog_records()
     return render_template('list_cogs.html', cogs=cogs)
 
 @geouploader_bp.route('/view_wms')
@@ -91,12 +169,12 @@ def display_wms():
     
     config = current_app.config
     wms_workspace = config['GEOSERVER_WORKSPACE']
-    wms_base_url = config['GEOSERVER_URL'].replace('/rest', '') + f"/{wms_workspace}/wms"
+    wms_base_url = url_for('proxy_wms')
 
     available_layers = get_geoserver_layers()
 
     # Generic GetCapabilities URL for the template
-    wms_capabilities_url = f"{config['GEOSERVER_URL'].replace('/rest', '')}/wms?service=WMS&version=1.3.0&request=GetCapabilities&namespace={wms_workspace}"
+    wms_capabilities_url = url_for('proxy_wms', service='WMS', version='1.3.0', request='GetCapabilities')
 
     return render_template('display_wms.html', 
                            layer_name=layer_name, 
@@ -124,19 +202,46 @@ def upload_file():
         return redirect(url_for('.upload_cog_route'), code=307)
 
     try:
-        filename, filepath = validate_file(file, config, original_filename_from_form)
+        filename, filepath, content_hash = validate_file(file, config, original_filename_from_form)
     except ValidationError as e:
         flash(str(e), "danger")
         return redirect(url_for('.index'))
 
     try:
+        artifact = find_artifact(content_hash, 'geoserver')
+        if artifact is not None and artifact.target == layer_name:
+            bbox_epsg3857 = (artifact.details or {}).get('bbox_epsg3857')
+            size = os.path.getsize(filepath)
+            # Każdy upload ma własny plik - duplikat nie jest już potrzebny.
+            os.remove(filepath)
+            return duplicate_accepted(artifact, size,
+                                      f"Warstwa '{layer_name}' jest już opublikowana z tego samego pliku.",
+                                      url_for('.display_wms', layer_name=layer_name, bbox_epsg3857=bbox_epsg3857))
+
+        if artifact is not None:
+            # Duplikat pod inną nazwą: walidacja i wysyłka pliku są pomijane,
+            # zadanie publikuje alias istniejącego magazynu pokrycia.
+            logger.info(f"Cel: GeoServer. Plik warstwy '{layer_name}' jest duplikatem '{artifact.target}'.")
+            job_id = job_queue.submit('geoserver', {
+                'layer_name': layer_name,
+                'filepath': filepath,
+                'bbox_epsg3857': (artifact.details or {}).get('bbox_epsg3857'),
+                'content_hash': content_hash,
+                'alias_of': artifact.target
+            }, completed_stages=('save', 'validate'))
+            return job_accepted(job_id, f"Warstwa '{layer_name}' przyjęta do publikacji jako alias '{artifact.target}'.")
+
         source_crs, bbox_epsg3857 = validate_geotiff_and_get_bbox(filepath, epsg_code_str)
 
-        # Publikacja w GeoServerze
-        logger.info(f"Cel: GeoServer. Publikowanie warstwy '{layer_name}'.")
-        publish_geotiff_directly(layer_name, filepath)
-        flash(f"Sukces! Warstwa '{layer_name}' opublikowana w GeoServerze.", "success")
-        return redirect(url_for('wms_viewer', layer_name=layer_name, bbox_epsg3857=bbox_epsg3857))
+        # Publikacja w GeoServerze odbywa się w tle
+        logger.info(f"Cel: GeoServer. Zlecanie publikacji warstwy '{layer_name}'.")
+        job_id = job_queue.submit('geoserver', {
+            'layer_name': layer_name,
+            'filepath': filepath,
+            'bbox_epsg3857': bbox_epsg3857,
+            'content_hash': content_hash
+        }, completed_stages=('save', 'validate'))
+        return job_accepted(job_id, f"Warstwa '{layer_name}' przyjęta do publikacji w GeoServerze.")
 
     except ValidationError as e:
         flash(str(e), "danger")
@@ -159,6 +264,9 @@ def republish_cog():
     try:
         logger.info(f"Rozpoczynanie ponownej publikacji warstwy '{layer_name}' z URL: {cog_url}")
         publish_cog_from_s3(layer_name, cog_url)
+        layer_cache.invalidate()
+        layer_info_cache.invalidate(layer_name)
+        tile_cache.purge(wms_layer(current_app.config['GEOSERVER_WORKSPACE'], layer_name))
         flash(f"Sukces! Ponownie opublikowano warstwę '{layer_name}'.", "success")
         # Przekierowanie do ogólnego widoku, bo nie mamy BBOX
         return redirect(url_for('.display_wms', layer_name=layer_name))
@@ -167,3 +275,24 @@ def republish_cog():
         flash(f"Błąd podczas ponownej publikacji: {e}", "danger")
         return redirect(url_for('.index'))
 
+@geouploader_bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Zwraca status zadania w tle wraz z postępem poszczególnych etapów."""
+    job = UploadJob.query.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Zadanie nie zostało znalezione'}), 404
+    return jsonify(job.to_dict())
+
+@geouploader_bp.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """Ponawia zadanie zakończone błędem (np. wznawia przerwany upload do S3)."""
+    if not job_queue.retry(job_id):
+        return jsonify({'error': 'Zadanie nie istnieje lub nie zakończyło się błędem'}), 409
+    return jsonify({'job_id': job_id, 'status_url': url_for('.job_status', job_id=job_id)}), 202
+
+@geouploader_bp.route('/jobs/<job_id>/abandon', methods=['POST'])
+def abandon_job(job_id):
+    """Porzuca zadanie zakończone błędem: przerywa niedokończony upload do S3 i usuwa pliki robocze."""
+    if not job_queue.abandon(job_id):
+        return jsonify({'error': 'Zadanie nie istnieje lub nie zakończyło się błędem'}), 409
+    return jsonify({'job_id': job_id, 'status': 'abandoned'})
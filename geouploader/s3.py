@@ -0,0 +1,272 @@
+import os
+import json
+import math
+import time
+import random
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+from flask import current_app
+
+from .clients import get_s3_client
+from .metrics import processed_bytes, cpu_accounted
+
+# Limity S3 dla multipart uploadu
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+def upload_file_multipart(path, object_name, progress=None):
+    """Wysyła plik do S3 multipart uploadem z parametrami z konfiguracji aplikacji."""
+    config = current_app.config
+    processed_bytes.inc(os.path.getsize(path), stage='upload')
+    return multipart_upload(
+        get_s3_client(),
+        path,
+        config['S3_BUCKET'],
+        object_name,
+        part_size=config['S3_PART_SIZE_MB'] * 1024 * 1024,
+        concurrency=config['S3_UPLOAD_CONCURRENCY'],
+        max_retries=config['S3_MAX_RETRIES'],
+        progress=progress
+    )
+
+def multipart_upload(s3_client, path, bucket, key, part_size=64 * 1024 * 1024, concurrency=8,
+                     max_retries=5, progress=None):
+    """
+    Wysyła plik do S3 jako multipart upload z równoległym przesyłaniem części.
+
+    Każda część jest ponawiana z wykładniczym opóźnieniem. Stan uploadu
+    (UploadId i ETagi wysłanych części) jest zapisywany obok pliku w
+    `<path>.upload.json`, więc ponowne wywołanie po błędzie wznawia upload
+    i nie wysyła ponownie części, które już dotarły do S3. Zwraca ETag obiektu.
+    Upload, którego nikt nie wznowi, trzeba przerwać (`abort_multipart`) -
+    inaczej jego części zajmują miejsce w buckecie.
+    """
+    size = os.path.getsize(path)
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+    part_count = max(1, math.ceil(size / part_size))
+    state_path = f"{path}.upload.json"
+
+    state = _load_state(state_path)
+    if state and (state.get('bucket'), state.get('key'), state.get('size'), state.get('part_size')) != (bucket, key, size, part_size):
+        # Plik lub parametry zmieniły się od poprzedniej próby - stary upload nie zostanie dokończony.
+        _abort_upload(s3_client, state)
+        state = None
+    completed = {}
+    if state:
+        try:
+            completed = _list_uploaded_parts(s3_client, bucket, key, state['upload_id'], part_size, size)
+        except ClientError:
+            # Upload wygasł lub został przerwany po stronie S3 - zaczynamy od nowa.
+            _abort_upload(s3_client, state)
+            state = None
+    if not state:
+        response = s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        state = {'bucket': bucket, 'key': key, 'size': size, 'part_size': part_size,
+                 'upload_id': response['UploadId']}
+        _save_state(state_path, state)
+
+    upload_id = state['upload_id']
+    missing = [n for n in range(1, part_count + 1) if n not in completed]
+
+    def upload_part(part_number):
+        offset = (part_number - 1) * part_size
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(min(part_size, size - offset))
+        response = _with_retries(
+            lambda: s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                          PartNumber=part_number, Body=body),
+            max_retries
+        )
+        return part_number, response['ETag']
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for part_number, etag in executor.map(cpu_accounted(upload_part), missing):
+            completed[part_number] = etag
+            if progress:
+                progress(len(completed), part_count)
+
+    parts = [{'PartNumber': n, 'ETag': completed[n]} for n in sorted(completed)]
+    response = _with_retries(
+        lambda: s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                    MultipartUpload={'Parts': parts}),
+        max_retries
+    )
+    os.remove(state_path)
+    return response.get('ETag')
+
+def _with_retries(call, max_retries, base_delay=0.5):
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except (BotoCoreError, ClientError):
+            if attempt == max_retries:
+                raise
+            time.sleep(base_delay * 2 ** attempt + random.uniform(0, base_delay))
+
+def abort_multipart(s3_client, path):
+    """
+    Przerywa w S3 multipart upload pliku `path` zapisany w `<path>.upload.json`
+    (wysłane części przestają być naliczane) i usuwa plik stanu.
+    Zwraca True, jeśli był upload do przerwania.
+    """
+    state_path = f"{path}.upload.json"
+    state = _load_state(state_path)
+    if state is None:
+        return False
+    _abort_upload(s3_client, state)
+    os.remove(state_path)
+    return True
+
+def _abort_upload(s3_client, state):
+    try:
+        s3_client.abort_multipart_upload(Bucket=state['bucket'], Key=state['key'], UploadId=state['upload_id'])
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+            raise
+
+def _load_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_state(state_path, state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def _list_uploaded_parts(s3_client, bucket, key, upload_id, part_size, size):
+    """Zwraca {numer części: ETag} dla części już zapisanych w S3 (z poprawnym rozmiarem)."""
+    parts = {}
+    paginator = s3_client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get('Parts', []):
+            number = part['PartNumber']
+            expected = min(part_size, size - (number - 1) * part_size)
+            if part['Size'] == expected:
+                parts[number] = part['ETag']
+    return parts
+
+def _object_dict(obj):
+    return {
+        'key': obj['Key'],
+        'size': obj['Size'],
+        'etag': obj.get('ETag'),
+        'last_modified': obj['LastModified'].isoformat()
+    }
+
+def list_objects_page(bucket, prefix='', delimiter=None, continuation_token=None, max_keys=1000,
+                      start_after=None):
+    """
+    Zwraca jedną stronę listingu S3. Z `delimiter` (np. '/') zwraca też
+    "foldery" (CommonPrefixes). `next_token` przekazuje się do kolejnego wywołania
+    jako `continuation_token`; `start_after` zaczyna listing za podanym kluczem.
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': max_keys}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    if continuation_token:
+        kwargs['ContinuationToken'] = continuation_token
+    elif start_after:
+        kwargs['StartAfter'] = start_after
+
+    response = get_s3_client().list_objects_v2(**kwargs)
+    return {
+        'objects': [_object_dict(obj) for obj in response.get('Contents', []) if obj['Key'] != prefix],
+        'folders': [p['Prefix'] for p in response.get('CommonPrefixes', [])],
+        'next_token': response.get('NextContinuationToken') if response.get('IsTruncated') else None
+    }
+
+def iter_objects(bucket, prefix=''):
+    """Generator po wszystkich obiektach pod `prefix` - kolejne strony pobiera na bieżąco."""
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'] != prefix:
+                yield _object_dict(obj)
+
+class ListingSnapshot:
+    """
+    Migawka pełnego listingu S3 dla skonfigurowanego prefiksu, odświeżana w tle
+    co `S3_LISTING_REFRESH` sekund. Strony listingu są wycinane z posortowanej
+    migawki (token = ostatni zwrócony klucz) bez zapytań do S3.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 60
+        self._lock = threading.Lock()
+        self._thread = None
+        self._keys = []
+        self._objects = []
+        self._refreshed_at = None
+        self._counters = {'refreshes': 0, 'errors': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['S3_LISTING_REFRESH']
+        app.extensions['geouploader_s3_listing'] = self
+
+    @property
+    def ready(self):
+        return self._refreshed_at is not None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name='s3-listing-snapshot')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    self._counters['errors'] += 1
+                    self.app.logger.warning("Odświeżenie migawki listingu S3 nie powiodło się.", exc_info=True)
+            time.sleep(self.interval)
+
+    def refresh(self):
+        config = current_app.config
+        objects = sorted(iter_objects(config['S3_BUCKET'], config.get('AWS_FOLDER') or ''), key=lambda o: o['key'])
+        with self._lock:
+            self._objects = objects
+            self._keys = [obj['key'] for obj in objects]
+            self._refreshed_at = time.time()
+            self._counters['refreshes'] += 1
+
+    def page(self, start_after=None, max_keys=1000, prefix=''):
+        """Zwraca stronę z migawki (None, jeśli migawka nie jest jeszcze gotowa)."""
+        self._start()
+        if not self.ready:
+            return None
+        with self._lock:
+            keys, objects = self._keys, self._objects
+        start = bisect.bisect_right(keys, start_after) if start_after else bisect.bisect_left(keys, prefix)
+        page = []
+        for obj in objects[start:]:
+            if not obj['key'].startswith(prefix):
+                break
+            page.append(obj)
+            if len(page) == max_keys:
+                break
+        more = len(page) == max_keys and start + max_keys < len(objects) and objects[start + max_keys]['key'].startswith(prefix)
+        return {
+            'objects': page,
+            'folders': [],
+            'next_token': page[-1]['key'] if more else None,
+            'snapshot_at': self._refreshed_at
+        }
+
+    def stats(self):
+        return {**self._counters, 'objects': len(self._objects), 'refreshed_at': self._refreshed_at}
+
+listing_snapshot = ListingSnapshot()
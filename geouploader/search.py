@@ -0,0 +1,272 @@
+import json
+import time
+import base64
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+import shapely.wkb
+import shapely.wkt
+from shapely.geometry import box, shape
+from shapely.strtree import STRtree
+from flask import current_app
+from sqlalchemy import func, or_, and_, literal, true, false
+import requests
+from geoalchemy2.shape import from_shape, to_shape
+
+from app import db
+from .models import CogRecord
+from .crs import parse_crs, get_transformer, transform_footprint
+from .cog_index import cog_url
+from .layer_cache import layer_cache
+from .layer_info import layer_info_cache
+from .exceptions.custom_exceptions import ValidationError
+
+SEARCH_TYPES = ('layer', 'cog')
+
+def parse_query_geometry(bbox=None, geometry=None, crs='EPSG:4326'):
+    """
+    Buduje geometrię zapytania w EPSG:4326 z BBOX ("minx,miny,maxx,maxy")
+    albo z geometrii WKT / GeoJSON zapisanej w układzie `crs`.
+    """
+    try:
+        if bbox:
+            minx, miny, maxx, maxy = (float(v) for v in bbox.split(','))
+            geom = box(minx, miny, maxx, maxy)
+        elif geometry:
+            geometry = geometry.strip()
+            if geometry.startswith('{'):
+                data = json.loads(geometry)
+                if data.get('type') == 'Feature':
+                    data = data['geometry']
+                geom = shape(data)
+            else:
+                geom = shapely.wkt.loads(geometry)
+        else:
+            raise ValidationError("Wymagany parametr 'bbox' lub 'geometry'.")
+    except (ValueError, KeyError, TypeError, shapely.errors.ShapelyError) as e:
+        raise ValidationError(f"Nieprawidłowa geometria zapytania: {e}")
+
+    if parse_crs(crs) != 'EPSG:4326':
+        transformer = get_transformer(crs, 'EPSG:4326')
+        geom = shapely.transform(geom, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+    if geom.is_empty or not geom.is_valid:
+        raise ValidationError("Geometria zapytania jest pusta lub niepoprawna.")
+    return geom
+
+def encode_cursor(item):
+    raw = json.dumps([item['score'], item['type'], item['name']])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        score, item_type, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), item_type, name
+    except (ValueError, TypeError):
+        raise ValidationError("Nieprawidłowy kursor stronicowania.")
+
+def _sort_key(item):
+    return (-item['score'], item['type'], item['name'])
+
+def _after_cursor(item, cursor):
+    return _sort_key(item) > (-cursor[0], cursor[1], cursor[2])
+
+class FootprintIndex:
+    """
+    Indeks przestrzenny zasięgów w pamięci (Shapely STRtree).
+
+    Zawiera warstwy GeoServera (zasięgi z metadanych warstw), a gdy baza nie
+    obsługuje PostGIS - również COG z katalogu. Indeks jest przebudowywany po
+    `ttl` sekundach lub po `invalidate()`. Indeksy z COG i bez nich są trzymane
+    osobno. Przebudowę wykonuje naraz jeden wątek - pozostałe w tym czasie
+    korzystają z poprzedniej wersji indeksu (o ile już istnieje).
+    """
+
+    def __init__(self):
+        self.ttl = 60
+        self._lock = threading.Lock()
+        # include_cogs -> (tree, items, geoms, built_at)
+        self._indexes = {}
+        self._build_locks = {True: threading.Lock(), False: threading.Lock()}
+
+    def init_app(self, app):
+        self.ttl = app.config['SEARCH_INDEX_TTL']
+        app.extensions['geouploader_search_index'] = self
+
+    def invalidate(self):
+        with self._lock:
+            # Indeks zostaje do użytku na czas przebudowy, ale traci ważność.
+            self._indexes = {key: (tree, items, geoms, None)
+                             for key, (tree, items, geoms, _) in self._indexes.items()}
+
+    def _load_items(self, include_cogs):
+        items = []
+        try:
+            layer_names = [layer['name'] for layer in layer_cache.get_layers()]
+            layers, _ = layer_info_cache.get_many(layer_names)
+        except requests.exceptions.RequestException as e:
+            current_app.logger.warning(f"Indeks wyszukiwania bez warstw GeoServera: {e}")
+            layers = {}
+        for name, info in layers.items():
+            if not info.get('bbox_epsg3857'):
+                continue
+            bounds = [float(v) for v in info['bbox_epsg3857'].split(',')]
+            items.append({
+                'type': 'layer',
+                'name': name,
+                'url': info.get('wms_url'),
+                'updated_at': None,
+                'geometry': shapely.Polygon(transform_footprint(bounds, 'EPSG:3857', 'EPSG:4326'))
+            })
+        if include_cogs:
+            for record in CogRecord.query.filter(CogRecord.footprint.isnot(None)).all():
+                items.append(_cog_item(record.key, record.updated_at, to_shape(record.footprint)))
+        return items
+
+    def _current(self, include_cogs):
+        with self._lock:
+            index = self._indexes.get(include_cogs)
+        if index is None:
+            return None, False
+        built_at = index[3]
+        return index[:3], built_at is not None and time.monotonic() - built_at < self.ttl
+
+    def _ensure_built(self, include_cogs):
+        index, fresh = self._current(include_cogs)
+        if fresh:
+            return index
+        build_lock = self._build_locks[include_cogs]
+        # Gdy inny wątek już przebudowuje indeks, zwracamy poprzednią wersję zamiast czekać.
+        if not build_lock.acquire(blocking=index is None):
+            return index
+        try:
+            index, fresh = self._current(include_cogs)
+            if fresh:
+                return index
+            items = self._load_items(include_cogs)
+            geoms = np.array([item['geometry'] for item in items], dtype=object)
+            tree = STRtree(geoms)
+            with self._lock:
+                self._indexes[include_cogs] = (tree, items, geoms, time.monotonic())
+            return tree, items, geoms
+        finally:
+            build_lock.release()
+
+    def search(self, query_geom, include_cogs=False, types=SEARCH_TYPES, name=None, start=None, end=None):
+        tree, items, geoms = self._ensure_built(include_cogs)
+        if not items:
+            return []
+        candidates = tree.query(query_geom, predicate='intersects')
+        if len(candidates) == 0:
+            return []
+        # Ranking wektorowo dla wszystkich kandydatów naraz (IoU zasięgu i zapytania).
+        candidate_geoms = geoms[candidates]
+        inter = shapely.area(shapely.intersection(candidate_geoms, query_geom))
+        union = shapely.area(shapely.union(candidate_geoms, query_geom))
+        scores = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+        results = []
+        for idx, score in zip(candidates, scores):
+            item = items[idx]
+            if item['type'] not in types:
+                continue
+            if name and name.lower() not in item['name'].lower():
+                continue
+            if (start or end) and item['updated_at'] is None:
+                continue
+            if (start and item['updated_at'] < start) or (end and item['updated_at'] > end):
+                continue
+            results.append(_result(item, float(score)))
+        return results
+
+def _cog_item(key, updated_at, geometry):
+    return {'type': 'cog', 'name': key, 'url': None, 'updated_at': updated_at, 'geometry': geometry}
+
+def _result(item, score):
+    updated_at = item['updated_at']
+    return {
+        'type': item['type'],
+        'name': item['name'],
+        'url': item['url'] if item['type'] == 'layer' else cog_url(item['name']),
+        'bbox': list(item['geometry'].bounds),
+        'score': score,
+        'updated_at': updated_at.isoformat() if updated_at else None
+    }
+
+def _postgis_available():
+    return bool(current_app.config.get('SQLALCHEMY_DATABASE_URI')) and db.engine.dialect.name == 'postgresql'
+
+def _search_cogs_postgis(query_geom, name, start, end, cursor, limit):
+    """Wyszukuje COG w PostGIS - filtr `&&`/ST_Intersects korzysta z indeksu GiST."""
+    query_element = from_shape(query_geom, srid=4326)
+    score = (func.ST_Area(func.ST_Intersection(CogRecord.footprint, query_element)) /
+             func.nullif(func.ST_Area(func.ST_Union(CogRecord.footprint, query_element)), 0))
+    score = func.coalesce(score, literal(0.0)).label('score')
+
+    query = (db.session.query(CogRecord.key, CogRecord.updated_at, func.ST_AsBinary(CogRecord.footprint), score)
+             .filter(func.ST_Intersects(CogRecord.footprint, query_element)))
+    if name:
+        query = query.filter(CogRecord.key.ilike(f"%{name}%"))
+    if start:
+        query = query.filter(CogRecord.updated_at >= start)
+    if end:
+        query = query.filter(CogRecord.updated_at <= end)
+
+    subquery = query.subquery()
+    outer = db.session.query(subquery)
+    if cursor:
+        # Keyset: elementy ściśle za kursorem w porządku (-score, type, name).
+        cursor_score, cursor_type, cursor_name = cursor
+        if cursor_type == 'cog':
+            tie = subquery.c.key > cursor_name
+        else:
+            tie = true() if 'cog' > cursor_type else false()
+        outer = outer.filter(or_(subquery.c.score < cursor_score,
+                                 and_(subquery.c.score == cursor_score, tie)))
+    rows = outer.order_by(subquery.c.score.desc(), subquery.c.key).limit(limit).all()
+    return [_result(_cog_item(key, updated_at, shapely.wkb.loads(bytes(footprint))), float(row_score))
+            for key, updated_at, footprint, row_score in rows]
+
+def search(query_geom, types=SEARCH_TYPES, name=None, start=None, end=None,
+           limit=50, offset=0, cursor=None):
+    """
+    Zwraca warstwy i COG przecinające `query_geom` (EPSG:4326), posortowane
+    malejąco wg stopnia pokrycia (IoU). Stronicowanie: `limit`/`offset` albo
+    `cursor` (keyset) z poprzedniej odpowiedzi. Filtr czasu (`start`, `end`)
+    dotyczy daty aktualizacji - pomija więc warstwy GeoServera, które jej nie mają.
+    """
+    cursor = decode_cursor(cursor) if cursor else None
+    use_postgis = 'cog' in types and _postgis_available()
+    window = limit + (0 if cursor else offset)
+
+    results = []
+    if use_postgis:
+        results += _search_cogs_postgis(query_geom, name, start, end, cursor, window)
+    tree_types = tuple(t for t in types if t != 'cog' or not use_postgis)
+    if tree_types:
+        include_cogs = 'cog' in tree_types and bool(current_app.config.get('SQLALCHEMY_DATABASE_URI'))
+        matches = search_index.search(query_geom, include_cogs=include_cogs, types=tree_types,
+                                      name=name, start=start, end=end)
+        if cursor:
+            matches = [m for m in matches if _after_cursor(m, cursor)]
+        results += matches
+
+    results.sort(key=_sort_key)
+    page = results[:window] if cursor else results[offset:window]
+    next_cursor = encode_cursor(page[-1]) if len(page) == limit else None
+    return page, next_cursor
+
+def parse_datetime(value):
+    """Data ISO 8601; daty ze strefą czasową są sprowadzane do naiwnego UTC, jak `updated_at` w bazie."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"Nieprawidłowa data: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+search_index = FootprintIndex()
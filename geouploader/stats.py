@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import hashlib
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+STATS_CACHE_DIR = '.stats'
+STATS_MODES = ('approx', 'exact')
+
+# Liczba przedziałów histogramu roboczego w trybie dokładnym. Dla typów
+# całkowitych o zakresie mieszczącym się w tej liczbie percentyle są dokładne.
+EXACT_HISTOGRAM_BINS = 65536
+
+def file_fingerprint(path, sample_size=64 * 1024):
+    """
+    Zwraca szybki odcisk pliku (rozmiar + czas modyfikacji + początek i koniec pliku).
+    Nie wymaga czytania całego pliku. Plik zmieniony w środku przy tym samym
+    rozmiarze ma inny czas modyfikacji, więc nie dostanie starych statystyk.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    digest = hashlib.blake2b(f"{size}:{stat.st_mtime_ns}".encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(size - sample_size, sample_size))
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+def _cache_path(path, content_hash=None):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), STATS_CACHE_DIR)
+    return os.path.join(cache_dir, f"{content_hash or file_fingerprint(path)}.json")
+
+def _read_cache(cache_file, params):
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('params') != params:
+        return None
+    return cached['bands']
+
+def _write_cache(cache_file, params, bands):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({'params': params, 'bands': bands}, f)
+    os.replace(tmp_file, cache_file)
+
+def compute_band_stats(path, mode='approx', percentiles=(2, 98), bins=256, max_pixels=1_000_000,
+                       use_cache=True, content_hash=None):
+    """
+    Liczy statystyki pasm (min/max, percentyle, histogram) z pominięciem nodata.
+
+    Tryb 'approx' czyta raster zdecymowany do ok. `max_pixels` pikseli (GDAL
+    korzysta wtedy z piramid, jeśli istnieją), tryb 'exact' przechodzi cały
+    raster blok po bloku. Wynik jest zapisywany obok pliku w katalogu `.stats`,
+    pod skrótem całej treści (`content_hash`, liczonym przy uploadzie), a gdy
+    go nie podano - pod odciskiem pliku (`file_fingerprint`).
+    """
+    if mode not in STATS_MODES:
+        raise ValueError(f"Nieznany tryb statystyk: {mode}")
+
+    params = {'mode': mode, 'percentiles': [float(q) for q in percentiles], 'bins': bins}
+    if mode == 'approx':
+        params['max_pixels'] = max_pixels
+
+    cache_file = _cache_path(path, content_hash) if use_cache else None
+    if cache_file:
+        cached = _read_cache(cache_file, params)
+        if cached is not None:
+            return cached
+
+    with rasterio.open(path) as src:
+        if mode == 'exact':
+            bands = _exact_stats(src, percentiles, bins)
+        else:
+            bands = _approx_stats(src, percentiles, bins, max_pixels)
+
+    if cache_file:
+        _write_cache(cache_file, params, bands)
+    return bands
+
+def _band_result(band, bmin, bmax, count, percentile_values, counts):
+    return {
+        'band': band,
+        'min': bmin,
+        'max': bmax,
+        'count': count,
+        'percentiles': percentile_values,
+        'histogram': {'range': [bmin, bmax], 'counts': [int(c) for c in counts]}
+    }
+
+def _empty_result(band, percentiles, bins):
+    return _band_result(band, 0.0, 0.0, 0, {f"{q:g}": 0.0 for q in percentiles}, [0] * bins)
+
+def _approx_stats(src, percentiles, bins, max_pixels):
+    factor = max(1, math.ceil(math.sqrt(src.width * src.height / max_pixels)))
+    out_shape = (math.ceil(src.height / factor), math.ceil(src.width / factor))
+
+    bands = []
+    for i in range(1, src.count + 1):
+        data = src.read(i, out_shape=out_shape, masked=True, resampling=Resampling.nearest)
+        values = data.compressed().astype('float64')
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            bands.append(_empty_result(i, percentiles, bins))
+            continue
+
+        bmin, bmax = float(values.min()), float(values.max())
+        percentile_values = {f"{q:g}": float(v) for q, v in zip(percentiles, np.percentile(values, percentiles))}
+        counts, _ = np.histogram(values, bins=bins, range=(bmin, bmax))
+        bands.append(_band_result(i, bmin, bmax, int(values.size), percentile_values, counts))
+    return bands
+
+def _exact_stats(src, percentiles, bins):
+    bands = []
+    for i in range(1, src.count + 1):
+        # Pierwsze przejście: zakres wartości.
+        bmin, bmax = np.inf, -np.inf
+        for _, window in src.block_windows(i):
+            values = _valid_values(src, i, window)
+            if values.size:
+                bmin = min(bmin, float(values.min()))
+                bmax = max(bmax, float(values.max()))
+        if bmin > bmax:
+            bands.append(_empty_result(i, percentiles, bins))
+            continue
+
+        # Drugie przejście: histogram roboczy (do percentyli) i wynikowy.
+        fine_bins = EXACT_HISTOGRAM_BINS
+        fine_range = (bmin, bmax)
+        if np.issubdtype(np.dtype(src.dtypes[i - 1]), np.integer) and bmax - bmin < fine_bins:
+            # Jeden przedział na każdą wartość całkowitą - środki przedziałów są dokładne.
+            fine_bins = int(bmax - bmin) + 1
+            fine_range = (bmin - 0.5, bmax + 0.5)
+        fine_counts = np.zeros(fine_bins, dtype='int64')
+        counts = np.zeros(bins, dtype='int64')
+        for _, window in src.block_windows(i):
+            values = _valid_values(src, i, window)
+            if values.size:
+                fine_counts += np.histogram(values, bins=fine_bins, range=fine_range)[0]
+                counts += np.histogram(values, bins=bins, range=(bmin, bmax))[0]
+
+        total = int(fine_counts.sum())
+        cumulative = np.cumsum(fine_counts)
+        edges = np.linspace(fine_range[0], fine_range[1], fine_bins + 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+        percentile_values = {}
+        for q in percentiles:
+            idx = int(np.searchsorted(cumulative, q / 100 * total, side='left'))
+            percentile_values[f"{q:g}"] = float(centers[min(idx, fine_bins - 1)])
+        bands.append(_band_result(i, bmin, bmax, total, percentile_values, counts))
+    return bands
+
+def _valid_values(src, band, window):
+    data = src.read(band, window=window, masked=True)
+    values = data.compressed().astype('float64')
+    return values[np.isfinite(values)]
+
+def stretch_range(band_stats, stretch='minmax', percentiles=(2, 98)):
+    """Zwraca (min, max) do skalowania pasma: pełny zakres albo zakres percentylowy."""
+    if stretch == 'minmax':
+        return band_stats['min'], band_stats['max']
+    if stretch == 'percentile':
+        low, high = percentiles
+        return band_stats['percentiles'][f"{low:g}"], band_stats['percentiles'][f"{high:g}"]
+    raise ValueError(f"Nieznany sposób rozciągania: {stretch}")
@@ -0,0 +1,317 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+from werkzeug.utils import secure_filename
+
+from .tiles import tile_range
+
+GENERATIONS_DIR = '.generations'
+
+class TileCache:
+    """
+    Dwupoziomowa pamięć podręczna kafli.
+
+    - poziom 1: LRU w pamięci procesu ograniczone sumą rozmiarów kafli,
+    - poziom 2: katalog na dysku `<warstwa>/<z>/<x>/<y>.<format>`, zapisy atomowe
+      (plik tymczasowy + `os.replace`), więc równoległe procesy nie czytają
+      niedokończonych kafli.
+
+    Kafel z dysku trafia do LRU przy odczycie. `purge(layer)` usuwa kafle warstwy
+    z obu poziomów (po ponownej publikacji) i zmienia generację warstwy zapisaną
+    w `.generations/<warstwa>`. Generacja jest częścią klucza, ścieżki i ETagu kafla,
+    więc inne procesy przestają używać swoich kopii w LRU, a kafel renderowany
+    przed purge nie zostaje zapisany pod nową generacją. `purge_bounds(layer, bounds)`
+    usuwa tylko kafle z danego zasięgu i zmienia znacznik `.generations/<warstwa>.area`;
+    po jego zmianie kopia w LRU jest ważna, dopóki istnieje jej plik.
+
+    Odczyty przy `get` biorą generację i znacznik z pamięci procesu, odświeżanej
+    co `generation_ttl` sekund - purge w innym procesie widać najpóźniej po tym czasie.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.max_memory = 64 * 1024 * 1024
+        self.max_age = 3600
+        self.generation_ttl = 1.0
+        self._stamps = {}
+        self._entries = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'not_modified': 0,
+                          'bytes_served': 0, 'purges': 0, 'area_purges': 0, 'stale_writes': 0}
+
+    def init_app(self, app):
+        self.root = app.config['TILE_CACHE_DIR']
+        self.max_memory = app.config['TILE_CACHE_MEMORY_MB'] * 1024 * 1024
+        self.max_age = app.config['TILE_CACHE_MAX_AGE']
+        self.generation_ttl = app.config['TILE_CACHE_GENERATION_TTL']
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['geouploader_tile_cache'] = self
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _generation_path(self, layer):
+        return os.path.join(self.root, GENERATIONS_DIR, _layer_dirname(layer))
+
+    def _read_stamp(self, path):
+        if self.root is None:
+            return 0
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def generation(self, layer):
+        """Bieżąca generacja warstwy (0, jeśli warstwy nigdy nie czyszczono)."""
+        return self._read_stamp(self._generation_path(layer))
+
+    def _area_stamp(self, layer):
+        """Znacznik ostatniego `purge_bounds` warstwy (w dowolnym procesie)."""
+        return self._read_stamp(f"{self._generation_path(layer)}.area")
+
+    def _current_stamps(self, layer):
+        """(generacja, znacznik `purge_bounds`) warstwy, odczytywane z dysku najwyżej co `generation_ttl`."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stamps.get(layer)
+        if cached is not None and now - cached[2] < self.generation_ttl:
+            return cached[0], cached[1]
+        stamps = (self.generation(layer), self._area_stamp(layer))
+        with self._lock:
+            self._stamps[layer] = (*stamps, now)
+        return stamps
+
+    def _drop_stamps(self, layer):
+        with self._lock:
+            self._stamps.pop(layer, None)
+
+    def _layer_dir(self, layer, generation):
+        # Generacja 0 zachowuje układ katalogów sprzed wprowadzenia generacji.
+        layer_dir = os.path.join(self.root, _layer_dirname(layer))
+        if generation:
+            layer_dir = os.path.join(layer_dir, f"g{generation}")
+        return layer_dir
+
+    def _path(self, key):
+        layer, generation, z, x, y, fmt, size = key
+        suffix = '' if size == 256 else f"@{size}"
+        return os.path.join(self._layer_dir(layer, generation), str(z), str(x), f"{y}{suffix}.{fmt}")
+
+    def _remember(self, key, data, etag, area_stamp):
+        with self._lock:
+            if key in self._entries:
+                self._memory -= len(self._entries.pop(key)[0])
+            self._entries[key] = (data, etag, area_stamp)
+            self._memory += len(data)
+            while self._memory > self.max_memory and self._entries:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._memory -= len(evicted)
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._memory -= len(entry[0])
+
+    def _write_current(self, key, data, area_stamp):
+        """
+        Zapisuje kafel na dysk, o ile w trakcie renderowania nie wyczyszczono
+        warstwy (`purge`) ani jej fragmentu (`purge_bounds`).
+        """
+        layer = key[0]
+        if self.generation(layer) != key[1]:
+            self._count('stale_writes')
+            return False
+        path = self._path(key)
+        self._write(path, data)
+        if self._area_stamp(layer) != area_stamp:
+            # Kafel mógł powstać z danych sprzed zmiany - nie wiadomo, czy leży poza czyszczonym zasięgiem.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._count('stale_writes')
+            return False
+        return True
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tile_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, layer, z, x, y, fmt, size, render):
+        """
+        Zwraca (dane, ETag) kafla. Przy braku w obu poziomach wywołuje `render()`
+        i zapisuje wynik w pamięci i na dysku.
+        """
+        generation, area_stamp = self._current_stamps(layer)
+        key = (layer, generation, z, x, y, fmt, size)
+        path = self._path(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            data, etag, entry_stamp = entry
+            # Po `purge_bounds` (także w innym procesie) kopia jest ważna, dopóki istnieje jej plik.
+            if entry_stamp == area_stamp or os.path.exists(path):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries[key] = (data, etag, area_stamp)
+                        self._entries.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                return data, etag
+            self._forget(key)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self._count('disk_hits')
+        except FileNotFoundError:
+            area_stamp = self._area_stamp(layer)
+            data = render()
+            self._count('misses')
+            if not self._write_current(key, data, area_stamp):
+                # Warstwę wyczyszczono w trakcie renderowania - wynik nie trafia do pamięci.
+                return data, tile_etag(data, generation)
+
+        etag = tile_etag(data, generation)
+        self._remember(key, data, etag, area_stamp)
+        return data, etag
+
+    def seed(self, layer, z, x, y, fmt, size, render, force=False):
+        """
+        Renderuje kafel wprost do magazynu na dysku, z pominięciem LRU, żeby
+        zasilanie nie wypychało z pamięci kafli oglądanych przez użytkowników.
+        Zwraca False, jeśli kafel już istniał.
+        """
+        key = (layer, self.generation(layer), z, x, y, fmt, size)
+        if not force and os.path.exists(self._path(key)):
+            return False
+        area_stamp = self._area_stamp(layer)
+        return self._write_current(key, render(), area_stamp)
+
+    def purge(self, layer):
+        """Zmienia generację warstwy i usuwa wszystkie jej kafle z pamięci i z dysku."""
+        if self.root is not None:
+            # Nowa generacja przed usunięciem kafli - renderowania, które zaczęły się
+            # wcześniej, nie zapiszą już swoich wyników. Czas w ns jest unikalny także
+            # przy równoczesnym purge w kilku procesach.
+            self._write(self._generation_path(layer), str(time.time_ns()).encode())
+        self._drop_stamps(layer)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == layer]:
+                self._memory -= len(self._entries.pop(key)[0])
+            self._counters['purges'] += 1
+        if self.root is None:
+            return
+        layer_dir = os.path.join(self.root, _layer_dirname(layer))
+        if os.path.isdir(layer_dir):
+            # Zmiana nazwy jest atomowa - nowe kafle nie trafią do usuwanego katalogu.
+            trash = tempfile.mkdtemp(dir=self.root, prefix='.purge_')
+            os.replace(layer_dir, os.path.join(trash, 'layer'))
+            shutil.rmtree(trash, ignore_errors=True)
+
+    def purge_bounds(self, layer, bounds, margin=1):
+        """
+        Usuwa kafle warstwy pokrywające BBOX (minlon, minlat, maxlon, maxlat) w EPSG:4326
+        na wszystkich poziomach, z marginesem `margin` kafli (bufor kafli MVT).
+        Przegląda tylko katalogi obecne na dysku. Zwraca liczbę usuniętych plików.
+        """
+        with self._lock:
+            self._counters['area_purges'] += 1
+        if self.root is None:
+            return 0
+        # Znacznik przed usunięciem plików - renderowania trwające w tej chwili
+        # nie zapiszą wyników (zob. `_write_current`).
+        self._write(f"{self._generation_path(layer)}.area", str(time.time_ns()).encode())
+        self._drop_stamps(layer)
+        generation = self.generation(layer)
+        layer_dir = self._layer_dir(layer, generation)
+
+        removed = 0
+        for z_name in _list_dir(layer_dir):
+            if not z_name.isdigit():
+                continue
+            min_x, min_y, max_x, max_y = tile_range(bounds, int(z_name))
+            for x_name in _list_dir(os.path.join(layer_dir, z_name)):
+                if not x_name.isdigit() or not min_x - margin <= int(x_name) <= max_x + margin:
+                    continue
+                x_dir = os.path.join(layer_dir, z_name, x_name)
+                for file_name in _list_dir(x_dir):
+                    y_name = file_name.split('.', 1)[0].split('@', 1)[0]
+                    if not y_name.isdigit() or not min_y - margin <= int(y_name) <= max_y + margin:
+                        continue
+                    try:
+                        os.remove(os.path.join(x_dir, file_name))
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == layer]:
+                min_x, min_y, max_x, max_y = tile_range(bounds, key[2])
+                if min_x - margin <= key[3] <= max_x + margin and min_y - margin <= key[4] <= max_y + margin:
+                    self._memory -= len(self._entries.pop(key)[0])
+        return removed
+
+    def response(self, data, etag, mimetype):
+        """Odpowiedź HTTP z ETag i Cache-Control; przy pasującym If-None-Match - 304 bez treści."""
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.make_conditional(request)
+        if response.status_code == 304:
+            self._count('not_modified')
+        else:
+            self._count('bytes_served', len(data))
+        return response
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['memory_entries'] = len(self._entries)
+            counters['memory_bytes'] = self._memory
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        counters['hit_ratio'] = (counters['memory_hits'] + counters['disk_hits']) / lookups if lookups else None
+        return counters
+
+def _layer_dirname(layer):
+    # ':' z nazw warstw WMS (`wms:<workspace>:<nazwa>`) zamieniamy na '_', żeby nie zlewały się z innymi.
+    return secure_filename(layer.replace(':', '_'))
+
+def _list_dir(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+def tile_etag(data, generation=0):
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f"{generation}-{digest}" if generation else digest
+
+def cog_layer(cog_id):
+    """Nazwa warstwy w pamięci kafli dla COG z katalogu."""
+    return f"cog-{cog_id}"
+
+def wms_layer(workspace, name):
+    """Nazwa warstwy w pamięci kafli dla kafli WMS warstwy GeoServera (osobna przestrzeń od `cog-<id>` i `geoms`)."""
+    return f"wms:{workspace}:{name}"
+
+tile_cache = TileCache()
@@ -0,0 +1,192 @@
+import math
+import os
+from urllib.parse import urlparse
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.session import AWSSession
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window, from_bounds
+from flask import current_app
+
+from .cog_index import cog_url
+from .util import scale_to_uint8
+
+# Połowa obwodu Ziemi w EPSG:3857 - zasięg siatki kafli XYZ to [-ORIGIN, ORIGIN].
+ORIGIN = math.pi * 6378137
+MAX_ZOOM = 24
+TILE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp')
+}
+
+def tile_bounds(z, x, y):
+    """Zasięg kafla XYZ (minx, miny, maxx, maxy) w EPSG:3857."""
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def tile_range(bounds, z):
+    """Zwraca (min_x, min_y, max_x, max_y) kafli poziomu `z` pokrywających BBOX (minlon, minlat, maxlon, maxlat) w EPSG:4326."""
+    def tile_xy(lon, lat):
+        lat = max(min(lat, 85.0511287798), -85.0511287798)
+        n = 2 ** z
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    min_x, min_y = tile_xy(bounds[0], bounds[3])
+    max_x, max_y = tile_xy(bounds[2], bounds[1])
+    return min_x, min_y, max_x, max_y
+
+def tiles_for_bounds(bounds, z):
+    """Generuje (x, y) kafli poziomu `z` pokrywających BBOX (minlon, minlat, maxlon, maxlat) w EPSG:4326."""
+    min_x, min_y, max_x, max_y = tile_range(bounds, z)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield x, y
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def cog_source(key, config):
+    """
+    Zwraca ścieżkę GDAL do COG: lokalna kopia z `COG_LOCAL_FOLDER`, `/vsis3/`
+    (gdy skonfigurowano klucze S3) albo `/vsicurl/` z odczytem zakresami HTTP.
+    """
+    local_folder = config.get('COG_LOCAL_FOLDER')
+    if local_folder:
+        local_path = os.path.join(local_folder, key)
+        if os.path.exists(local_path):
+            return local_path
+    if config.get('S3_KEY'):
+        return f"/vsis3/{config['S3_BUCKET']}/{key}"
+    return f"/vsicurl/{cog_url(key)}"
+
+def gdal_env(config):
+    """Środowisko GDAL do odczytu zakresami z S3/HTTP: bez listowania katalogów, ze scalaniem zakresów."""
+    options = {
+        'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+        'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+        'GDAL_HTTP_MULTIPLEX': 'YES',
+        'VSI_CACHE': 'TRUE',
+        # Całkowite GDAL_CACHEMAX rasterio przekazuje do GDAL w bajtach.
+        'GDAL_CACHEMAX': config['TILE_GDAL_CACHE_MB'] * 1024 * 1024
+    }
+    if config.get('AWS_ENDPOINT'):
+        endpoint = urlparse(config['AWS_ENDPOINT'])
+        options['AWS_S3_ENDPOINT'] = endpoint.netloc or endpoint.path
+        options['AWS_HTTPS'] = 'NO' if endpoint.scheme == 'http' else 'YES'
+        options['AWS_VIRTUAL_HOSTING'] = 'FALSE'
+    if config.get('S3_KEY'):
+        session = AWSSession(aws_access_key_id=config['S3_KEY'],
+                             aws_secret_access_key=config['S3_SECRET'],
+                             region_name=config['S3_LOCATION'])
+        return rasterio.Env(session=session, **options)
+    return rasterio.Env(**options)
+
+def select_overview_level(src, tile_resolution):
+    """
+    Wybiera najmniej szczegółową piramidę, której rozdzielczość jest wciąż
+    nie gorsza niż rozdzielczość kafla. None oznacza pełną rozdzielczość.
+    """
+    level = None
+    for i, factor in enumerate(src.overviews(1)):
+        if src.res[0] * factor <= tile_resolution:
+            level = i
+    return level
+
+def _read_window(src, bounds, tile_size, resampling):
+    """
+    Czyta z `src` tylko część okna kafla leżącą w zasięgu rastra i wkleja ją
+    w pusty kafel. Zwraca (dane, maska).
+    """
+    data = np.zeros((src.count, tile_size, tile_size), dtype=src.dtypes[0])
+    mask = np.zeros((tile_size, tile_size), dtype='uint8')
+
+    window = from_bounds(*bounds, transform=src.transform)
+    scale_x = window.width / tile_size
+    scale_y = window.height / tile_size
+    col0 = max(window.col_off, 0)
+    row0 = max(window.row_off, 0)
+    col1 = min(window.col_off + window.width, src.width)
+    row1 = min(window.row_off + window.height, src.height)
+    if col1 <= col0 or row1 <= row0:
+        return data, mask
+
+    out_x0 = int(round((col0 - window.col_off) / scale_x))
+    out_y0 = int(round((row0 - window.row_off) / scale_y))
+    out_x1 = int(round((col1 - window.col_off) / scale_x))
+    out_y1 = int(round((row1 - window.row_off) / scale_y))
+    if out_x1 <= out_x0 or out_y1 <= out_y0:
+        return data, mask
+
+    read_window = Window(col0, row0, col1 - col0, row1 - row0)
+    out_shape = (out_y1 - out_y0, out_x1 - out_x0)
+    data[:, out_y0:out_y1, out_x0:out_x1] = src.read(window=read_window, out_shape=(src.count, *out_shape),
+                                                      resampling=resampling)
+    mask[out_y0:out_y1, out_x0:out_x1] = src.dataset_mask(window=read_window, out_shape=out_shape,
+                                                          resampling=Resampling.nearest)
+    return data, mask
+
+def _to_rgb(data, band_stats):
+    # COG z konwersji są już uint8 (1 lub 3 pasma). Inne typy skalujemy zakresem z katalogu.
+    if data.dtype != np.uint8:
+        scaled = []
+        for i, band in enumerate(data.astype('float32')):
+            stats = band_stats[i] if band_stats and i < len(band_stats) else {}
+            scaled.append(scale_to_uint8(band, stats.get('min'), stats.get('max')))
+        data = np.stack(scaled)
+    if data.shape[0] >= 3:
+        return data[:3]
+    return np.repeat(data[:1], 3, axis=0)
+
+def _intersects(bounds, bbox_epsg3857):
+    minx, miny, maxx, maxy = (float(v) for v in bbox_epsg3857.split(','))
+    return bounds[0] < maxx and bounds[2] > minx and bounds[1] < maxy and bounds[3] > miny
+
+def encode_tile(rgb, mask, fmt):
+    driver, _ = TILE_FORMATS[fmt]
+    bands = rgb if fmt == 'jpg' else np.concatenate([rgb, mask[np.newaxis]])
+    profile = {'driver': driver, 'width': rgb.shape[2], 'height': rgb.shape[1],
+               'count': bands.shape[0], 'dtype': 'uint8'}
+    if fmt == 'jpg':
+        profile['quality'] = 85
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(bands)
+        return memfile.read()
+
+def render_tile(record, z, x, y, fmt='png', tile_size=256):
+    """
+    Renderuje kafel XYZ z COG z katalogu. Odczytywany jest tylko fragment
+    najbliższej piramidy pokrywający kafel, więc przy źródle S3/HTTP GDAL
+    pobiera zakresami wyłącznie potrzebne bloki.
+    """
+    config = current_app.config
+    bounds = tile_bounds(z, x, y)
+    if record.bbox_epsg3857 and not _intersects(bounds, record.bbox_epsg3857):
+        empty = np.zeros((3, tile_size, tile_size), dtype='uint8')
+        return encode_tile(empty, empty[0], fmt)
+    tile_resolution = (bounds[2] - bounds[0]) / tile_size
+    resampling = Resampling[config['TILE_RESAMPLING']]
+    path = cog_source(record.key, config)
+
+    with gdal_env(config):
+        with rasterio.open(path) as src:
+            level = select_overview_level(src, tile_resolution)
+            reprojected = src.crs != 'EPSG:3857'
+        if reprojected:
+            # Katalog może zawierać COG spoza konwersji - czytamy je przez wirtualny warp.
+            with rasterio.open(path) as src, WarpedVRT(src, crs='EPSG:3857', resampling=resampling) as vrt:
+                data, mask = _read_window(vrt, bounds, tile_size, resampling)
+        else:
+            open_options = {} if level is None else {'overview_level': level}
+            with rasterio.open(path, **open_options) as src:
+                data, mask = _read_window(src, bounds, tile_size, resampling)
+
+    return encode_tile(_to_rgb(data, record.band_stats), mask, fmt)
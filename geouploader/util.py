@@ -1,132 +1,230 @@
-import boto3
 import os
 import json
-from rio_cogeo.cogeo import cog_translate
+import math
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from rio_cogeo.cogeo import cog_translate, cog_validate
 from rio_cogeo.profiles import cog_profiles
 from rasterio.enums import Resampling
+from rasterio.rio.overview import get_maximum_overview_level
 import rasterio
 from rasterio.warp import transform_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 import numpy as np
-import requests
+from flask import current_app
+from .stats import compute_band_stats, stretch_range
+from .exceptions.custom_exceptions import CogValidationError
+from .metrics import timed_stage, processed_bytes, conversions_in_flight, cpu_accounted
 from rasterio.warp import reproject, Resampling as WarpResampling, calculate_default_transform
 
-METADATA_FILE = os.path.join('orto_ref_host')
+logger = logging.getLogger(__name__)
 
-def convert_data_to_cog(input_path, output_path):
-    with rasterio.open(input_path) as src:
-        count = src.count
-        dst_crs = 'EPSG:3857'
-        transform, width, height = get_reproject_params(src, dst_crs)
-
-        if count == 1:
-            photometric = "minisblack"
-        elif count == 3:
-            photometric = "ycbcr"
-        else:
-            raise ValueError(f"Nieobsługiwana liczba kanałów ({count}).")
-
-        profile = build_output_profile(src, count, width, height, transform, dst_crs, photometric)
-
-        with rasterio.open(output_path, 'w', **profile) as dst:
-            for i in range(1, count + 1):
-                band = src.read(i, resampling=Resampling.nearest).astype("float32")
-                scaled = scale_to_uint8(band)
-                reprojected = reproject_band(scaled, src, (height, width), transform, dst_crs)
-                dst.write(reprojected, i)
-
-    print(f"✅ JPEG+COG zapisany z CRS=EPSG:3857: {output_path}")
-    return output_path
+def convert_data_to_cog(input_path, output_path, streaming=True, block_size=512, memory_limit_mb=256,
+                        stats_mode='approx', stretch='minmax', percentiles=(2, 98),
+                        workers=1, warp_threads=1, compress_threads=None,
+                        overview_resampling='average', validate=True, progress=None, content_hash=None):
+    """
+    Konwertuje GeoTIFF do JPEG+COG w EPSG:3857.
 
-def get_presigned_post(bucket_name, object_name, expiration=3600):
-    s3_client = boto3.client(
-        's3',
-        region_name=os.environ.get('AWS_REGION'),
-        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
-    )
+    W trybie strumieniowym (domyślnym) plik wynikowy jest zapisywany blok po bloku
+    wg siatki bloków wyjściowych, więc zużycie pamięci zależy od `block_size`
+    i `memory_limit_mb`, a nie od rozmiaru rastra. Zakres skalowania pasm pochodzi
+    z globalnych statystyk (`compute_band_stats`), więc bloki nie mają widocznych szwów.
 
-    response = s3_client.generate_presigned_post(
-        Bucket=bucket_name,
-        Key=object_name,
-        ExpiresIn=expiration
-    )
-    return response
+    Przy `workers` > 1 okna i pasma są reprojektowane równolegle w puli wątków,
+    ale zapis odbywa się w tej samej kolejności bloków co w trybie szeregowym,
+    więc plik wynikowy jest identyczny bajt w bajt. `warp_threads` to liczba
+    wątków operacji warp GDAL, `compress_threads` - opcja NUM_THREADS kompresji.
 
-def upload_cog_to_s3(file_storage):
-    bucket_name = os.environ.get('AWS_BUCKET_NAME')
-    original_filename = file_storage.filename
+    Zreprojektowany raster trafia najpierw do pliku pośredniego (bezstratny DEFLATE),
+    z którego `cog_translate` buduje właściwy COG z wewnętrznymi piramidami
+    (`overview_resampling`) i nagłówkami IFD na początku pliku. Przy `validate=True`
+    wynik jest sprawdzany przez `cog_validate`.
 
-    # Define temporary paths
-    temp_dir = 'orto_ref_host'
-    input_path = os.path.join(temp_dir, f"input_{original_filename}")
-    output_path = os.path.join(temp_dir, f"cog_{original_filename}")
+    `progress(done, total)` - opcjonalny callback wywoływany po zapisaniu każdego bloku.
+    `content_hash` - skrót treści pliku z uploadu, klucz pamięci podręcznej statystyk pasm.
+    Czasy etapów 'reproject' i 'encode' trafiają do metryk (`/metrics`).
+    """
+    intermediate_path = f"{output_path}.tmp.tif"
+    with conversions_in_flight.track():
+        try:
+            with timed_stage('reproject'):
+                photometric = write_reprojected(input_path, intermediate_path, streaming, block_size,
+                                                memory_limit_mb, stats_mode, stretch, percentiles, workers,
+                                                warp_threads, compress_threads, progress, content_hash)
+            with timed_stage('encode'):
+                translate_to_cog(intermediate_path, output_path, photometric, block_size, overview_resampling,
+                                 compress_threads, memory_limit_mb)
+        finally:
+            if os.path.exists(intermediate_path):
+                os.remove(intermediate_path)
 
-    # Ensure the temporary directory exists
-    os.makedirs(temp_dir, exist_ok=True)
+        if validate:
+            validate_cog(output_path)
 
-    try:
-        # 1. Save the uploaded file to a temporary input location
-        file_storage.save(input_path)
+    processed_bytes.inc(os.path.getsize(input_path), stage='convert')
+    logger.info(f"JPEG+COG zapisany z CRS=EPSG:3857: {output_path}")
+    return output_path
 
-        # 2. Convert the input file to a COG
-        convert_data_to_cog(input_path, output_path)
+def write_reprojected(input_path, output_path, streaming=True, block_size=512, memory_limit_mb=256,
+                      stats_mode='approx', stretch='minmax', percentiles=(2, 98),
+                      workers=1, warp_threads=1, compress_threads=None, progress=None, content_hash=None):
+    """
+    Zapisuje źródło zreprojektowane do EPSG:3857 i przeskalowane do uint8 jako
+    kafelkowany GeoTIFF (DEFLATE). Zwraca docelową interpretację fotometryczną.
 
-        # 3. Prepare to upload the COG to S3
-        # The object name in S3 should be the original filename
-        object_name = 'cog/' + original_filename
-        presigned_url = get_presigned_post(bucket_name, object_name)
+    Źródło jest czytane przez `WarpedVRT` na siatce wyniku pasami kolejnych bloków
+    jednego rzędu (`block_strips`), więc GDAL liczy transformację i czyta kafle
+    źródła raz na pas, a nie osobno dla każdego bloku i pasma.
+    """
+    # rasterio przekazuje całkowite GDAL_CACHEMAX do GDAL w bajtach, nie w MB.
+    with rasterio.Env(GDAL_CACHEMAX=max(memory_limit_mb // 2, 16) * 1024 * 1024):
+        with rasterio.open(input_path) as src:
+            count = src.count
+            dst_crs = 'EPSG:3857'
+            transform, width, height = get_reproject_params(src, dst_crs)
 
-        # 4. Upload the converted COG file
-        with open(output_path, 'rb') as f:
-            files = {'file': (original_filename, f)}
-            response = requests.post(presigned_url['url'], data=presigned_url['fields'], files=files)
-        
-        return response.status_code
+            if count == 1:
+                photometric = "minisblack"
+            elif count == 3:
+                photometric = "ycbcr"
+            else:
+                raise ValueError(f"Nieobsługiwana liczba kanałów ({count}).")
 
-    finally:
-        # 5. Clean up the temporary files
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
-
-def list_cogs_in_bucket():
-    s3_client = boto3.client(
-        's3',
-        region_name=os.environ.get('AWS_REGION'),
-        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+            # YCbCr jest dozwolone tylko z kompresją JPEG - plik pośredni zapisujemy jako RGB.
+            profile = build_output_profile(src, count, width, height, transform, dst_crs,
+                                           "rgb" if photometric == "ycbcr" else photometric,
+                                           block_size=block_size, compress="deflate")
+            if compress_threads:
+                profile["num_threads"] = compress_threads
+
+            with rasterio.open(output_path, 'w', **profile) as dst:
+                if streaming:
+                    band_stats = compute_band_stats(input_path, mode=stats_mode, percentiles=percentiles,
+                                                    content_hash=content_hash)
+                    band_ranges = [stretch_range(b, stretch, percentiles) for b in band_stats]
+                    warp_mem_limit, pool_workers, in_flight = plan_warp_memory(memory_limit_mb, workers)
+                    if pool_workers > 1:
+                        write_blocks_parallel(input_path, dst, band_ranges, pool_workers,
+                                              warp_mem_limit, warp_threads, progress, in_flight)
+                    else:
+                        total = sum(1 for _ in dst.block_windows(1))
+                        done = 0
+                        with open_warped(src, dst.crs, dst.transform, dst.width, dst.height,
+                                         warp_mem_limit, warp_threads) as vrt:
+                            for strip in block_strips(dst, warp_mem_limit * 1024 * 1024):
+                                for window, block in zip(strip, read_strip(vrt, strip, band_ranges)):
+                                    dst.write(block, window=window)
+                                    done += 1
+                                    if progress:
+                                        progress(done, total)
+                else:
+                    for i in range(1, count + 1):
+                        band = src.read(i, resampling=Resampling.nearest).astype("float32")
+                        scaled = scale_to_uint8(band)
+                        reprojected = reproject_band(scaled, src, (height, width), transform, dst_crs)
+                        dst.write(reprojected, i)
+
+    return photometric
+
+def translate_to_cog(input_path, output_path, photometric, block_size=512, overview_resampling='average',
+                     compress_threads=None, memory_limit_mb=256):
+    """Buduje z pliku pośredniego JPEG COG z wewnętrznymi piramidami."""
+    with rasterio.open(input_path) as src:
+        width, height = src.width, src.height
+    while _single_block_column(width, height, block_size):
+        block_size //= 2
+    dst_profile = cog_profiles.get("jpeg")
+    dst_profile.update({
+        "photometric": photometric,
+        "blockxsize": block_size,
+        "blockysize": block_size
+    })
+    # Te same poziomy, które wybrałby cog_translate - podajemy je jawnie, żeby
+    # rozmiar bloku piramid był liczony dla faktycznie budowanych poziomów.
+    overview_level = get_maximum_overview_level(width, height, minsize=block_size)
+    config = {
+        "GDAL_TIFF_INTERNAL_MASK": True,
+        "GDAL_TIFF_OVR_BLOCKSIZE": overview_block_size(width, height, block_size, overview_level),
+        "GDAL_CACHEMAX": max(memory_limit_mb // 2, 16) * 1024 * 1024
+    }
+    if compress_threads:
+        dst_profile["num_threads"] = compress_threads
+        config["GDAL_NUM_THREADS"] = compress_threads
+
+    cog_translate(
+        input_path,
+        output_path,
+        dst_profile,
+        overview_level=overview_level,
+        overview_resampling=overview_resampling,
+        config=config,
+        in_memory=False,
+        quiet=True
     )
-    bucket_name = os.environ.get('AWS_BUCKET_NAME')
-    cogs = []
-    metadata = _read_metadata() # Load all metadata once
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='cog/')
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                filename = os.path.basename(obj['Key'])
-                cog_url = f"https://{bucket_name}.s3.{os.environ.get('AWS_REGION')}.amazonaws.com/{obj['Key']}"
-                bbox = metadata.get(filename, {}).get('bbox_epsg3857')
-                print(f"DEBUG: In list_cogs_in_bucket - Filename: {filename}, Bbox from metadata: {bbox}")
-                cogs.append({'url': cog_url, 'bbox': bbox})
-    except Exception as e:
-        print(f"Error listing files in S3: {e}")
-    return cogs
-
-def get_cog_bbox(filename):
-    metadata = _read_metadata()
-    return metadata.get(filename, {}).get('bbox_epsg3857')
+    return output_path
+
+def _single_block_column(width, height, size):
+    # Walidatory COG (rio-cogeo, skrypt GDAL) uznają poziom wyższy lub szerszy
+    # niż 512 px, którego szerokość jest równa szerokości bloku, za niekafelkowany.
+    return size > 64 and width == size and max(width, height) > 512
+
+def overview_block_size(width, height, block_size, overview_level):
+    """
+    Rozmiar bloku piramid: `block_size` zmniejszany, dopóki któryś poziom miałby
+    jedną kolumnę bloków (np. piramida 512x513 przy blokach 512).
+    """
+    size = block_size
+    for factor in (2 ** level for level in range(1, overview_level + 1)):
+        while _single_block_column(math.ceil(width / factor), math.ceil(height / factor), size):
+            size //= 2
+    return size
+
+def validate_cog(path):
+    """Sprawdza, czy plik jest poprawnym COG. W przeciwnym razie rzuca CogValidationError."""
+    is_valid, errors, warnings = cog_validate(path, quiet=True)
+    if not is_valid:
+        raise CogValidationError(f"Plik {path} nie jest poprawnym COG: {'; '.join(errors)}")
+    return warnings
+
+def convert_upload_to_cog(input_path, output_path, progress=None, content_hash=None):
+    """Konwertuje plik do COG z parametrami z konfiguracji aplikacji."""
+    config = current_app.config
+    return convert_data_to_cog(input_path, output_path,
+                               block_size=config['COG_BLOCK_SIZE'],
+                               memory_limit_mb=config['COG_MEMORY_LIMIT_MB'],
+                               stats_mode=config['COG_STATS_MODE'],
+                               stretch=config['COG_STRETCH'],
+                               workers=config['COG_WORKERS'],
+                               warp_threads=config['COG_WARP_THREADS'],
+                               compress_threads=config['COG_COMPRESS_THREADS'],
+                               overview_resampling=config['COG_OVERVIEW_RESAMPLING'],
+                               progress=progress,
+                               content_hash=content_hash)
 
 def requires_byte_conversion(path):
     with rasterio.open(path) as src:
         dtype = src.dtypes[0]
         return dtype != "uint8"
     
-def scale_to_uint8(band: np.ndarray) -> np.ndarray:
-    bmin, bmax = band.min(), band.max()
+def scale_to_uint8(band: np.ndarray, bmin=None, bmax=None) -> np.ndarray:
+    """
+    Skaluje pasmo do zakresu 0-255. Jeśli `bmin`/`bmax` nie są podane, zakres
+    liczony jest z przekazanej tablicy. Piksele NaN (brak danych) dostają 0.
+    """
+    valid = ~np.isnan(band)
+    if bmin is None or bmax is None:
+        if not valid.any():
+            return np.zeros_like(band, dtype="uint8")
+        bmin, bmax = band[valid].min(), band[valid].max()
     if bmax - bmin == 0:
         return np.zeros_like(band, dtype="uint8")
-    return ((band - bmin) / (bmax - bmin) * 255).astype("uint8")
+    scaled = np.zeros(band.shape, dtype="uint8")
+    scaled[valid] = np.clip((band[valid] - bmin) / (bmax - bmin) * 255, 0, 255).astype("uint8")
+    return scaled
 
 def get_reproject_params(src, dst_crs='EPSG:3857'):
     if src.crs == dst_crs:
@@ -147,18 +245,126 @@ def reproject_band(scaled_band, src, dst_shape, dst_transform, dst_crs):
     )
     return dest
 
-def build_output_profile(src, count, width, height, transform, dst_crs, photometric):
+# Rozmiar pasu (MB danych float32) przy dużym budżecie pamięci. Nie zależy od
+# liczby wątków, więc wynik równoległy jest identyczny z szeregowym.
+WARP_STRIP_MB = 16
+
+def plan_warp_memory(memory_limit_mb, workers):
+    """
+    Dzieli połowę `memory_limit_mb` (druga połowa to cache GDAL) na pasy w locie.
+    Pas zajmuje do 2 * rozmiar pasu (bufor warpa GDAL i tablica float32), więc
+    liczba pasów w locie i wątków wynika z budżetu, a nie z `workers`.
+    Zwraca (rozmiar pasu w MB, liczba wątków, limit pasów w locie).
+    """
+    budget = max(memory_limit_mb // 2, 2)
+    strip_mb = max(min(WARP_STRIP_MB, budget // 2), 1)
+    in_flight = max(budget // (2 * strip_mb), 1)
+    return strip_mb, max(min(workers, in_flight), 1), in_flight
+
+def open_warped(src, dst_crs, dst_transform, width, height, warp_mem_limit=64, warp_threads=1):
+    """
+    Wirtualny raster źródła na siatce wyniku (float32, brak danych jako NaN).
+    GDAL czyta ze źródła tylko fragment potrzebny do wypełnienia czytanego okna.
+    """
+    return WarpedVRT(src, crs=dst_crs, transform=dst_transform, width=width, height=height,
+                     nodata=np.nan, dtype="float32", resampling=WarpResampling.nearest,
+                     warp_mem_limit=warp_mem_limit, warp_extras={"NUM_THREADS": warp_threads})
+
+def block_strips(dst, max_bytes):
+    """
+    Dzieli bloki `dst` na pasy: kolejne bloki jednego rzędu, których dane
+    float32 ze wszystkich pasm mieszczą się w `max_bytes` (co najmniej jeden blok).
+    """
+    block_height, block_width = dst.block_shapes[0]
+    per_strip = max(1, max_bytes // (dst.count * block_height * block_width * 4))
+    strip = []
+    for _, window in dst.block_windows(1):
+        if strip and (window.row_off != strip[0].row_off or len(strip) >= per_strip):
+            yield strip
+            strip = []
+        strip.append(window)
+    if strip:
+        yield strip
+
+def read_strip(vrt, strip, band_ranges):
+    """
+    Czyta pas jednym odczytem z `vrt` i zwraca bloki uint8 (pasma, wiersze, kolumny)
+    w kolejności okien pasa, przeskalowane zakresami z `band_ranges`.
+    """
+    first = strip[0]
+    data = vrt.read(window=Window(first.col_off, first.row_off, sum(w.width for w in strip), first.height))
+    blocks = []
+    for window in strip:
+        offset = int(window.col_off - first.col_off)
+        block = data[:, :, offset:offset + int(window.width)]
+        blocks.append(np.stack([scale_to_uint8(band, bmin, bmax)
+                                for band, (bmin, bmax) in zip(block, band_ranges)]))
+    return blocks
+
+def write_blocks_parallel(input_path, dst, band_ranges, workers, warp_mem_limit=64, warp_threads=1,
+                          progress=None, in_flight=None):
+    """
+    Reprojektuje pasy bloków w puli wątków i zapisuje je do `dst` w kolejności
+    bloków. Pasy są te same co w trybie szeregowym (przybliżenie transformacji
+    GDAL zależy od zasięgu czytanego okna), więc wynik jest identyczny. Uchwyty
+    GDAL nie są bezpieczne wątkowo, więc każdy wątek otwiera własną kopię pliku
+    źródłowego i własny `WarpedVRT`. Liczba pasów w locie (liczonych i czekających
+    na zapis) jest ograniczona do `in_flight` (domyślnie 2 * `workers`, najwyżej
+    tyle), co przy limitach z `plan_warp_memory` mieści się w budżecie pamięci.
+    """
+    in_flight = min(in_flight or 2 * workers, 2 * workers)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+    total = sum(1 for _ in dst.block_windows(1))
+    written = 0
+    # Uchwyt `dst` jest w tym czasie używany do zapisu w wątku głównym - wątki
+    # robocze dostają tylko skopiowane wartości.
+    dst_transform, dst_crs, width, height = dst.transform, dst.crs, dst.width, dst.height
+
+    def open_source():
+        if not hasattr(local, 'vrt'):
+            src = rasterio.open(input_path)
+            local.vrt = open_warped(src, dst_crs, dst_transform, width, height, warp_mem_limit, warp_threads)
+            with handles_lock:
+                handles.extend([local.vrt, src])
+        return local.vrt
+
+    def flush(strip, future):
+        nonlocal written
+        for window, block in zip(strip, future.result()):
+            dst.write(block, window=window)
+            written += 1
+            if progress:
+                progress(written, total)
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for strip in block_strips(dst, warp_mem_limit * 1024 * 1024):
+                future = executor.submit(cpu_accounted(lambda strip=strip: read_strip(open_source(), strip, band_ranges)))
+                pending.append((strip, future))
+                if len(pending) >= in_flight:
+                    flush(*pending.popleft())
+            while pending:
+                flush(*pending.popleft())
+    finally:
+        for handle in handles:
+            handle.close()
+
+def build_output_profile(src, count, width, height, transform, dst_crs, photometric, block_size=512,
+                         compress="jpeg"):
     profile = src.profile.copy()
     profile.update({
         "driver": "GTiff",
         "dtype": "uint8",
         "nodata": None,
         "count": count,
-        "compress": "jpeg",
+        "compress": compress,
         "photometric": photometric,
         "tiled": True,
-        "blockxsize": 512,
-        "blockysize": 512,
+        "blockxsize": block_size,
+        "blockysize": block_size,
         "interleave": "pixel",
         "crs": dst_crs,
         "transform": transform,
@@ -1,60 +1,109 @@
 import os
+import uuid
+import tempfile
 from werkzeug.utils import secure_filename
 from flask import current_app, flash
 from .exceptions.custom_exceptions import ValidationError
 import rasterio
-from pyproj import Transformer
+from .crs import transform_bounds
+from .dedup import content_hasher, file_digest
+from .metrics import timed_stage, processed_bytes
 
-def validate_file(file, config, original_filename_from_form):
-    """Waliduje plik wejściowy."""
-    if file and file.filename != '':
-        file.seek(0, os.SEEK_END)
-        file_length = file.tell()
-        file.seek(0)
+def save_stream(stream, filepath, chunk_size=1024 * 1024, fsync=False, max_size=None):
+    """
+    Zapisuje strumień na dysk kawałkami po `chunk_size` bajtów, więc zużycie
+    pamięci nie zależy od rozmiaru pliku. Dane trafiają do pliku tymczasowego
+    w katalogu docelowym i są atomowo przenoszone pod `filepath`.
+    Skrót treści (BLAKE2) liczony jest w trakcie zapisu, bez ponownego czytania pliku.
+    Zwraca (liczba zapisanych bajtów, skrót treści).
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload_')
+    written = 0
+    digest = content_hasher()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if max_size is not None and written > max_size:
+                    raise ValidationError(f"Błąd: Plik jest za duży. Maksymalny rozmiar to {max_size // (1024 * 1024)} MB.")
+                digest.update(chunk)
+                f.write(chunk)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written, digest.hexdigest()
 
-        if file_length > 100 * 1024 * 1024:  # 100 MB
-            raise ValidationError("Błąd: Plik jest za duży. Maksymalny rozmiar to 100 MB.")
+def save_upload(stream, filepath, config, max_size_mb=None):
+    """
+    Zapisuje strumień uploadu z parametrami z konfiguracji aplikacji. Limit
+    rozmiaru to `max_size_mb`, domyślnie `MAX_UPLOAD_SIZE_MB`.
+    """
+    if max_size_mb is None:
+        max_size_mb = config['MAX_UPLOAD_SIZE_MB']
+    with timed_stage('save'):
+        written, content_hash = save_stream(stream, filepath,
+                                            chunk_size=config['UPLOAD_CHUNK_SIZE'],
+                                            fsync=config['UPLOAD_FSYNC'],
+                                            max_size=max_size_mb * 1024 * 1024)
+    processed_bytes.inc(written, stage='save')
+    return written, content_hash
 
-        filename = secure_filename(file.filename)
+def validate_file(file, config, original_filename_from_form):
+    """
+    Waliduje plik wejściowy. Zwraca (nazwa pliku, ścieżka, skrót treści).
+    Każdy upload dostaje własną nazwę `upload_<token>_<nazwa>`, bo plik jest
+    publikowany później w tle - kolejny upload o tej samej nazwie nie może go
+    nadpisać. Ta nazwa wraca w formularzu przy ponownym wysłaniu z kodem EPSG.
+    """
+    if file and file.filename != '':
+        filename = f"upload_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}"
         filepath = os.path.join(config['UPLOAD_FOLDER'], filename)
         current_app.logger.info(f"Zapisywanie nowego pliku '{filename}' do '{filepath}'")
-        file.save(filepath)
-        return filename, filepath
+        _, content_hash = save_upload(file.stream, filepath, config)
+        return filename, filepath, content_hash
 
     elif original_filename_from_form:
-        filename = original_filename_from_form
+        filename = secure_filename(original_filename_from_form)
         filepath = os.path.join(config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(filepath):
             raise ValidationError("Błąd: Oryginalny plik nie został znaleziony.")
-        return filename, filepath
+        return filename, filepath, file_digest(filepath, config['UPLOAD_CHUNK_SIZE'])
 
     else:
         raise ValidationError("Błąd: Nazwa warstwy i plik są wymagane.")
 
 def validate_geotiff_and_get_bbox(filepath, epsg_code_str):
     """Waliduje plik GeoTIFF, jego CRS i zwraca BBOX w EPSG:3857."""
-    try:
-        with rasterio.open(filepath) as dataset:
-            source_crs = dataset.crs
-            source_bounds = dataset.bounds
-
-            if not source_crs and not epsg_code_str:
-                raise ValidationError("Plik nie ma zdefiniowanego CRS. Proszę podać kod EPSG.")
-
-            if epsg_code_str:
-                try:
-                    source_crs = rasterio.crs.CRS.from_epsg(int(epsg_code_str))
-                except ValueError:
-                    raise ValidationError("Nieprawidłowy kod EPSG.")
-
-            if not source_crs:
-                raise ValidationError("Nie udało się określić CRS.")
-
-            transformer = Transformer.from_crs(source_crs, "EPSG:3857", always_xy=True)
-            minx_3857, miny_3857 = transformer.transform(source_bounds.left, source_bounds.bottom)
-            maxx_3857, maxy_3857 = transformer.transform(source_bounds.right, source_bounds.top)
-            bbox_epsg3857 = f"{minx_3857},{miny_3857},{maxx_3857},{maxy_3857}"
-
-            return source_crs, bbox_epsg3857
-    except rasterio.errors.RasterioIOError:
-        raise ValidationError("Nieprawidłowy format pliku. Oczekiwano GeoTIFF.")
+    with timed_stage('validate'):
+        try:
+            with rasterio.open(filepath) as dataset:
+                source_crs = dataset.crs
+                source_bounds = dataset.bounds
+
+                if not source_crs and not epsg_code_str:
+                    raise ValidationError("Plik nie ma zdefiniowanego CRS. Proszę podać kod EPSG.")
+
+                if epsg_code_str:
+                    try:
+                        source_crs = rasterio.crs.CRS.from_epsg(int(epsg_code_str))
+                    except ValueError:
+                        raise ValidationError("Nieprawidłowy kod EPSG.")
+
+                if not source_crs:
+                    raise ValidationError("Nie udało się określić CRS.")
+
+                minx_3857, miny_3857, maxx_3857, maxy_3857 = transform_bounds(source_bounds, source_crs, "EPSG:3857")
+                bbox_epsg3857 = f"{minx_3857},{miny_3857},{maxx_3857},{maxy_3857}"
+
+                return source_crs, bbox_epsg3857
+        except rasterio.errors.RasterioIOError:
+            raise ValidationError("Nieprawidłowy format pliku. Oczekiwano GeoTIFF.")
@@ -0,0 +1,241 @@
+import math
+import time
+import threading
+
+from flask import current_app
+
+from .clients import get_geoserver_session
+from .tiles import ORIGIN
+from .tile_cache import tile_cache, tile_etag, wms_layer
+
+# Formaty GetMap zapisywane w pamięci kafli (rozszerzenie pliku w magazynie).
+CACHEABLE_FORMATS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+WEB_MERCATOR = ('EPSG:3857', 'EPSG:900913')
+# Tolerancja dopasowania BBOX do siatki kafli - ułamek rozmiaru kafla.
+GRID_TOLERANCE = 0.01
+# Parametry GetMap, które nie zmieniają obrazu poza kluczem kafla (warstwa, format,
+# z/x/y, rozmiar). Zapytania z innymi parametrami (TIME, CQL_FILTER, SLD, ENV...) nie są cache'owane.
+CACHEABLE_PARAMS = {'SERVICE', 'REQUEST', 'VERSION', 'LAYERS', 'STYLES', 'FORMAT', 'TRANSPARENT',
+                    'CRS', 'SRS', 'BBOX', 'WIDTH', 'HEIGHT'}
+# W EPSG:3857 obie wersje mają kolejność osi x/y, więc dają ten sam obraz.
+CACHEABLE_VERSIONS = ('1.1.1', '1.3.0')
+# Wersje GetCapabilities trzymane w pamięci (inne przechodzą do GeoServera bez cache).
+CAPABILITIES_VERSIONS = ('1.1.0', '1.1.1', '1.3.0')
+
+class UpstreamError(Exception):
+    """Odpowiedź GeoServera, której nie zapisujemy w pamięci (np. ServiceException)."""
+
+    def __init__(self, status_code, content_type, body):
+        super().__init__(f"GeoServer WMS: status {status_code}")
+        self.status_code = status_code
+        self.content_type = content_type
+        self.body = body
+
+class RequestCoalescer:
+    """
+    Scala równoczesne identyczne zapytania: pierwsze wykonuje `fetch()`,
+    pozostałe czekają na jego wynik (lub wyjątek) zamiast pytać GeoServer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._counters = {'upstream': 0, 'coalesced': 0}
+
+    def do(self, key, fetch):
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._inflight[key] = call
+                self._counters['upstream'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fetch()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call['event'].set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, inflight=len(self._inflight))
+
+def normalise_params(args):
+    """Nazwy parametrów WMS wielkimi literami, wartości bez zbędnych spacji; stała kolejność."""
+    params = {key.upper(): value.strip() for key, value in args.items()}
+    if params.get('REQUEST', '').lower() == 'getmap':
+        params['REQUEST'] = 'GetMap'
+        params['SERVICE'] = 'WMS'
+        params['VERSION'] = params.get('VERSION', '1.3.0')
+        params['STYLES'] = params.get('STYLES', '')
+        params['FORMAT'] = params.get('FORMAT', 'image/png').lower()
+        params['TRANSPARENT'] = params.get('TRANSPARENT', 'FALSE').upper()
+        crs_param = 'SRS' if params['VERSION'] == '1.1.1' else 'CRS'
+        params[crs_param] = params.get(crs_param, '').upper()
+    return dict(sorted(params.items()))
+
+def snap_to_grid(params):
+    """
+    Dopasowuje BBOX zapytania GetMap w EPSG:3857 do siatki kafli XYZ.
+    Zwraca (z, x, y, rozmiar kafla, BBOX dokładnego zasięgu kafla) albo None,
+    gdy zapytanie nie odpowiada kaflowi. Nie zmienia `params`.
+    """
+    crs = params.get('CRS') or params.get('SRS')
+    if crs not in WEB_MERCATOR:
+        return None
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in params['BBOX'].split(','))
+        width, height = int(params['WIDTH']), int(params['HEIGHT'])
+    except (KeyError, ValueError):
+        return None
+    if width != height or width not in (256, 512) or maxx <= minx:
+        return None
+
+    z = round(math.log2(2 * ORIGIN / (maxx - minx)))
+    if not 0 <= z <= 24:
+        return None
+    size = 2 * ORIGIN / 2 ** z
+    x = round((minx + ORIGIN) / size)
+    y = round((ORIGIN - maxy) / size)
+    tile_minx, tile_maxy = -ORIGIN + x * size, ORIGIN - y * size
+    tolerance = size * GRID_TOLERANCE
+    if (abs(minx - tile_minx) > tolerance or abs(maxy - tile_maxy) > tolerance or
+            abs(maxx - (tile_minx + size)) > tolerance or abs(miny - (tile_maxy - size)) > tolerance):
+        return None
+
+    bbox = f"{tile_minx!r},{tile_maxy - size!r},{tile_minx + size!r},{tile_maxy!r}"
+    return z, x, y, width, bbox
+
+def _cache_layer(params, workspace):
+    """
+    Nazwa warstwy w pamięci kafli - tylko dla pojedynczej warstwy ze stylem
+    domyślnym, żeby `tile_cache.purge(wms_layer(...))` po publikacji obejmował wszystkie wpisy,
+    i tylko bez parametrów spoza `CACHEABLE_PARAMS`.
+    """
+    if not CACHEABLE_PARAMS.issuperset(params) or params.get('VERSION') not in CACHEABLE_VERSIONS:
+        return None
+    layers = params.get('LAYERS', '')
+    if not layers or ',' in layers or params.get('STYLES'):
+        return None
+    fmt = CACHEABLE_FORMATS.get(params.get('FORMAT'))
+    if fmt is None or (fmt != 'jpg' and params.get('TRANSPARENT') != 'TRUE'):
+        return None
+    prefix, _, name = layers.rpartition(':')
+    if prefix and prefix != workspace:
+        return None
+    return wms_layer(workspace, name), fmt
+
+class WMSProxy:
+    """
+    Pośrednik WMS przed GeoServerem.
+
+    - GetMap: parametry są normalizowane, a BBOX zapytań kaflowych dopasowany do siatki,
+      kafle pojedynczych warstw trafiają do `tile_cache` (purge po publikacji),
+    - GetCapabilities: jeden dokument na workspace i wersję WMS, odświeżany po `capabilities_ttl`,
+    - równoczesne identyczne zapytania są scalane w jedno zapytanie do GeoServera.
+    """
+
+    def __init__(self):
+        self.capabilities_ttl = 300
+        self.coalescer = RequestCoalescer()
+        self._capabilities = {}
+        self._lock = threading.Lock()
+        self._counters = {'getmap_cached': 0, 'getmap_passthrough': 0,
+                          'capabilities_hits': 0, 'capabilities_misses': 0}
+
+    def init_app(self, app):
+        self.capabilities_ttl = app.config['WMS_CAPABILITIES_TTL']
+        app.extensions['geouploader_wms_proxy'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _upstream_url(self, workspace):
+        return f"{current_app.config['GEOSERVER_URL'].replace('/rest', '')}/{workspace}/wms"
+
+    def _fetch(self, workspace, params):
+        response = get_geoserver_session().get(self._upstream_url(workspace), params=params)
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or ('xml' in content_type and params.get('REQUEST') == 'GetMap'):
+            raise UpstreamError(response.status_code, content_type, response.content)
+        return response.content, content_type
+
+    def get_map(self, params, workspace):
+        """Zwraca (treść, typ, ETag) dla GetMap; ETag jest None dla odpowiedzi spoza pamięci kafli."""
+        grid = snap_to_grid(params)
+        cache_layer = _cache_layer(params, workspace) if grid else None
+
+        if cache_layer is None:
+            self._count('getmap_passthrough')
+            key = tuple(params.items())
+            content, content_type = self.coalescer.do(key, lambda: self._fetch(workspace, params))
+            return content, content_type, None
+
+        self._count('getmap_cached')
+        layer, fmt = cache_layer
+        z, x, y, size, bbox = grid
+        # Do GeoServera idzie BBOX dosunięty do siatki tylko dla zapytań z pamięci kafli.
+        params = {**params, 'BBOX': bbox}
+        key = tuple(params.items())
+        content, etag = tile_cache.get(layer, z, x, y, fmt, size,
+                                       lambda: self.coalescer.do(key, lambda: self._fetch(workspace, params))[0])
+        return content, params['FORMAT'], etag
+
+    def get_capabilities(self, workspace, version=None):
+        """Zwraca (treść, typ, ETag) dokumentu GetCapabilities workspace'u w wersji `version` (domyślnie 1.3.0)."""
+        version = version or '1.3.0'
+        params = {'SERVICE': 'WMS', 'REQUEST': 'GetCapabilities', 'VERSION': version}
+        if version not in CAPABILITIES_VERSIONS:
+            # Nieznaną wersję negocjuje GeoServer - odpowiedź nie trafia do pamięci.
+            content, content_type = self._fetch(workspace, params)
+            return content, content_type, tile_etag(content)
+
+        key = (workspace, version)
+        entry = self._capabilities.get(key)
+        if entry is not None and time.monotonic() - entry['fetched_at'] < self.capabilities_ttl:
+            self._count('capabilities_hits')
+            return entry['content'], entry['content_type'], entry['etag']
+
+        self._count('capabilities_misses')
+        content, content_type = self.coalescer.do(('capabilities',) + key,
+                                                  lambda: self._fetch(workspace, params))
+        etag = tile_etag(content)
+        self._capabilities[key] = {'content': content, 'content_type': content_type,
+                                   'etag': etag, 'fetched_at': time.monotonic()}
+        return content, content_type, etag
+
+    def passthrough(self, params, workspace):
+        """Pozostałe zapytania (GetFeatureInfo, GetLegendGraphic) - tylko scalanie."""
+        content, content_type = self.coalescer.do(tuple(params.items()), lambda: self._fetch(workspace, params))
+        return content, content_type, None
+
+    def invalidate_capabilities(self, workspace=None):
+        with self._lock:
+            if workspace is None:
+                self._capabilities.clear()
+            else:
+                for key in [key for key in self._capabilities if key[0] == workspace]:
+                    del self._capabilities[key]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters.update(self.coalescer.stats())
+        return counters
+
+wms_proxy = WMSProxy()
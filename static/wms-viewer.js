@@ -17,6 +17,8 @@ class WMSLayerViewer {
         this.map = null;
         this.baseLayer = null;
         this.currentWMSLayer = null;
+        this.layerInfoCache = {};
+        this.cogSources = {};
         this.coordinateMarkers = null;
         this.measurementLayer = null;
         
@@ -122,6 +124,8 @@ class WMSLayerViewer {
             
             const data = await response.json();
             this.populateLayerSelect(data.layers);
+            this.prefetchLayerInfo();
+            this.loadCogSources();
             
         } catch (error) {
             console.error('Error loading WMS layers:', error);
@@ -149,6 +153,35 @@ class WMSLayerViewer {
         }
     }
     
+    /**
+     * Load COGs served as XYZ tiles by the application and add them to the select
+     */
+    async loadCogSources() {
+        try {
+            const response = await fetch('/geouploader/tiles/');
+            if (!response.ok) {
+                return;
+            }
+            const data = await response.json();
+            if (!data.cogs || data.cogs.length === 0) {
+                return;
+            }
+            
+            const group = document.createElement('optgroup');
+            group.label = 'COG (XYZ)';
+            data.cogs.forEach(cog => {
+                this.cogSources[cog.id] = cog;
+                const option = document.createElement('option');
+                option.value = `cog:${cog.id}`;
+                option.textContent = cog.key.split('/').pop();
+                group.appendChild(option);
+            });
+            this.elements.layerSelect.appendChild(group);
+        } catch (error) {
+            console.warn('COG sources loading failed:', error);
+        }
+    }
+    
     /**
      * Handle layer loading errors
      */
@@ -173,7 +206,11 @@ class WMSLayerViewer {
         }
         
         try {
-            await this.loadWMSLayer(selectedLayer);
+            if (selectedLayer.startsWith('cog:')) {
+                this.loadCogLayer(this.cogSources[selectedLayer.slice(4)]);
+            } else {
+                await this.loadWMSLayer(selectedLayer);
+            }
         } catch (error) {
             console.error('Error loading WMS layer:', error);
             this.showToast(`Błąd ładowania warstwy: ${selectedLayer}`, true);
@@ -206,8 +243,8 @@ class WMSLayerViewer {
             // Get layer information
             const layerInfo = await this.getLayerInfo(layerName);
             
-            // Create WMS layer
-            this.currentWMSLayer = L.tileLayer.wms(layerInfo.wms_url, {
+            // Create WMS layer (through the caching proxy when configured)
+            this.currentWMSLayer = L.tileLayer.wms(this.config.wmsProxyUrl || layerInfo.wms_url, {
                 layers: `${this.config.geoserverWorkspace}:${layerName}`,
                 format: 'image/png',
                 transparent: true,
@@ -250,10 +287,58 @@ class WMSLayerViewer {
         }
     }
     
+    /**
+     * Load a COG as an XYZ tile layer rendered by the application
+     */
+    loadCogLayer(cog) {
+        this.currentWMSLayer = L.tileLayer(cog.tiles_url, {
+            maxZoom: 22,
+            errorTileUrl: 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+        });
+        
+        this.currentWMSLayer.on('load', () => {
+            this.showToast(`Załadowano warstwę: ${cog.key}`);
+        });
+        
+        this.currentWMSLayer.on('tileerror', (e) => {
+            console.error('Tile loading error:', e);
+            this.showToast('Błąd ładowania niektórych fragmentów warstwy', true);
+        });
+        
+        this.currentWMSLayer.addTo(this.map);
+        
+        if (cog.bbox_epsg3857) {
+            this.zoomToLayerExtent(cog.bbox_epsg3857);
+        }
+        
+        this.enableLayerControls();
+        this.displayLayerInfo({ name: cog.key, abstract: 'Kafle XYZ renderowane bezpośrednio z COG', type: 'XYZ', enabled: true });
+    }
+    
+    /**
+     * Fetch information about all layers in a single batch request
+     */
+    async prefetchLayerInfo() {
+        try {
+            const response = await fetch('/api/layer-info?all=1');
+            if (!response.ok) {
+                return;
+            }
+            const data = await response.json();
+            Object.assign(this.layerInfoCache, data.layers || {});
+        } catch (error) {
+            console.warn('Layer info prefetch failed:', error);
+        }
+    }
+    
     /**
      * Get layer information from server
      */
     async getLayerInfo(layerName) {
+        if (this.layerInfoCache[layerName]) {
+            return this.layerInfoCache[layerName];
+        }
+        
         const response = await fetch(`/api/layer-info/${layerName}`);
         
         if (!response.ok) {
@@ -0,0 +1,49 @@
+import pytest
+import shapely
+
+from geoapi.flatgeobuf import encode_header, encode_feature
+
+pyogrio = pytest.importorskip('pyogrio')
+
+GEOMETRIES = {
+    'point': shapely.Point(21.0, 52.2),
+    'linestring': shapely.LineString([(0, 0), (1, 1), (2, 0)]),
+    'polygon_with_holes': shapely.Polygon(
+        [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)],
+        [[(1, 1), (2, 1), (2, 2), (1, 2), (1, 1)], [(5, 5), (6, 5), (6, 6), (5, 6), (5, 5)]]
+    ),
+    'multipolygon': shapely.MultiPolygon([
+        shapely.Polygon([(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)], [[(1, 1), (2, 1), (2, 2), (1, 2), (1, 1)]]),
+        shapely.Polygon([(10, 10), (12, 10), (12, 12), (10, 10)])
+    ]),
+    'multilinestring': shapely.MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3), (4, 2)]]),
+    'multipoint': shapely.MultiPoint([(0, 0), (1, 2), (3, 4)]),
+}
+
+def _read(tmp_path, features, epsg=4326):
+    path = tmp_path / 'export.fgb'
+    path.write_bytes(encode_header('geoms', epsg) + b''.join(encode_feature(i, g) for i, g in features))
+    meta, _, wkb, field_data = pyogrio.raw.read(path)
+    return meta, shapely.from_wkb(wkb), field_data
+
+@pytest.mark.parametrize('name', GEOMETRIES)
+def test_geometry_round_trip(tmp_path, name):
+    geom = GEOMETRIES[name]
+    meta, geoms, field_data = _read(tmp_path, [(7, geom)])
+    assert list(meta['fields']) == ['id']
+    assert field_data[0].tolist() == [7]
+    assert len(geoms) == 1
+    assert shapely.equals_exact(shapely.normalize(geoms[0]), shapely.normalize(geom))
+    assert geoms[0].geom_type == geom.geom_type
+
+def test_many_features_keep_order_and_ids(tmp_path):
+    features = [(i, geom) for i, geom in enumerate(GEOMETRIES.values(), start=1)]
+    _, geoms, field_data = _read(tmp_path, features)
+    assert field_data[0].tolist() == [i for i, _ in features]
+    for read, (_, geom) in zip(geoms, features):
+        assert shapely.equals_exact(shapely.normalize(read), shapely.normalize(geom))
+
+def test_empty_export_has_valid_header(tmp_path):
+    meta, geoms, _ = _read(tmp_path, [], epsg=2180)
+    assert len(geoms) == 0
+    assert 'EPSG:2180' in meta['crs']
@@ -0,0 +1,53 @@
+import pytest
+import shapely
+
+from geoapi.mvt import encode_mvt
+
+mapbox_vector_tile = pytest.importorskip('mapbox_vector_tile')
+
+GEOMETRIES = {
+    'point': shapely.Point(100, 200),
+    'linestring': shapely.LineString([(0, 0), (100, 100), (200, 0)]),
+    'polygon_with_holes': shapely.Polygon(
+        [(0, 0), (1000, 0), (1000, 1000), (0, 1000), (0, 0)],
+        [[(100, 100), (200, 100), (200, 200), (100, 200), (100, 100)],
+         [(500, 500), (600, 500), (600, 600), (500, 600), (500, 500)]]
+    ),
+    'multipolygon': shapely.MultiPolygon([
+        shapely.Polygon([(0, 0), (400, 0), (400, 400), (0, 400), (0, 0)],
+                        [[(100, 100), (200, 100), (200, 200), (100, 200), (100, 100)]]),
+        shapely.Polygon([(1000, 1000), (1200, 1000), (1200, 1200), (1000, 1000)])
+    ]),
+    'multilinestring': shapely.MultiLineString([[(0, 0), (100, 100)], [(200, 200), (300, 300), (400, 200)]]),
+    'multipoint': shapely.MultiPoint([(0, 0), (10, 20), (30, 40)]),
+}
+
+def _decode(tile):
+    layers = mapbox_vector_tile.decode(tile, default_options={'y_coord_down': True})
+    return layers['geoms']
+
+@pytest.mark.parametrize('name', GEOMETRIES)
+def test_geometry_round_trip(name):
+    geom = GEOMETRIES[name]
+    layer = _decode(encode_mvt('geoms', [(7, geom)], extent=4096))
+    assert layer['extent'] == 4096
+    assert len(layer['features']) == 1
+    feature = layer['features'][0]
+    assert feature['id'] == 7
+    decoded = shapely.geometry.shape(feature['geometry'])
+    assert decoded.geom_type == geom.geom_type
+    assert shapely.equals_exact(shapely.normalize(decoded), shapely.normalize(geom))
+
+def test_many_features_keep_ids():
+    features = list(enumerate(GEOMETRIES.values(), start=1))
+    layer = _decode(encode_mvt('geoms', features))
+    assert [feature['id'] for feature in layer['features']] == [i for i, _ in features]
+
+def test_empty_batch_gives_empty_tile():
+    assert encode_mvt('geoms', []) == b''
+    assert mapbox_vector_tile.decode(b'') == {}
+
+def test_degenerate_geometries_are_skipped():
+    collapsed = shapely.Polygon([(0, 0), (0.2, 0), (0.2, 0.2), (0, 0)])
+    layer = _decode(encode_mvt('geoms', [(1, collapsed), (2, shapely.Point(5, 5))]))
+    assert [feature['id'] for feature in layer['features']] == [2]